@@ -3,13 +3,14 @@ import { userModel } from "../models/userModel.js";
 import transporter from '../config/nodemailer.js';
 import jwt from 'jsonwebtoken';
 import { STORY_CREATED_TEMPLATE, STORY_UPDATED_TEMPLATE, STORY_PENDING_TEMPLATE } from '../config/emailTemplates.js';
-import { exec } from 'child_process';
+import { exec, execFile } from 'child_process';
 import { promisify } from 'util';
 import fs from 'fs';
 import path from 'path';
 import { fileURLToPath } from 'url';
 
 const execAsync = promisify(exec);
+const execFileAsync = promisify(execFile);
 const __filename = fileURLToPath(import.meta.url);
 const __dirname = path.dirname(__filename);
 
@@ -175,7 +176,7 @@ export const generateAudio = async (req, res) => {
     let tempOutputDir = null;
 
     try {
-        const { text, storyTitle, speakerName, speed } = req.body;
+        const { text, storyTitle, speakerName, speed, targetWordsPerSecond, priority } = req.body;
 
         console.log(`🎙️ Generazione audio per: "${storyTitle}" | Voce: ${speakerName} | Velocità: ${speed || 1.0}`);
         // ========================================
@@ -201,6 +202,17 @@ export const generateAudio = async (req, res) => {
         // Usa lo speakerName ricevuto dal frontend, default a voce femminile
         const speaker = speakerName || 'it-Spk0_woman';
 
+        // Il nome della voce finisce nella riga di comando di VibeVoice: solo nomi di voce veri
+        // (lettere, cifre, '_' e '-'), mai spazi o caratteri della shell
+        if (typeof speaker !== 'string' || !/^[\w-]+$/.test(speaker)) {
+            return res.status(400).json({ success: false, message: "Voce non valida." });
+        }
+
+        // Con targetWordsPerSecond l'analizzatore misura la velocità reale del parlato
+        // (parole al secondo sul testo) e sceglie da solo il fattore di stretch
+        const targetWps = Number(targetWordsPerSecond);
+        const useTargetWps = Number.isFinite(targetWps) && targetWps > 0;
+
         console.log("🎤 Richiesta generazione audio con VibeVoice:");
         console.log("   Titolo:", storyTitle);
         console.log("   Lunghezza testo:", text.length, "caratteri");
@@ -211,10 +223,13 @@ export const generateAudio = async (req, res) => {
         // CONFIGURAZIONE PATHS
         // ========================================
 
-        // Calcola percorsi relativi di default (rispetto alla cartella server/)
+        // Calcola percorsi relativi di default (rispetto alla cartella server/): gli stessi
+        // di utils/narrationQueue.py, cioè il checkout clonato da setup.py con il suo venv env1
         const serverDir = path.join(__dirname, '..');
         const defaultVibeVoicePath = path.join(serverDir, '..', 'VibeVoice');
-        const defaultPythonPath = path.join(defaultVibeVoicePath, 'env1', 'Scripts', 'python.exe');
+        const defaultPythonPath = process.platform === 'win32'
+            ? path.join(defaultVibeVoicePath, 'env1', 'Scripts', 'python.exe')
+            : path.join(defaultVibeVoicePath, 'env1', 'bin', 'python');
 
         // Usa i percorsi dal .env se presenti, altrimenti usa quelli relativi
         const vibeVoicePath = process.env.VIBEVOICE_PATH || defaultVibeVoicePath;
@@ -254,22 +269,65 @@ export const generateAudio = async (req, res) => {
         // ========================================
 
         // Costruisci il comando per eseguire VibeVoice
-        const command = `"${pythonPath}" "${scriptPath}" --model_path microsoft/VibeVoice-Realtime-0.5B --txt_path "${tempTextPath}" --speaker_name ${speaker} --output_dir "${tempOutputDir}"`;
+        // Sui server solo CPU setup.py misura i thread migliori per torch (TORCH_NUM_THREADS /
+        // TORCH_NUM_INTEROP_THREADS nel .env) e prepara un modello int8 (VIBEVOICE_QUANTIZED_MODEL):
+        // il launcher applica entrambi prima di caricare il modello
+        const intraOpThreads = process.env.TORCH_NUM_THREADS;
+        const useLauncher = Boolean(intraOpThreads || process.env.TORCH_NUM_INTEROP_THREADS
+            || process.env.VIBEVOICE_QUANTIZED_MODEL);
+        const launcherPath = path.join(__dirname, '..', 'utils', 'vibevoiceLauncher.py');
+        const launcherArg = useLauncher ? `"${launcherPath}" ` : '';
+        const command = `"${pythonPath}" ${launcherArg}"${scriptPath}" --model_path microsoft/VibeVoice-Realtime-0.5B --txt_path "${tempTextPath}" --speaker_name ${speaker} --output_dir "${tempOutputDir}"`;
 
         console.log("⏳ Esecuzione VibeVoice...");
         console.log("   Voce:", speaker);
         console.log("   Questo potrebbe richiedere 1-2 minuti...");
 
-        // Esegui VibeVoice
-        const { stdout, stderr } = await execAsync(command, {
-            maxBuffer: 50 * 1024 * 1024, // 50MB buffer
-            timeout: 900000, // 15 minuti timeout
-            cwd: vibeVoicePath // Esegui dalla cartella VibeVoice
-        });
+        // Velocità già applicata dalla coda al WAV ricevuto (1.0 = nessuna)
+        let queuedSpeed = 1.0;
+        if (process.env.NARRATION_QUEUE === 'true') {
+            // Coda condivisa (utils/narrationQueue.py serve): al massimo N VibeVoice girano
+            // insieme e le richieste identiche in corso vengono unite in un solo job
+            // La sintesi è condivisa tra richieste con stesso testo e voce: la velocità viene
+            // applicata dalla coda a ogni richiesta (con targetWordsPerSecond la sceglie l'analizzatore)
+            const queueScript = path.join(__dirname, '..', 'utils', 'narrationQueue.py');
+            queuedSpeed = useTargetWps ? 1.0 : (Number(speed) || 1.0);
+            // Argomenti come argv, senza shell
+            const { stdout: submitted } = await execFileAsync(pythonPath, [
+                queueScript, 'submit', '--text-file', tempTextPath, '--speaker', speaker,
+                '--speed', String(queuedSpeed), '--priority', String(parseInt(priority, 10) || 0)
+            ], { encoding: 'utf8' });
+            const job = JSON.parse(submitted);
+            if (job.error) throw new Error(`Coda narrazioni: ${job.error}`);
+            console.log(`📥 Job ${job.id} in coda${job.deduped ? ' (unito a una richiesta identica)' : ''}`);
+
+            // 15 minuti al massimo in attesa di un worker; mentre un worker lo esegue il job
+            // è già limitato dal timeout di VibeVoice, quindi qui non serve un timeout
+            const { stdout: finished } = await execFileAsync(pythonPath, [
+                queueScript, 'status', String(job.id), '--wait', '900'
+            ], { encoding: 'utf8' });
+            const status = JSON.parse(finished);
+            if (status.status !== 'done') {
+                throw new Error(`Job ${job.id}: ${status.error || status.status}`);
+            }
+            // Il WAV del job può servire anche ad altre richieste unite: si copia, non si sposta
+            fs.copyFileSync(status.result.path, path.join(tempOutputDir, path.basename(status.result.path)));
+        } else {
+            // Esegui VibeVoice
+            const { stdout, stderr } = await execAsync(command, {
+                maxBuffer: 50 * 1024 * 1024, // 50MB buffer
+                timeout: 900000, // 15 minuti timeout
+                cwd: vibeVoicePath, // Esegui dalla cartella VibeVoice
+                // Anche i pool OpenMP/MKL usano lo stesso numero di thread di torch
+                env: intraOpThreads
+                    ? { ...process.env, OMP_NUM_THREADS: intraOpThreads, MKL_NUM_THREADS: intraOpThreads }
+                    : process.env
+            });
 
-        // Log output Python (per debug)
-        if (stderr) console.log("📋 VibeVoice stderr:", stderr);
-        if (stdout) console.log("📋 VibeVoice stdout:", stdout);
+            // Log output Python (per debug)
+            if (stderr) console.log("📋 VibeVoice stderr:", stderr);
+            if (stdout) console.log("📋 VibeVoice stdout:", stdout);
+        }
 
         // ========================================
         // TROVA E SALVA PERMANENTEMENTE
@@ -313,26 +371,25 @@ export const generateAudio = async (req, res) => {
             throw new Error(`File sorgente non trovato: ${audioFilePath}`);
         }
 
-        // Sposta il file (Copia + Elimina è più affidabile di renameSync su Windows)
-        try {
-            fs.copyFileSync(audioFilePath, finalFilePath);
-            fs.unlinkSync(audioFilePath);
-            console.log("✅ Audio spostato con successo via Copy+Unlink");
-        } catch (moveErr) {
-            console.warn("⚠️ Fallimento Copy+Unlink, provo renameSync tradizionale:", moveErr.message);
-            fs.renameSync(audioFilePath, finalFilePath);
-        }
-
-        console.log("✅ Audio salvato permanentemente!");
-
-        // --- ANALISI AUDIO PER SINCRONIZZAZIONE (KARAOKE) ---
+        // --- SALVATAGGIO + ANALISI AUDIO PER SINCRONIZZAZIONE (KARAOKE) ---
+        // L'analizzatore legge il file di VibeVoice una sola volta e scrive il file finale
+        // (già stretchato) direttamente in uploads/audio con un rename atomico:
+        // niente più Copy+Unlink seguito da una seconda riscrittura.
         let syncData = null;
+        const analyzerScript = path.join(__dirname, '..', 'utils', 'audioAnalyzer.py');
+        // Il WAV della coda è già alla velocità richiesta: non va stretchato una seconda volta
+        const targetSpeed = queuedSpeed !== 1.0 ? 1.0 : (speed || 1.0);
+        const rateArgs = useTargetWps ? ` --target-wps ${targetWps}` : '';
+        // VAD sull'inviluppo da ~1ms: a velocità 1.0 il file viene letto e copiato in un solo passaggio
+        // (confini entro una finestra da 20ms rispetto all'analisi completa)
         try {
             console.log("🔍 Analisi audio per sincronizzazione...");
-            const analyzerScript = path.join(__dirname, '..', 'utils', 'audioAnalyzer.py');
-            const targetSpeed = speed || 1.0;
-            const analysisResult = execSync(`"${pythonPath}" "${analyzerScript}" "${finalFilePath}" ${targetSpeed}`, { encoding: 'utf8' });
+            const { stdout: analysisResult } = await execAsync(
+                `"${pythonPath}" "${analyzerScript}" "${audioFilePath}" ${targetSpeed} --output "${finalFilePath}" --text-file "${tempTextPath}" --vad fast${rateArgs}`,
+                { encoding: 'utf8', maxBuffer: 10 * 1024 * 1024 }
+            );
             syncData = JSON.parse(analysisResult);
+            if (queuedSpeed !== 1.0 && !syncData.error) syncData.speed = queuedSpeed;
             if (syncData.error) {
                 console.error("❌ Errore analisi audio:", syncData.error);
                 syncData = null;
@@ -343,6 +400,19 @@ export const generateAudio = async (req, res) => {
             console.error("❌ Fallimento analisi audio:", analysisErr.message);
         }
 
+        // Se l'analizzatore non ha prodotto il file finale, sposta quello originale
+        if (!fs.existsSync(finalFilePath)) {
+            console.warn("⚠️ File finale non prodotto dall'analizzatore, sposto l'originale");
+            try {
+                fs.renameSync(audioFilePath, finalFilePath);
+            } catch (moveErr) {
+                fs.copyFileSync(audioFilePath, finalFilePath);
+                fs.unlinkSync(audioFilePath);
+            }
+        }
+
+        console.log("✅ Audio salvato permanentemente!");
+
         // Crea URL pubblico
         const protocol = req.protocol;
         const host = req.get('host');
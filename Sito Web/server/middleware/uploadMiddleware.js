@@ -1,5 +1,9 @@
 import multer from 'multer';
 import path from 'path';
+import { execFile } from 'child_process';
+import { fileURLToPath } from 'url';
+
+const __dirname = path.dirname(fileURLToPath(import.meta.url));
 
 // Configurazione di dove salvare i file
 const storage = multer.diskStorage({
@@ -22,4 +26,55 @@ const fileFilter = (req, file, cb) => {
     }
 };
 
-export const upload = multer({ storage: storage, fileFilter: fileFilter });
\ No newline at end of file
+export const upload = multer({ storage: storage, fileFilter: fileFilter });
+// ========================================
+// VARIANTI IMMAGINI (utils/imagePipeline.py)
+// ========================================
+
+// Dopo ogni upload con immagini rigenera le varianti ridimensionate in uploads/variants/
+// (servite da express.static insieme a uploads/, indice in uploads/variants/index.json).
+// Gira in background: la risposta non aspetta l'encoding. Una sola esecuzione alla volta,
+// gli upload arrivati nel frattempo vengono coperti da un solo giro successivo
+const imagePipelineScript = path.join(__dirname, '..', 'utils', 'imagePipeline.py');
+let pipelineRunning = false;
+let pipelinePending = false;
+
+const runImagePipeline = () => {
+    if (pipelineRunning) {
+        pipelinePending = true;
+        return;
+    }
+    pipelineRunning = true;
+    pipelinePending = false;
+    // Stesso Python di VibeVoice (PYTHON_VENV_PATH scritto da setup.py), serve Pillow
+    const pythonPath = process.env.PYTHON_VENV_PATH || (process.platform === 'win32' ? 'python' : 'python3');
+    // Argomenti come argv, senza shell; la cartella è quella in cui multer salva
+    execFile(pythonPath, [imagePipelineScript, '--uploads-dir', path.resolve('uploads')], { encoding: 'utf8' },
+        (error, stdout) => {
+            pipelineRunning = false;
+            if (error) {
+                console.warn('⚠️ Varianti immagini non generate:', error.message);
+            } else {
+                try {
+                    const report = JSON.parse(stdout);
+                    if (report.error) {
+                        console.warn('⚠️ Varianti immagini non generate:', report.error);
+                    } else if (report.encoded) {
+                        console.log(`🖼️ Varianti generate per ${report.processed} immagini`);
+                    }
+                } catch {
+                    console.warn('⚠️ Risposta non valida da imagePipeline.py');
+                }
+            }
+            if (pipelinePending) runImagePipeline();
+        });
+};
+
+// Da mettere dopo upload.any() / upload.single(): non blocca mai la richiesta
+export const optimizeUploadedImages = (req, res, next) => {
+    const files = req.files || (req.file ? [req.file] : []);
+    if (files.some(file => file.mimetype.startsWith('image/'))) {
+        runImagePipeline();
+    }
+    next();
+};
@@ -13,7 +13,7 @@ import {
     generateAudio
 } from '../controller/storyController.js';
 import { userAuth } from '../middleware/userAuth.js';
-import { upload } from '../middleware/uploadMiddleware.js';
+import { upload, optimizeUploadedImages } from '../middleware/uploadMiddleware.js';
 
 const storyRouter = express.Router();
 
@@ -22,7 +22,7 @@ const storyRouter = express.Router();
 // DEVONO VENIRE PRIMA DI /:id
 // ========================================
 
-storyRouter.post('/create', userAuth, upload.any(), createStory);
+storyRouter.post('/create', userAuth, upload.any(), optimizeUploadedImages, createStory);
 storyRouter.get('/all', getAllStories);
 storyRouter.get('/my-stories', userAuth, getUserStories);
 storyRouter.post('/generate-audio', userAuth, generateAudio);
@@ -38,7 +38,7 @@ storyRouter.post('/assign-to-children', userAuth, assignStoryToChildren);
 // ROTTE CON PARAMETRI (update, delete)
 // ========================================
 
-storyRouter.put('/update/:id', userAuth, upload.any(), updateStory);
+storyRouter.put('/update/:id', userAuth, upload.any(), optimizeUploadedImages, updateStory);
 storyRouter.delete('/delete/:id', userAuth, deleteStory);
 
 // ========================================
@@ -1,6 +1,6 @@
 import express from "express";
 import { userAuth } from "../middleware/userAuth.js";
-import { upload } from "../middleware/uploadMiddleware.js";
+import { upload, optimizeUploadedImages } from "../middleware/uploadMiddleware.js";
 import {
     getUserData,
     logoutChild,
@@ -27,11 +27,11 @@ userRouter.post('/request-delete-otp', userAuth, requestDeleteOtp);
 userRouter.post('/verify-delete', userAuth, verifyDeleteAndDelete);
 
 // Child profiles routes
-userRouter.post('/add-child', userAuth, upload.single('avatar'), addChild);
+userRouter.post('/add-child', userAuth, upload.single('avatar'), optimizeUploadedImages, addChild);
 userRouter.get('/children', userAuth, getChildren);
 userRouter.post('/switch-child/:childId', userAuth, switchToChild);
 userRouter.post('/logout-child', logoutChild);
-userRouter.put('/edit-child/:childId', userAuth, upload.single('avatar'), editChild);
+userRouter.put('/edit-child/:childId', userAuth, upload.single('avatar'), optimizeUploadedImages, editChild);
 userRouter.delete('/delete-child/:childId', userAuth, deleteChild);
 
 // Therapist routes
@@ -1,161 +1,1929 @@
-import wave
 import numpy as np
 import sys
 import json
 import os
+import re
+import time
+import tempfile
+import argparse
+import struct
+import subprocess
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+# Optional JIT backend for the OLA, energy and silence loops (pip install numba)
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Same fields as wave.Wave_read.getparams(); comptype is 'NONE' for integer PCM
+# and 'FLOAT' for IEEE float samples
+WavParams = namedtuple('WavParams', 'nchannels sampwidth framerate nframes comptype compname')
+
+# RIFF/WAVE format tags
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Bytes per read when skipping chunks (works on pipes, which cannot seek)
+SKIP_CHUNK_BYTES = 1 << 16
+
+# Frames per write call when streaming the final file to disk
+WRITE_CHUNK_FRAMES = 65536
+
+# Shortest delivery segment: cuts happen at the first silence after this many seconds
+SEGMENT_MIN_SECONDS = 4.0
+
+# Anti-alias filter of the polyphase resampler: Kaiser beta and taps per side
+# (times max(up, down)), the same design scipy's resample_poly uses by default
+RESAMPLE_KAISER_BETA = 5.0
+RESAMPLE_HALF_TAPS = 10
+
+# Output samples computed per block by the resampler's gather path
+RESAMPLE_BLOCK = 1 << 15
+
+# Up to this many phases (e.g. 16k <-> 24k, 48k -> 16k) each phase is one np.convolve
+RESAMPLE_CONVOLVE_MAX_UP = 8
+
+# Input samples handled per block by the OLA kernel (bounds the frame matrix size)
+OLA_BLOCK_SAMPLES = 1 << 16
+
+# Input samples per task when one narration is split across a process pool
+# (~44s at 24 kHz: many more tasks than workers, so stragglers even out)
+PARALLEL_CHUNK_SAMPLES = 1 << 20
+
+# Target length of one fast-VAD envelope block (~1ms); the actual block is the
+# closest divisor of the 20ms analysis window
+ENVELOPE_BLOCK_SECONDS = 0.001
+
+# Frames read per step by the streaming envelope pass
+ENVELOPE_CHUNK_FRAMES = 1 << 18
+
+# Frames per step of the envelope pass over a memory-mapped file: the working
+# buffers stay in L2 cache between the abs, the cast and the block sums
+MAPPED_CHUNK_FRAMES = 1 << 16
+
+# Voice activity detection paths: full-resolution windows or decimated envelope
+VAD_MODES = ("full", "fast")
+
+# Prosody: pitch search range (speech F0), normalized autocorrelation peak
+# needed to call a frame voiced, and speech windows per batched FFT call (about
+# 5 s, so the spectra of a batch stay in cache). Pitch is
+# measured on two VAD windows (40ms) centered on each one: three periods of
+# the lowest pitch, where a single 20ms window holds barely one
+PITCH_MIN_HZ = 75.0
+PITCH_MAX_HZ = 400.0
+PITCH_FRAME_WINDOWS = 2
+VOICING_THRESHOLD = 0.3
+PROSODY_BLOCK_FRAMES = 256
+
+# The shortest-lag autocorrelation peak at least this close to the strongest
+# one is the period; longer ones are its multiples (octave errors)
+PITCH_OCTAVE_RATIO = 0.9
+
+# The autocorrelation for pitch is taken on the spectrum below half this rate
+# (the harmonics that carry F0), at a power-of-two fraction of the framerate
+PITCH_AUTOCORR_RATE = 8000
+
+# Speech rate: words (letters, elisions like "l'albero" count once) and vowel
+# groups, which approximate Italian syllable nuclei (diphthongs count once)
+WORD_RE = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+VOWEL_GROUP_RE = re.compile(r"[aeiouyàáâèéêìíîòóôùúû]+", re.IGNORECASE)
+
+# Stretch factors a target-rate run may pick (OLA quality degrades beyond)
+TARGET_SPEED_MIN = 0.5
+TARGET_SPEED_MAX = 2.0
+
+# Audio sprites: silence between clips, and how far a paragraph boundary
+# estimated from the text may move to snap onto a detected pause
+SPRITE_GAP_SECONDS = 0.1
+SPRITE_SNAP_SECONDS = 1.0
+
+# Environment variable that selects the kernel backend: "numba" (the default
+# when it is installed) or "numpy"
+KERNELS_ENV = "AUDIO_KERNELS"
+KERNEL_BACKENDS = ("numpy", "numba")
+
+# ========================================
+# JIT KERNELS (optional Numba backend, NumPy fallback)
+# ========================================
+
+def kernel_backend():
+    """Backend used by the OLA, energy and silence kernels: 'numba' or 'numpy'"""
+    requested = os.environ.get(KERNELS_ENV, "").strip().lower()
+    if numba is None or requested == "numpy":
+        return "numpy"
+    return "numba"
+
+def use_kernels(backend):
+    """Pin the kernel backend for this process and the workers it starts"""
+    if backend not in KERNEL_BACKENDS:
+        raise ValueError(f"Unknown kernel backend '{backend}'")
+    if backend == "numba" and numba is None:
+        raise ValueError("Numba is not installed")
+    os.environ[KERNELS_ENV] = backend
+
+def kernel_info():
+    return {"backend": kernel_backend(), "numba": numba.__version__ if numba is not None else None}
+
+def jit(func):
+    """Compile with Numba when available (lazily, on first call, cached on disk); plain Python otherwise"""
+    return numba.njit(cache=True)(func) if numba is not None else func
+
+# The kernels below repeat the NumPy expressions operation by operation, in the
+# same order and precision, so both backends give bit-identical results
+
+@jit
+def ola_kernel(data, output, window, target_hop, hop_size, k0, k1):
+    """Frame-by-frame OLA of frames k0..k1-1 (see overlap_add for the summation order)"""
+    window_size = 2 * hop_size
+    for k in range(k0, k1):
+        src = k * target_hop
+        dst = k * hop_size
+        for m in range(window_size):
+            # float32 sample * float64 window, summed in float64 and stored as float32
+            output[dst + m] = output[dst + m] + data[src + m] * window[m]
+
+@jit
+def pairwise_block(values, start, n):
+    """float32 sum of at most 128 values, as NumPy's pairwise sum does a leaf block"""
+    if n < 8:
+        res = np.float32(0.0)
+        for i in range(n):
+            res = res + values[start + i]
+        return res
+    r = values[start:start + 8].copy()
+    i = 8
+    while i < n - n % 8:
+        for j in range(8):
+            r[j] = r[j] + values[start + i + j]
+        i += 8
+    res = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]))
+    while i < n:
+        res = res + values[start + i]
+        i += 1
+    return res
+
+@jit
+def pairwise_sum(values, start, n):
+    """float32 sum with NumPy's pairwise scheme (8 accumulators, blocks of 128).
+
+    NumPy halves the range (rounded to a multiple of 8) until it is a
+    leaf block and adds the two halves. The same tree is walked here with
+    an explicit stack, left half first, because Numba cannot cache a
+    recursive function.
+    """
+    # (start, n, halves done) per pending range; 3 entries per level are plenty for any length
+    starts = np.empty(192, dtype=np.int64)
+    sizes = np.empty(192, dtype=np.int64)
+    split = np.empty(192, dtype=np.bool_)
+    sums = np.empty(64, dtype=np.float32)
+    starts[0], sizes[0], split[0] = start, n, False
+    top, n_sums = 1, 0
+    while top > 0:
+        top -= 1
+        s, size = starts[top], sizes[top]
+        if size <= 128:
+            sums[n_sums] = pairwise_block(values, s, size)
+            n_sums += 1
+        elif split[top]:
+            # Both halves are on the sum stack: left + right, as NumPy adds them
+            sums[n_sums - 2] = sums[n_sums - 2] + sums[n_sums - 1]
+            n_sums -= 1
+        else:
+            n2 = size // 2
+            n2 -= n2 % 8
+            split[top] = True
+            starts[top + 1], sizes[top + 1], split[top + 1] = s + n2, size - n2, False
+            starts[top + 2], sizes[top + 2], split[top + 2] = s, n2, False
+            top += 3
+    return sums[0]
+
+@jit
+def energy_kernel(mono_data, max_val, window_size, n_windows):
+    """window_energies for float32 samples; `max_val` is passed as float32"""
+    energies = np.empty(n_windows, dtype=np.float32)
+    buf = np.empty(window_size, dtype=np.float32)
+    for k in range(n_windows):
+        base = k * window_size
+        for i in range(window_size):
+            buf[i] = abs(mono_data[base + i] / max_val)
+        energies[k] = pairwise_sum(buf, 0, window_size) / np.float32(window_size)
+    return energies
+
+@jit
+def envelope_kernel(samples, n_channels, block):
+    """mapped_envelope for int16 samples: integer |channel sum| per frame, summed per block"""
+    n_blocks = len(samples) // (n_channels * block)
+    sums = np.empty(n_blocks, dtype=np.float32)
+    for b in range(n_blocks):
+        frames = samples[b * block * n_channels:(b + 1) * block * n_channels]
+        acc = np.int32(0)
+        if n_channels == 1:
+            for i in range(block):
+                acc += abs(np.int32(frames[i]))
+        else:
+            for i in range(block):
+                frame = np.int32(0)
+                for c in range(n_channels):
+                    frame += np.int32(frames[i * n_channels + c])
+                acc += abs(frame)
+        sums[b] = acc
+    return sums
+
+@jit
+def silence_kernel(is_speech):
+    """Start/end window of every silence run closed by speech (a trailing run is not a pause)"""
+    starts = np.empty(len(is_speech), dtype=np.int64)
+    ends = np.empty(len(is_speech), dtype=np.int64)
+    count = 0
+    silence_start = -1
+    for i in range(len(is_speech)):
+        if not is_speech[i]:
+            if silence_start == -1:
+                silence_start = i
+        elif silence_start != -1:
+            starts[count] = silence_start
+            ends[count] = i
+            count += 1
+            silence_start = -1
+    return starts[:count], ends[:count]
+
+def silence_runs(is_speech):
+    """(starts, ends) window indices of the silence runs that end in speech"""
+    if kernel_backend() == "numba":
+        return silence_kernel(is_speech)
+    previous = np.concatenate(([True], is_speech[:-1]))
+    starts = np.flatnonzero(previous & ~is_speech)
+    ends = np.flatnonzero(~previous & is_speech)
+    return starts[:len(ends)], ends
+
+def ola_frames(data, output, window, target_hop, hop_size, k0, k1):
+    """Window frames k0..k1-1 of `data` and overlap-add them into `output`"""
+    if kernel_backend() == "numba":
+        ola_kernel(data, output, window, target_hop, hop_size, k0, k1)
+        return
+    offsets = np.arange(hop_size * 2)
+    frames = data[(np.arange(k0, k1) * target_hop)[:, None] + offsets] * window
+    overlap_add(output, frames, k0, hop_size)
 
 def stretch_audio(data, rate, framerate):
     """Simple OLA (Overlap-Add) for time-stretching without changing pitch"""
     if rate == 1.0:
         return data
-        
+    return stretch_many(data, [rate], framerate)[rate]
+
+def stretch_many(data, rates, framerate, pool=None):
+    """OLA time-stretch of one signal to several rates in a single pass.
+
+    Analysis frames (2 x 20ms, Hann window) start every int(hop * rate)
+    input samples. Window, frame offsets and the input walk are shared by
+    all rates; output is sample-identical to running the rates one at a time.
+    With a process `pool` each rate is split across workers instead
+    (see parallel_overlap_add), with the same result.
+    """
     # Parameters for OLA
     hop_size = int(framerate * 0.02) # 20ms
     window_size = hop_size * 2
-    
-    # Target hop size for the output
-    target_hop = int(hop_size * rate)
-    
-    if target_hop == 0: target_hop = 1
-    
+
     # Window function
     window = np.hanning(window_size)
-    
-    # Calculate output length
-    output_len = int(len(data) / rate) + window_size
-    output = np.zeros(output_len, dtype=np.float32)
-    
-    input_ptr = 0
-    output_ptr = 0
-    
-    while input_ptr + window_size < len(data):
-        # Extract frame
-        frame = data[input_ptr:input_ptr + window_size] * window
-        
-        # Add to output
-        if output_ptr + window_size < output_len:
-            output[output_ptr:output_ptr + window_size] += frame
-        
-        # Advance pointers
-        input_ptr += target_hop
-        output_ptr += hop_size
-        
-    return output
-
-def analyze_audio(wav_path, speed=1.0):
+
+    outputs = {}
+    plans = []
+    for rate in rates:
+        if rate == 1.0:
+            outputs[rate] = data
+            continue
+
+        # Target hop size for the output
+        target_hop = max(int(hop_size * rate), 1)
+
+        # Calculate output length
+        output_len = int(len(data) / rate) + window_size
+        output = np.zeros(output_len, dtype=np.float32)
+        outputs[rate] = output
+
+        # Frames start at k * target_hop while the whole window fits in the input,
+        # and are kept while they also fit in the output buffer
+        n_frames = (len(data) - window_size - 1) // target_hop + 1 if len(data) > window_size else 0
+        n_frames = min(n_frames, max((output_len - window_size - 1) // hop_size + 1, 0))
+        plans.append((target_hop, n_frames, output))
+
+    if pool is not None:
+        for target_hop, n_frames, output in plans:
+            parallel_overlap_add(pool, data, output, target_hop, n_frames, hop_size)
+        return outputs
+
+    # Walk the input once, block by block: every rate consumes the block while it is
+    # still hot in cache instead of streaming the whole signal again per rate
+    for block_start in range(0, len(data), OLA_BLOCK_SAMPLES):
+        block_end = block_start + OLA_BLOCK_SAMPLES
+        for target_hop, n_frames, output in plans:
+            # Frames of this rate whose start falls in the block
+            k0 = -(-block_start // target_hop)
+            k1 = min(-(-block_end // target_hop), n_frames)
+            if k1 <= k0:
+                continue
+            ola_frames(data, output, window, target_hop, hop_size, k0, k1)
+
+    return outputs
+
+def overlap_add(output, frames, first_frame, hop_size):
+    """Add windowed frames (2 hops long) at output hop `hop_size`, starting at frame `first_frame`.
+
+    Each output hop receives the tail of frame k-1 before the head of
+    frame k, the same summation order as a frame-by-frame loop.
+    """
+    count = len(frames)
+    blocks = output[first_frame * hop_size:(first_frame + count + 1) * hop_size].reshape(count + 1, hop_size)
+    blocks[1:] += frames[:, hop_size:]
+    blocks[:-1] += frames[:, :hop_size]
+
+# ========================================
+# PCM CODEC (RIFF/WAVE header + vectorized sample packing)
+# ========================================
+
+def pcm_params(n_channels, sampwidth, framerate, n_frames=0, is_float=False):
+    if is_float:
+        return WavParams(n_channels, sampwidth, framerate, n_frames, 'FLOAT', 'IEEE float')
+    return WavParams(n_channels, sampwidth, framerate, n_frames, 'NONE', 'not compressed')
+
+def is_float_format(params):
+    return params.comptype == 'FLOAT'
+
+def check_format(params):
+    if is_float_format(params):
+        if params.sampwidth not in (4, 8):
+            raise ValueError(f"Unsupported float sample width: {params.sampwidth * 8} bit")
+    elif params.sampwidth not in (1, 2, 3, 4):
+        raise ValueError(f"Unsupported PCM sample width: {params.sampwidth * 8} bit")
+    if params.nchannels < 1:
+        raise ValueError("WAV without channels")
+
+def full_scale(params):
+    """Largest positive sample value of the format, used to normalize to 0-1"""
+    if is_float_format(params):
+        return 1.0
+    return float(2 ** (8 * params.sampwidth - 1) - 1)
+
+def format_label(params):
+    if is_float_format(params):
+        return f"float{params.sampwidth * 8}"
+    return "uint8" if params.sampwidth == 1 else f"int{params.sampwidth * 8}"
+
+def decode_pcm(content, params):
+    """Frame bytes -> interleaved float32 samples in the format's own scale.
+
+    8-bit unsigned is re-centred on 0, 24-bit samples are sign-extended by
+    loading each 3-byte group into the top of an int32, float is taken
+    as-is. Everything is a whole-buffer NumPy operation. (float32 keeps 24
+    bits of mantissa, more than enough for int32 narration audio.)
+    """
+    width = params.sampwidth
+    n = len(content) // width
+    if is_float_format(params):
+        return np.frombuffer(content, dtype='<f4' if width == 4 else '<f8', count=n).astype(np.float32)
+    if width == 1:
+        return np.frombuffer(content, dtype=np.uint8, count=n).astype(np.float32) - 128
+    if width == 2:
+        return np.frombuffer(content, dtype='<i2', count=n).astype(np.float32)
+    if width == 3:
+        packed = np.zeros((n, 4), dtype=np.uint8)
+        packed[:, 1:] = np.frombuffer(content, dtype=np.uint8, count=n * 3).reshape(n, 3)
+        return (packed.view('<i4')[:, 0] >> 8).astype(np.float32)
+    return np.frombuffer(content, dtype='<i4', count=n).astype(np.float32)
+
+def encode_pcm(samples, params):
+    """Inverse of decode_pcm. Integer formats are clipped to their range, never wrapped"""
+    width = params.sampwidth
+    if is_float_format(params):
+        return np.asarray(samples, dtype='<f4' if width == 4 else '<f8').tobytes()
+    limit = full_scale(params)
+    # float64 so that int32 limits are exact before the cast
+    clipped = np.clip(np.asarray(samples, dtype=np.float64), -limit - 1, limit)
+    if width == 1:
+        return (clipped + 128).astype(np.uint8).tobytes()
+    if width == 2:
+        return clipped.astype('<i2').tobytes()
+    if width == 3:
+        return clipped.astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    return clipped.astype('<i4').tobytes()
+
+def ola_chunk(segment, target_hop, hop_size, count):
+    """Worker side of parallel_overlap_add: OLA of `count` frames of `segment` from a zero buffer.
+
+    Returns the finished output hops after the first one, plus the windowed
+    head of the first frame (float64) that still has to be added on top of
+    the previous chunk's tail.
+    """
+    window = np.hanning(hop_size * 2)
+    local = np.zeros((count + 1) * hop_size, dtype=np.float32)
+    frames_per_block = max(OLA_BLOCK_SAMPLES // target_hop, 1)
+    for f0 in range(0, count, frames_per_block):
+        ola_frames(segment, local, window, target_hop, hop_size, f0, min(f0 + frames_per_block, count))
+    return local[hop_size:], segment[:hop_size] * window[:hop_size]
+
+def parallel_overlap_add(pool, data, output, target_hop, n_frames, hop_size):
+    """Split the frames of one rate into contiguous ranges and overlap-add them in `pool`.
+
+    Each range ships its input slice plus the one-window overlap into the
+    next range. At a seam the serial kernel adds the tail of the last frame
+    before the head of the next one; stitching the ranges in order and
+    adding the returned float64 head last reproduces that sum bit for bit.
+    """
+    step = max(PARALLEL_CHUNK_SAMPLES // target_hop, 1)
+    pending = []
+    for k0 in range(0, n_frames, step):
+        k1 = min(k0 + step, n_frames)
+        segment = np.ascontiguousarray(data[k0 * target_hop:(k1 - 1) * target_hop + hop_size * 2])
+        pending.append((k0, k1, pool.submit(ola_chunk, segment, target_hop, hop_size, k1 - k0)))
+    # In order: the first hop of a range needs the previous range's tail already in place
+    for k0, k1, future in pending:
+        body, first_head = future.result()
+        output[(k0 + 1) * hop_size:(k1 + 1) * hop_size] = body
+        output[k0 * hop_size:(k0 + 1) * hop_size] += first_head
+
+def parse_pcm_spec(spec):
+    """Parse a headerless PCM description "rate,channels,sampwidth" (e.g. "24000,1,2").
+
+    A trailing 'f' on the sample width marks float samples ("24000,1,4f").
+    """
+    try:
+        framerate, n_channels, width = (v.strip() for v in spec.split(','))
+        is_float = width.lower().endswith('f')
+        params = pcm_params(int(n_channels), int(width.rstrip('fF')), int(framerate), is_float=is_float)
+    except ValueError:
+        raise ValueError(f"Invalid PCM spec '{spec}', expected rate,channels,sampwidth")
+    check_format(params)
+    return params
+
+def read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) < size:
+        raise ValueError("Truncated WAV header")
+    return data
+
+def skip_bytes(stream, size):
+    if stream.seekable():
+        stream.seek(size, os.SEEK_CUR)
+        return
+    while size > 0:
+        size -= len(read_exact(stream, min(size, SKIP_CHUNK_BYTES)))
+
+def read_wav_header(stream):
+    """Parse RIFF/WAVE chunks up to 'data', reading forward only.
+
+    Handles PCM, IEEE float and WAVE_FORMAT_EXTENSIBLE (sub-format taken
+    from the GUID). Returns (params, data_size); data_size is None when
+    the writer left the size open (streamed WAVs) and the data runs to EOF.
+    """
+    riff = read_exact(stream, 12)
+    if riff[:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+
+    params = None
+    while True:
+        chunk_id, size = struct.unpack('<4sI', read_exact(stream, 8))
+        if chunk_id == b'fmt ':
+            body = read_exact(stream, size + (size & 1))
+            tag, n_channels, framerate, _, block_align, bits = struct.unpack('<HHIIHH', body[:16])
+            if tag == WAVE_FORMAT_EXTENSIBLE and size >= 40:
+                tag = struct.unpack('<H', body[24:26])[0]
+            if tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+                raise ValueError(f"Unsupported WAV format tag: {tag:#06x}")
+            sampwidth = block_align // n_channels if n_channels else (bits + 7) // 8
+            params = pcm_params(n_channels, sampwidth, framerate, is_float=tag == WAVE_FORMAT_IEEE_FLOAT)
+            check_format(params)
+        elif chunk_id == b'data':
+            if params is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            if size in (0, 0xFFFFFFFF):
+                return params, None
+            return params._replace(nframes=size // (params.nchannels * params.sampwidth)), size
+        else:
+            skip_bytes(stream, size + (size & 1))
+
+def wav_header(params, n_frames):
+    """RIFF header for `n_frames` frames: PCM, or IEEE float with its fact chunk"""
+    block_align = params.nchannels * params.sampwidth
+    data_size = n_frames * block_align
+    tag = WAVE_FORMAT_IEEE_FLOAT if is_float_format(params) else WAVE_FORMAT_PCM
+    fmt = struct.pack('<HHIIHH', tag, params.nchannels, params.framerate,
+                      params.framerate * block_align, block_align, params.sampwidth * 8)
+    chunks = b''
+    if tag == WAVE_FORMAT_IEEE_FLOAT:
+        fmt += struct.pack('<H', 0)
+        chunks = b'fact' + struct.pack('<II', 4, n_frames)
+    chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt + chunks
+    riff_size = 4 + len(chunks) + 8 + data_size + (data_size & 1)
+    return b'RIFF' + struct.pack('<I', riff_size) + b'WAVE' + chunks + b'data' + struct.pack('<I', data_size)
+
+def read_source(source, pcm_spec=None):
+    """Read a WAV file, a WAV stream on stdin ('-') or raw PCM on stdin.
+
+    Returns (params, content) where params has the fields of wave getparams()
+    and content the raw little-endian frame bytes.
+    """
+    if source == '-':
+        stream = sys.stdin.buffer
+        if pcm_spec:
+            params = parse_pcm_spec(pcm_spec)
+            content = stream.read()
+            frame_size = params.nchannels * params.sampwidth
+            n_frames = len(content) // frame_size
+            return params._replace(nframes=n_frames), content[:n_frames * frame_size]
+        # The header parser only moves forward, so a pipe works as well as a file
+        return read_wav_stream(stream)
+
+    with open(source, 'rb') as f:
+        return read_wav_stream(f)
+
+def read_wav_stream(stream):
+    params, data_size = read_wav_header(stream)
+    content = stream.read() if data_size is None else stream.read(data_size)
+    frame_size = params.nchannels * params.sampwidth
+    n_frames = len(content) // frame_size
+    return params._replace(nframes=n_frames), content[:n_frames * frame_size]
+
+@contextmanager
+def open_wav_atomic(dest_path, params, n_frames):
+    """File to write the `n_frames` frames of a WAV into, published with an atomic rename.
+
+    The data goes to a temporary file in the destination directory (same
+    filesystem) and is moved over `dest_path` only once fully flushed, so a
+    reader never sees a half-written narration.
+    """
+    dest_dir = os.path.dirname(os.path.abspath(dest_path))
+    os.makedirs(dest_dir, exist_ok=True)
+    data_size = n_frames * params.nchannels * params.sampwidth
+
+    fd, tmp_path = tempfile.mkstemp(prefix='.partial_', suffix='.wav', dir=dest_dir)
     try:
-        if not os.path.exists(wav_path):
+        with os.fdopen(fd, 'wb') as f:
+            # Header is written once with the final size, no patching afterwards
+            f.write(wav_header(params, n_frames))
+            yield f
+            if f.tell() != len(wav_header(params, n_frames)) + data_size:
+                raise ValueError("Audio data is shorter than its header says")
+            if data_size & 1:
+                f.write(b'\0')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def write_wav_atomic(dest_path, params, frames_bytes):
+    """Write the final WAV in one streaming pass and publish it with an atomic rename"""
+    frame_size = params.nchannels * params.sampwidth
+    n_frames = len(frames_bytes) // frame_size
+    with open_wav_atomic(dest_path, params, n_frames) as f:
+        view = memoryview(frames_bytes)
+        step = WRITE_CHUNK_FRAMES * frame_size
+        for offset in range(0, n_frames * frame_size, step):
+            f.write(view[offset:min(offset + step, n_frames * frame_size)])
+    return os.path.getsize(dest_path)
+
+def decode_samples(content, params):
+    """Frame bytes -> (interleaved float32 samples, mono mixdown for analysis)"""
+    data = decode_pcm(content, params)
+
+    # If multi-channel, convert to mono for analysis
+    if params.nchannels > 1:
+        mono_data = data.reshape(-1, params.nchannels).mean(axis=1)
+    else:
+        mono_data = data
+    return data, mono_data
+
+def encode_samples(final_data, params):
+    return encode_pcm(final_data, params)
+
+def render_rates(data, mono_data, params, rates, pool=None):
+    """Stretch one decoded narration to every rate in `rates`.
+
+    Returns {rate: (frame bytes or None, stretched mono)}; the OLA pass over each
+    channel serves all rates at once (see stretch_many).
+    """
+    n_channels, framerate = params.nchannels, params.framerate
+    stretched_mono = stretch_many(mono_data, rates, framerate, pool)
+
+    # If we stretched mono, we should also stretch the ORIGINAL data to save it back
+    if n_channels == 1:
+        final = stretched_mono
+    else:
+        # Handle multi-channel stretching by stretching each channel
+        channels = data.reshape(-1, n_channels)
+        stretched = [stretch_many(channels[:, c], rates, framerate, pool) for c in range(n_channels)]
+        final = {}
+        for rate in rates:
+            # Use the shortest one to avoid size mismatch
+            min_len = min(len(ch[rate]) for ch in stretched)
+            final[rate] = np.stack([ch[rate][:min_len] for ch in stretched], axis=1).reshape(-1)
+
+    # Rate 1.0 is a passthrough: no bytes, callers keep the source frames
+    return {rate: (encode_samples(final[rate], params) if rate != 1.0 else None, stretched_mono[rate])
+            for rate in rates}
+
+def downmix_source(params, content, data, mono_data):
+    """Collapse a multi-channel source to mono before stretching: one OLA pass instead of one per channel"""
+    if params.nchannels == 1:
+        return params, content, data
+    mono_params = params._replace(nchannels=1)
+    return mono_params, encode_samples(mono_data, mono_params), mono_data
+
+def design_resample_filter(up, down):
+    """Windowed-sinc low-pass at the lower of the two Nyquist rates, gain `up` for zero stuffing"""
+    max_rate = max(up, down)
+    half_len = RESAMPLE_HALF_TAPS * max_rate
+    k = np.arange(-half_len, half_len + 1)
+    h = np.sinc(k / max_rate) * np.kaiser(2 * half_len + 1, RESAMPLE_KAISER_BETA)
+    return h * (up / h.sum()), half_len
+
+def resample_poly(x, up, down):
+    """Resample a 1-D signal by up/down with a polyphase FIR, fully vectorized.
+
+    Output m sits at position m*down + delay of the zero-stuffed signal, so
+    only the taps h[p::up] of phase p = (m*down + delay) % up touch real
+    samples and the upsampled signal is never materialized. With few
+    phases each one is a single np.convolve over the input; otherwise
+    blocks of outputs gather their (output x taps) products for one einsum.
+    """
+    h, half_len = design_resample_filter(up, down)
+    n_taps = -(-len(h) // up)
+    padded = np.zeros(n_taps * up)
+    padded[:len(h)] = h
+    # poly[p, j] = h[p + j*up]
+    poly = padded.reshape(n_taps, up).T
+
+    n_out = -(-len(x) * up // down)
+    last_base = ((n_out - 1) * down + half_len) // up if n_out else 0
+    xp = np.concatenate([np.zeros(n_taps - 1), np.asarray(x, dtype=np.float64),
+                         np.zeros(max(last_base + 1 - len(x), 0))])
+
+    y = np.empty(n_out, dtype=np.float32)
+    if up <= RESAMPLE_CONVOLVE_MAX_UP:
+        n = np.arange(n_out) * down + half_len
+        phase, base = n % up, n // up
+        for p in range(up):
+            selected = phase == p
+            # valid-mode convolution: c[i] = sum_j poly[p, j] * xp[i + n_taps - 1 - j]
+            y[selected] = np.convolve(xp, poly[p], 'valid')[base[selected]]
+        return y
+
+    taps = np.arange(n_taps)
+    for m0 in range(0, n_out, RESAMPLE_BLOCK):
+        n = np.arange(m0, min(m0 + RESAMPLE_BLOCK, n_out)) * down + half_len
+        base = n // up + (n_taps - 1)
+        y[m0:m0 + len(n)] = np.einsum('ij,ij->i', poly[n % up], xp[base[:, None] - taps])
+    return y
+
+def resample_frames(params, frames_bytes, target_rate):
+    """Resample interleaved frame bytes to `target_rate`, returning (params, frame bytes)"""
+    if not target_rate or target_rate == params.framerate:
+        return params, frames_bytes
+    g = np.gcd(int(target_rate), int(params.framerate))
+    up, down = int(target_rate) // g, int(params.framerate) // g
+
+    data, _ = decode_samples(frames_bytes, params)
+    channels = data.reshape(-1, params.nchannels)
+    out = np.stack([resample_poly(channels[:, c], up, down) for c in range(params.nchannels)], axis=1)
+
+    # The filter can overshoot near full scale: encode_samples clips instead of wrapping
+    return params._replace(framerate=int(target_rate)), encode_samples(out.reshape(-1), params)
+
+def analyze_audio(wav_path, speed=1.0, output_path=None, pcm_spec=None, segment_seconds=None,
+                  target_rate=None, downmix=False, workers=None, vad="full", prosody=False,
+                  text=None, target_wps=None, paragraphs=None, game_clips_dir=None):
+    """Stretch (if needed) and analyze a narration.
+
+    `wav_path` may be a file path or '-' for stdin. When `output_path` is
+    given the final audio is written there (single write, atomic rename);
+    otherwise a stretched file is rewritten in place as before. With
+    `segment_seconds` the final audio is also packaged into silence-aligned
+    segments (see package_segments).
+
+    `downmix` stores mono and `target_rate` resamples the stored audio.
+    Analysis always runs on the source-rate mono signal, so the sync data
+    is the same with or without them.
+
+    `workers` > 1 stretches and analyzes the narration on that many
+    processes; output and sync data are identical to the serial run.
+
+    `vad="fast"` detects speech on a ~1ms envelope (see analyze_envelope).
+    When the audio is not transformed (speed 1.0, no resample/downmix/
+    segments) the file is never decoded as a whole: 16-bit PCM is mapped
+    and summed in place, other formats are read in one streaming pass,
+    and an `output_path` elsewhere is written from the same data (see
+    copy_source_envelope).
+
+    `prosody` adds pitch, spectral centroid and RMS summaries for every
+    speech segment (see analyze_prosody).
+
+    With the narration `text` the result also reports the speech rate
+    (see speech_rate). `target_wps` (words per second of speech) replaces
+    `speed`: the rate of the unstretched narration is measured first and
+    the stretch factor that hits the target is applied in the same run.
+
+    `paragraphs` (the story's paragraph records) cuts the isKeyStep spans
+    into an audio sprite, and packs pre-rendered gameText clips from
+    `game_clips_dir` into a second one (see package_sprites).
+    """
+    if vad not in VAD_MODES:
+        return {"error": f"Unknown VAD mode '{vad}'"}
+    if target_wps is not None and (not text or target_wps <= 0):
+        return {"error": "A target speech rate needs the narration text and a positive rate"}
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return _analyze_audio(wav_path, speed, output_path, pcm_spec, segment_seconds,
+                                  target_rate, downmix, vad, prosody, text, target_wps, paragraphs,
+                                  game_clips_dir, pool)
+    return _analyze_audio(wav_path, speed, output_path, pcm_spec, segment_seconds, target_rate, downmix,
+                          vad, prosody, text, target_wps, paragraphs, game_clips_dir)
+
+def _analyze_audio(wav_path, speed, output_path, pcm_spec, segment_seconds, target_rate, downmix,
+                   vad="full", prosody=False, text=None, target_wps=None, paragraphs=None,
+                   game_clips_dir=None, pool=None):
+    try:
+        if wav_path != '-' and not os.path.exists(wav_path):
             return {"error": "File not found"}
 
-        with wave.open(wav_path, 'rb') as wr:
-            params = wr.getparams()
-            n_channels, sampwidth, framerate, n_frames = params[:4]
-            content = wr.readframes(n_frames)
-            
-            # Convert binary data to numpy array
-            if sampwidth == 2:
-                data = np.frombuffer(content, dtype=np.int16).astype(np.float32)
+        untouched = speed == 1.0 and \
+            not (segment_seconds or target_rate or downmix or prosody or target_wps or paragraphs)
+        in_place = not output_path or (wav_path != '-' and os.path.abspath(wav_path) == os.path.abspath(output_path))
+        if vad == "fast" and untouched and (in_place or (wav_path != '-' and not pcm_spec)):
+            if in_place:
+                result = analyze_source_envelope(wav_path, pcm_spec)
             else:
-                data = np.frombuffer(content, dtype=np.int8).astype(np.float32)
-            
-            # If stereo, convert to mono for analysis
-            if n_channels == 2:
-                mono_data = data.reshape(-1, 2).mean(axis=1)
-            else:
-                mono_data = data
-
-            # Apply time-stretching if needed
-            if speed != 1.0:
-                print(f"Stretching audio by factor {speed}...", file=sys.stderr)
-                stretched_mono = stretch_audio(mono_data, speed, framerate)
-                
-                # If we stretched mono, we should also stretch the ORIGINAL data to save it back
-                if n_channels == 1:
-                    final_data = stretched_mono
-                else:
-                    # Handle stereo stretching by stretching each channel
-                    left = stretch_audio(data.reshape(-1, 2)[:, 0], speed, framerate)
-                    right = stretch_audio(data.reshape(-1, 2)[:, 1], speed, framerate)
-                    # Use the shorter one to avoid size mismatch
-                    min_len = min(len(left), len(right))
-                    final_data = np.vstack((left[:min_len], right[:min_len])).T.flatten()
-                
-                # Save back the stretched audio
-                with wave.open(wav_path, 'wb') as ww:
-                    ww.setparams(params)
-                    ww.setnframes(len(final_data) // (n_channels if n_channels > 1 else 1))
-                    
-                    if sampwidth == 2:
-                        ww.writeframes(final_data.astype(np.int16).tobytes())
-                    else:
-                        ww.writeframes(final_data.astype(np.int8).tobytes())
-                
-                # Update analysis data
-                mono_data = stretched_mono
-                n_frames = len(stretched_mono)
-
-            # Analyze audio (on mono_data)
-            # Normalize to 0-1 range
-            max_val = np.iinfo(np.int16).max if sampwidth == 2 else 127
-            float_data = np.abs(mono_data / max_val)
-            
-            # Analyze in 20ms windows
-            window_size = int(framerate * 0.02)
-            n_windows = len(float_data) // window_size
-            
-            if n_windows == 0:
-                return {"start": 0, "end": 0, "silences": []}
-
-            energies = np.array([np.mean(float_data[i*window_size:(i+1)*window_size]) for i in range(n_windows)])
-            threshold = max(np.mean(energies) * 0.15, 0.005)
-            is_speech = energies > threshold
-            
-            speech_indices = np.where(is_speech)[0]
-            if len(speech_indices) == 0:
-                total_dur = len(mono_data) / framerate
-                return {"start": 0, "end": total_dur, "silences": []}
-            
-            start_time = float(speech_indices[0] * 0.02)
-            end_time = float(speech_indices[-1] * 0.02)
-            
-            silences = []
-            silence_start = -1
-            for i, val in enumerate(is_speech):
-                if not val:
-                    if silence_start == -1: silence_start = i
-                else:
-                    if silence_start != -1:
-                        dur = (i - silence_start) * 0.02
-                        if dur > 0.15:
-                            silences.append({
-                                "start": float(silence_start * 0.02),
-                                "end": float(i * 0.02),
-                                "duration": float(dur)
-                            })
-                        silence_start = -1
-            
-            return {
-                "success": True,
-                "start": start_time,
-                "end": end_time,
-                "totalDuration": float(len(mono_data) / framerate),
-                "silences": silences,
-                "speed": speed
-            }
+                result = copy_source_envelope(wav_path, output_path)
+            if text and result.get("success"):
+                result["speechRate"] = speech_rate(result, text)
+            return result
+
+        params, content = read_source(wav_path, pcm_spec)
+        framerate = params.framerate
+        data, mono_data = decode_samples(content, params)
+        source_params = params
+        if downmix:
+            params, content, data = downmix_source(params, content, data, mono_data)
+
+        target = None
+        if target_wps:
+            # Measure the narration as synthesized, then pick the stretch that lands on the target
+            source_rate = speech_rate(analyze_signal(mono_data, framerate, full_scale(params), 1.0, pool, vad), text)
+            speed = target_speed(source_rate, target_wps)
+            target = {"wordsPerSecond": target_wps, "sourceWordsPerSecond": source_rate["wordsPerSecond"],
+                      "speed": speed}
+
+        # Bytes of the final file payload; None means the source is kept untouched
+        out_bytes = None
+
+        # Apply time-stretching if needed
+        if speed != 1.0:
+            print(f"Stretching audio by factor {speed}...", file=sys.stderr)
+            out_bytes, mono_data = render_rates(data, mono_data, params, [speed], pool)[speed]
+        elif params != source_params or (target_rate and target_rate != framerate) or \
+                (output_path and (wav_path == '-' or os.path.abspath(wav_path) != os.path.abspath(output_path))):
+            # Nothing to stretch but the narration still has to land at its destination
+            out_bytes = content
+
+        if out_bytes is not None:
+            params, out_bytes = resample_frames(params, out_bytes, target_rate)
+
+        # Stdin without --output is analysis only: there is nowhere to write the audio
+        if out_bytes is not None and (output_path or wav_path != '-'):
+            write_wav_atomic(output_path or wav_path, params, out_bytes)
+
+        result = analyze_signal(mono_data, framerate, full_scale(params), speed, pool, vad)
+        if text and result.get("success"):
+            result["speechRate"] = speech_rate(result, text)
+        if target:
+            result["targetRate"] = target
+        if prosody and result.get("success"):
+            result["prosody"] = analyze_prosody(mono_data, framerate, full_scale(params), result)
+        if segment_seconds and result.get("success"):
+            dest = output_path or wav_path
+            if dest == '-':
+                return {"error": "Segmenting stdin input needs --output"}
+            result["segmentManifest"] = package_segments(
+                dest, params, out_bytes if out_bytes is not None else content, result, segment_seconds)
+        if paragraphs and result.get("success"):
+            dest = output_path or wav_path
+            if dest == '-':
+                return {"error": "Audio sprites from stdin input need --output"}
+            result["spriteManifest"] = package_sprites(
+                dest, params, out_bytes if out_bytes is not None else content, result, paragraphs, game_clips_dir)
+        return result
     except Exception as e:
         return {"error": str(e)}
 
+def rendition_path(output_path, rate):
+    """narration_1.wav + 0.75 -> narration_1_0.75x.wav"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_{rate:g}x{ext or '.wav'}"
+
+def manifest_path(output_path):
+    return os.path.splitext(output_path)[0] + '.sync.json'
+
+def write_json_atomic(dest_path, payload):
+    dest_dir = os.path.dirname(os.path.abspath(dest_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.partial_', suffix='.json', dir=dest_dir)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def render_renditions(wav_path, rates, output_path, pcm_spec=None, segment_seconds=None,
+                      target_rate=None, downmix=False, workers=None, vad="full"):
+    """Render several playback speeds from one decode and write a combined sync manifest.
+
+    Each rate is written to rendition_path(output_path, rate) and analyzed;
+    the manifest (also returned) maps every rate to its file name and sync
+    data, so the player can switch speed without asking the server again.
+    With `segment_seconds` every rendition also gets its own segments;
+    `target_rate`, `downmix`, `workers` and `vad` work as in analyze_audio.
+    """
+    if vad not in VAD_MODES:
+        return {"error": f"Unknown VAD mode '{vad}'"}
+    if workers and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return _render_renditions(wav_path, rates, output_path, pcm_spec, segment_seconds,
+                                      target_rate, downmix, vad, pool)
+    return _render_renditions(wav_path, rates, output_path, pcm_spec, segment_seconds, target_rate, downmix, vad)
+
+def _render_renditions(wav_path, rates, output_path, pcm_spec, segment_seconds, target_rate, downmix,
+                       vad="full", pool=None):
+    try:
+        if wav_path != '-' and not os.path.exists(wav_path):
+            return {"error": "File not found"}
+        rates = sorted(set(rates))
+        if not rates or any(rate <= 0 for rate in rates):
+            return {"error": "Rates must be positive numbers"}
+
+        params, content = read_source(wav_path, pcm_spec)
+        framerate = params.framerate
+        data, mono_data = decode_samples(content, params)
+        if downmix:
+            params, content, data = downmix_source(params, content, data, mono_data)
+
+        print(f"Rendering rates {', '.join(f'{r:g}' for r in rates)}...", file=sys.stderr)
+        rendered = render_rates(data, mono_data, params, rates, pool)
+
+        renditions = {}
+        for rate in rates:
+            out_bytes, rate_mono = rendered[rate]
+            if rate == 1.0:
+                # Unstretched rendition is the decoded source, byte for byte
+                out_bytes = content
+            rate_params, out_bytes = resample_frames(params, out_bytes, target_rate)
+            dest = rendition_path(output_path, rate)
+            write_wav_atomic(dest, rate_params, out_bytes)
+            entry = analyze_signal(rate_mono, framerate, full_scale(params), rate, pool, vad)
+            entry["file"] = os.path.basename(dest)
+            if segment_seconds and entry.get("success"):
+                entry["segmentManifest"] = package_segments(dest, rate_params, out_bytes, entry, segment_seconds)
+            renditions[f"{rate:g}"] = entry
+
+        manifest = {
+            "success": True,
+            "defaultRate": "1" if 1.0 in rates else f"{rates[0]:g}",
+            "renditions": renditions
+        }
+        write_json_atomic(manifest_path(output_path), manifest)
+        return manifest
+    except Exception as e:
+        return {"error": str(e)}
+
+def plan_segments(sync, n_frames, framerate, min_seconds=SEGMENT_MIN_SECONDS):
+    """Split points (in frames) for segmented delivery.
+
+    A cut is placed in the middle of the first detected silence that comes
+    at least `min_seconds` after the previous cut, so no segment boundary
+    falls inside speech. Without a suitable silence the segment simply
+    grows; a tail shorter than half the minimum is merged into the last
+    segment.
+    """
+    cuts = [0]
+    for silence in sync.get("silences", []):
+        cut = int(round((silence["start"] + silence["end"]) / 2 * framerate))
+        if cut - cuts[-1] >= min_seconds * framerate and n_frames - cut >= min_seconds * framerate / 2:
+            cuts.append(cut)
+    cuts.append(n_frames)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+def segments_dir(audio_path):
+    return os.path.splitext(audio_path)[0] + '_segments'
+
+def package_segments(audio_path, params, frames_bytes, sync, min_seconds=SEGMENT_MIN_SECONDS):
+    """Cut the final narration into silence-aligned WAV segments.
+
+    Segments go to <name>_segments/, alongside a <name>.segments.json
+    manifest whose start/end times are on the same timeline as the sync
+    data. The manifest is written last, so its presence means the whole
+    set is complete. Returns its file name.
+
+    No HLS playlist is written: HLS players only accept TS/fMP4 segments,
+    and the player fetches the WAV segments through the manifest.
+    """
+    framerate = params.framerate
+    frame_size = params.nchannels * params.sampwidth
+    n_frames = len(frames_bytes) // frame_size
+
+    out_dir = segments_dir(audio_path)
+    os.makedirs(out_dir, exist_ok=True)
+    dir_name = os.path.basename(out_dir)
+
+    view = memoryview(frames_bytes)
+    segments = []
+    for index, (first, last) in enumerate(plan_segments(sync, n_frames, framerate, min_seconds)):
+        name = f"seg_{index:05d}.wav"
+        size = write_wav_atomic(os.path.join(out_dir, name), params, view[first * frame_size:last * frame_size])
+        segments.append({
+            "file": f"{dir_name}/{name}",
+            "start": first / framerate,
+            "end": last / framerate,
+            "duration": (last - first) / framerate,
+            "bytes": size
+        })
+
+    root = os.path.splitext(audio_path)[0]
+    manifest_name = os.path.basename(root) + '.segments.json'
+    write_json_atomic(root + '.segments.json', {
+        "audio": os.path.basename(audio_path),
+        "totalDuration": n_frames / framerate,
+        "segments": segments
+    })
+    return manifest_name
+
+def window_energies(mono_data, max_val, window_size, n_windows):
+    """Mean normalized amplitude of each analysis window"""
+    if kernel_backend() == "numba" and mono_data.dtype == np.float32:
+        return energy_kernel(np.ascontiguousarray(mono_data), np.float32(max_val), window_size, n_windows)
+    # Normalize to 0-1 range
+    float_data = np.abs(mono_data[:n_windows * window_size] / max_val)
+    return float_data.reshape(n_windows, window_size).mean(axis=1)
+
+def parallel_window_energies(pool, mono_data, max_val, window_size, n_windows):
+    """window_energies over contiguous window ranges in `pool`; windows never straddle a range"""
+    step = max(PARALLEL_CHUNK_SAMPLES // window_size, 1)
+    futures = []
+    for w0 in range(0, n_windows, step):
+        w1 = min(w0 + step, n_windows)
+        segment = np.ascontiguousarray(mono_data[w0 * window_size:w1 * window_size])
+        futures.append(pool.submit(window_energies, segment, max_val, window_size, w1 - w0))
+    return np.concatenate([f.result() for f in futures])
+
+def analyze_signal(mono_data, framerate, max_val, speed=1.0, pool=None, vad="full"):
+    """VAD over 20ms windows: speech start/end and pauses longer than 150ms.
+
+    `max_val` is the full-scale value of the samples (see full_scale).
+    Window energies may be computed in a process `pool`; the threshold
+    depends on all of them, so silence runs are extracted after stitching.
+    `vad="fast"` goes through the decimated envelope instead (no pool).
+    """
+    # Analyze audio (on mono_data)
+    # Analyze in 20ms windows
+    window_size = int(framerate * 0.02)
+    n_windows = len(mono_data) // window_size
+
+    if n_windows == 0:
+        return {"start": 0, "end": 0, "silences": []}
+
+    if vad == "fast":
+        block = envelope_block(framerate, window_size)
+        envelope = signal_envelope(mono_data, block)
+        return analyze_envelope(envelope, block, framerate, len(mono_data), max_val, speed)
+
+    if pool is not None:
+        energies = parallel_window_energies(pool, mono_data, max_val, window_size, n_windows)
+    else:
+        energies = window_energies(mono_data, max_val, window_size, n_windows)
+    return detect_speech(energies, len(mono_data) / framerate, speed)
+
+def detect_speech(energies, total_duration, speed=1.0):
+    """Threshold 20ms window energies into speech start/end and silences"""
+    threshold = max(np.mean(energies) * 0.15, 0.005)
+    is_speech = energies > threshold
+
+    speech_indices = np.where(is_speech)[0]
+    if len(speech_indices) == 0:
+        return {"start": 0, "end": float(total_duration), "silences": []}
+
+    start_time = float(speech_indices[0] * 0.02)
+    end_time = float(speech_indices[-1] * 0.02)
+
+    starts, ends = silence_runs(is_speech)
+    durations = (ends - starts) * 0.02
+    kept = durations > 0.15
+    silences = [{"start": start, "end": end, "duration": dur}
+                for start, end, dur in zip((starts[kept] * 0.02).tolist(), (ends[kept] * 0.02).tolist(),
+                                           durations[kept].tolist())]
+
+    return {
+        "success": True,
+        "start": start_time,
+        "end": end_time,
+        "totalDuration": float(total_duration),
+        "silences": silences,
+        "speed": speed
+    }
+
+# ========================================
+# FAST VAD (decimated envelope)
+# ========================================
+
+def envelope_block(framerate, window_size):
+    """Divisor of the 20ms window closest to ENVELOPE_BLOCK_SECONDS, so every window is whole blocks"""
+    target = framerate * ENVELOPE_BLOCK_SECONDS
+    divisors = [d for d in range(1, window_size + 1) if window_size % d == 0]
+    return min(divisors, key=lambda d: abs(d - target))
+
+def signal_envelope(mono_data, block):
+    """Sum of |amplitude| over each `block` samples of an already decoded mono signal"""
+    n_blocks = len(mono_data) // block
+    return np.abs(mono_data[:n_blocks * block]).reshape(n_blocks, block).sum(axis=1, dtype=np.float64)
+
+def envelope_chunk(content, params, block):
+    """Sum of |channel sum| over each `block` frames of raw PCM (whole blocks only).
+
+    16-bit integer PCM, what the TTS writes, stays in integers: no float
+    decode and exact sums. Other formats go through decode_pcm per chunk.
+    """
+    n_channels = params.nchannels
+    if params.sampwidth == 2 and not is_float_format(params):
+        samples = np.frombuffer(content, dtype='<i2')
+        if n_channels == 1:
+            # abs(-32768) wraps in int16; read it back as unsigned
+            magnitude, acc = np.abs(samples).view(np.uint16), np.uint32
+        else:
+            magnitude, acc = np.abs(samples.reshape(-1, n_channels).sum(axis=1, dtype=np.int32)), np.int64
+    else:
+        magnitude = np.abs(decode_pcm(content, params).reshape(-1, n_channels).sum(axis=1, dtype=np.float64))
+        acc = np.float64
+    return magnitude.reshape(-1, block).sum(axis=1, dtype=acc)
+
+def stream_envelope(stream, params, data_size, block, sink=None):
+    """One forward pass over the data chunk: sum of |channel sum| per `block` frames.
+
+    Reads ENVELOPE_CHUNK_FRAMES at a time (a multiple of `block`), so
+    memory stays flat however long the narration is. `data_size` None
+    reads to EOF. Every chunk read is also passed to `sink`, if given.
+    Returns (envelope, n_frames).
+    """
+    frame_size = params.nchannels * params.sampwidth
+    chunk_bytes = max(ENVELOPE_CHUNK_FRAMES // block, 1) * block * frame_size
+    remaining = data_size
+    sums = []
+    n_frames = 0
+    while remaining is None or remaining > 0:
+        chunk = stream.read(chunk_bytes if remaining is None else min(chunk_bytes, remaining))
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        if sink is not None:
+            sink(chunk)
+        frames = len(chunk) // frame_size
+        n_frames += frames
+        whole = frames // block * block
+        if whole:
+            sums.append(envelope_chunk(memoryview(chunk)[:whole * frame_size], params, block))
+        if len(chunk) < chunk_bytes:
+            # Short read: end of data (a trailing partial block never fills a window)
+            break
+    return (np.concatenate(sums) if sums else np.zeros(0)), n_frames
+
+def analyze_envelope(envelope, block, framerate, n_frames, scale, speed=1.0):
+    """Speech start/end and silences from a `block`-frame envelope of |amplitude| sums.
+
+    `scale` is the full-scale value of one envelope sample (full_scale
+    times the channels summed into it). Each 20ms window is exactly
+    window_size // block envelope blocks, so window energies are the
+    full-resolution ones up to float rounding (exact sums divided once
+    here, float32 means there). The only way a decision can differ is a
+    window whose energy is within rounding of the threshold: worst case
+    that moves one boundary by one window, 20ms, and never shifts the
+    time grid.
+    """
+    window_size = int(framerate * 0.02)
+    per_window = window_size // block
+    n_windows = len(envelope) // per_window
+    if n_windows == 0:
+        return {"start": 0, "end": 0, "silences": []}
+    sums = envelope[:n_windows * per_window].reshape(n_windows, per_window).sum(axis=1, dtype=np.float64)
+    return detect_speech(sums / (window_size * scale), n_frames / framerate, speed)
+
+def is_mappable(params):
+    """16-bit integer PCM whose envelope block sums stay exact in float32 (see mapped_envelope)"""
+    if params.sampwidth != 2 or is_float_format(params):
+        return False
+    window_size = int(params.framerate * 0.02)
+    return window_size > 0 and envelope_block(params.framerate, window_size) * params.nchannels <= 256
+
+def map_frames(path, offset, n_frames, params):
+    """Interleaved int16 samples of `n_frames` frames at `offset`, mapped read-only (no read, no copy)"""
+    if n_frames == 0:
+        return np.zeros(0, dtype='<i2')
+    return np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(n_frames * params.nchannels,))
+
+def mapped_envelope(samples, n_channels, block):
+    """Sum of |channel sum| over each `block` frames of int16 samples, as float32.
+
+    Works through the data MAPPED_CHUNK_FRAMES at a time: int16 abs (mono)
+    or channel sum, a cast to float32 and one matrix-vector product for
+    the block sums. Every partial sum is an integer below 2**24 (blocks
+    of at most 256 samples, see is_mappable), so the float32 sums are
+    exact: the same values as envelope_chunk's integer sums.
+    """
+    # A plain ndarray view: slicing a np.memmap goes through its Python-level hooks
+    samples = np.asarray(samples)
+    if kernel_backend() == "numba":
+        return envelope_kernel(samples, n_channels, block)
+    n_blocks = len(samples) // (n_channels * block)
+    sums = np.empty(n_blocks, dtype=np.float32)
+    ones = np.ones(block, dtype=np.float32)
+    step = max(MAPPED_CHUNK_FRAMES // block, 1)
+    magnitude = np.empty(step * block, dtype=np.int16)
+    work = np.empty(step * block, dtype=np.float32)
+    for b0 in range(0, n_blocks, step):
+        b1 = min(b0 + step, n_blocks)
+        chunk = samples[b0 * block * n_channels:b1 * block * n_channels]
+        frames = work[:(b1 - b0) * block]
+        if n_channels == 1:
+            # abs(-32768) wraps in int16; read it back as unsigned
+            frames[:] = np.abs(chunk, out=magnitude[:len(chunk)]).view(np.uint16)
+        else:
+            frames[:] = chunk.reshape(-1, n_channels).sum(axis=1)
+            np.abs(frames, out=frames)
+        np.dot(frames.reshape(-1, block), ones, out=sums[b0:b1])
+    return sums
+
+def data_in_file(f, data_size):
+    """Bytes of the data chunk actually in the file: a streamed WAV with an open size, or
+    a truncated file, runs to the end of the file"""
+    available = os.fstat(f.fileno()).st_size - f.tell()
+    return available if data_size is None else min(data_size, available)
+
+def analyze_source_envelope(source, pcm_spec=None):
+    """Fast VAD straight from a WAV file, a WAV stream on stdin ('-') or raw PCM on stdin.
+
+    16-bit files are mapped instead of read (see mapped_envelope); other
+    formats and stdin go through the streaming pass.
+    """
+    if source == '-':
+        stream = sys.stdin.buffer
+        if pcm_spec:
+            params, data_size = parse_pcm_spec(pcm_spec), None
+        else:
+            params, data_size = read_wav_header(stream)
+        return _analyze_stream_envelope(stream, params, data_size)
+    with open(source, 'rb') as f:
+        params, data_size = read_wav_header(f)
+        data_size = data_in_file(f, data_size)
+        if is_mappable(params):
+            n_frames = data_size // (params.nchannels * params.sampwidth)
+            return _analyze_mapped_envelope(map_frames(source, f.tell(), n_frames, params), params)
+        return _analyze_stream_envelope(f, params, data_size)
+
+def copy_source_envelope(source, output_path):
+    """Fast VAD of a WAV file while writing its audio to `output_path`.
+
+    The narration is read once and written once, as write_wav_atomic
+    would write it (canonical header, whole frames only): 16-bit frames
+    are written straight from the mapped file, other formats are copied
+    chunk by chunk as the streaming pass reads them.
+    """
+    with open(source, 'rb') as f:
+        params, data_size = read_wav_header(f)
+        frame_size = params.nchannels * params.sampwidth
+        n_frames = data_in_file(f, data_size) // frame_size
+        with open_wav_atomic(output_path, params, n_frames) as out:
+            if is_mappable(params):
+                samples = map_frames(source, f.tell(), n_frames, params)
+                out.write(memoryview(samples).cast('B'))
+                return _analyze_mapped_envelope(samples, params)
+            return _analyze_stream_envelope(f, params, n_frames * frame_size, out.write)
+
+def _analyze_mapped_envelope(samples, params):
+    block = envelope_block(params.framerate, int(params.framerate * 0.02))
+    envelope = mapped_envelope(samples, params.nchannels, block)
+    return analyze_envelope(envelope, block, params.framerate, len(samples) // params.nchannels,
+                            params.nchannels * full_scale(params))
+
+def _analyze_stream_envelope(stream, params, data_size, sink=None):
+    window_size = int(params.framerate * 0.02)
+    if window_size == 0:
+        if sink is not None:
+            sink(stream.read(data_size))
+        return {"start": 0, "end": 0, "silences": []}
+    block = envelope_block(params.framerate, window_size)
+    envelope, n_frames = stream_envelope(stream, params, data_size, block, sink)
+    return analyze_envelope(envelope, block, params.framerate, n_frames, params.nchannels * full_scale(params))
+
+# ========================================
+# PROSODY (batched STFT features on the speech windows)
+# ========================================
+
+def fft_size(n):
+    """Smallest 2^a * 3^b * 5^c >= n: pocketfft is fastest on these, and they pad far less than a power of two"""
+    best = 1 << int(np.ceil(np.log2(n)))
+    odd5 = 1
+    while odd5 < best:
+        odd = odd5
+        while odd < best:
+            size = odd
+            while size < n:
+                size *= 2
+            best = min(best, size)
+            odd *= 3
+        odd5 *= 5
+    return best
+
+def frame_features(frames, framerate, max_val):
+    """Pitch (Hz, 0 when unvoiced), spectral centroid (Hz) and RMS of a batch of analysis frames.
+
+    Each row is PITCH_FRAME_WINDOWS VAD windows centered on one of them
+    (see window_frames); RMS is taken on that window alone, pitch and
+    centroid on the whole frame. One rfft per batch gives both the
+    magnitude spectrum (centroid) and, through the power spectrum, the
+    autocorrelation (pitch): the FFT is zero-padded just enough that the
+    lags searched are not circular, and the autocorrelation comes from
+    the low band alone with an inverse FFT `step` times shorter, i.e. at
+    framerate / step. Dividing by the Hann window's own autocorrelation
+    undoes its taper, which would otherwise flatten the peaks at the
+    long lags of low voices.
+    """
+    n_frames, frame_size = frames.shape
+    window_size = frame_size // PITCH_FRAME_WINDOWS
+    first = (frame_size - window_size) // 2
+    rms = np.sqrt(np.mean(np.square(frames[:, first:first + window_size], dtype=np.float64), axis=1)) / max_val
+
+    step = 1
+    while framerate / (2 * step) >= PITCH_AUTOCORR_RATE:
+        step *= 2
+    rate = framerate / step
+    lag_min = max(int(rate / PITCH_MAX_HZ), 2)
+    lag_max = min(int(np.ceil(rate / PITCH_MIN_HZ)), frame_size // (2 * step))
+    # Circular lag L picks up lag n_fft - L. The taper is zero at both ends, so the
+    # autocorrelation is zero from lag frame_size - 2 on: no aliasing up to lag_max + 1
+    n_fft = step * fft_size(-(-(frame_size + (lag_max + 1) * step - 2) // step))
+    taper = np.hanning(frame_size)
+    # Normalized and tapered in one pass
+    spectrum = np.fft.rfft(frames * (taper / max_val), n=n_fft, axis=1)
+    magnitude = np.abs(spectrum)
+    # Sum and first moment of every spectrum in one product
+    freqs = np.arange(magnitude.shape[1]) * (framerate / n_fft)
+    moments = magnitude @ np.stack((np.ones_like(freqs), freqs), axis=1)
+    total = moments[:, 0]
+    centroid = np.divide(moments[:, 1], total, out=np.zeros(n_frames), where=total > 0)
+
+    pitch = np.zeros(n_frames)
+    if lag_max <= lag_min:
+        return pitch, centroid, rms
+    n_lag = n_fft // step
+    autocorr = np.fft.irfft(np.square(magnitude[:, :n_lag // 2 + 1]), n=n_lag, axis=1)
+    taper_autocorr = np.fft.irfft(np.square(np.abs(np.fft.rfft(taper, n=n_fft)[:n_lag // 2 + 1])), n=n_lag)
+    # Lags lag_min-1 .. lag_max+1: one extra on each side for the peak test and the interpolation
+    lags = slice(lag_min - 1, lag_max + 2)
+    energy = autocorr[:, 0] / taper_autocorr[0]
+    norm = np.divide(autocorr[:, lags] / taper_autocorr[lags], energy[:, None],
+                     out=np.zeros((n_frames, lag_max - lag_min + 3)), where=energy[:, None] > 0)
+
+    center = norm[:, 1:-1]
+    is_peak = (center >= norm[:, :-2]) & (center > norm[:, 2:])
+    strongest = np.where(is_peak, center, -np.inf).max(axis=1)
+    candidate = is_peak & (center >= PITCH_OCTAVE_RATIO * strongest[:, None])
+    peak = np.argmax(candidate, axis=1)
+    rows = np.arange(n_frames)
+    voiced = candidate.any(axis=1) & (center[rows, peak] > VOICING_THRESHOLD)
+    # Parabolic interpolation around the peak for sub-sample lag
+    left, mid, right = norm[rows, peak], norm[rows, peak + 1], norm[rows, peak + 2]
+    curve = left - 2 * mid + right
+    offset = np.divide(0.5 * (left - right), curve, out=np.zeros(n_frames), where=curve < 0)
+    lag = peak + lag_min + np.clip(offset, -0.5, 0.5)
+    pitch[voiced] = rate / lag[voiced]
+    return pitch, centroid, rms
+
+def window_frames(mono_data, window_size, i0, i1):
+    """VAD windows i0..i1-1 of analyze_signal, each widened to PITCH_FRAME_WINDOWS windows (zeros past the ends).
+
+    The 20ms grid shifted back by half the widening is cut once with a
+    reshape; frame i is then cells i..i+PITCH_FRAME_WINDOWS-1 side by side.
+    """
+    before = (PITCH_FRAME_WINDOWS - 1) * window_size // 2
+    lo = i0 * window_size - before
+    hi = (i1 + PITCH_FRAME_WINDOWS - 1) * window_size - before
+    # Only whole windows are analyzed, as in window_energies
+    end = len(mono_data) // window_size * window_size
+    cells = np.zeros(hi - lo, dtype=mono_data.dtype)
+    cells[max(lo, 0) - lo:min(hi, end) - lo] = mono_data[max(lo, 0):min(hi, end)]
+    cells = cells.reshape(-1, window_size)
+    count = i1 - i0
+    return np.concatenate([cells[k:k + count] for k in range(PITCH_FRAME_WINDOWS)], axis=1)
+
+def span_features(mono_data, framerate, max_val, ranges):
+    """frame_features of the VAD windows in `ranges` ((i0, i1) pairs), concatenated in order.
+
+    Consecutive ranges are packed into groups of PROSODY_BLOCK_FRAMES
+    windows (long ones are cut across groups) and each group is one FFT
+    call; windows outside the ranges are never transformed.
+    """
+    window_size = int(framerate * 0.02)
+    groups, group, size = [], [], 0
+    for i0, i1 in ranges:
+        while i0 < i1:
+            take = min(i1 - i0, PROSODY_BLOCK_FRAMES - size)
+            group.append((i0, i0 + take))
+            i0 += take
+            size += take
+            if size == PROSODY_BLOCK_FRAMES:
+                groups.append(group)
+                group, size = [], 0
+    if group:
+        groups.append(group)
+    if not groups:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    parts = [frame_features(np.concatenate([window_frames(mono_data, window_size, i0, i1) for i0, i1 in group]),
+                            framerate, max_val)
+             for group in groups]
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+def prosody_frames(mono_data, framerate, max_val):
+    """frame_features for every 20ms VAD window"""
+    n_windows = len(mono_data) // int(framerate * 0.02)
+    return span_features(mono_data, framerate, max_val, [(0, n_windows)])
+
+def speech_spans(sync):
+    """(start, end) seconds of the speech between the silences of a sync result"""
+    spans = []
+    cursor = sync["start"]
+    # "end" is the start of the last speech window
+    speech_end = sync["end"] + 0.02
+    for silence in sync["silences"]:
+        if silence["start"] > cursor:
+            spans.append((cursor, min(silence["start"], speech_end)))
+        cursor = max(cursor, silence["end"])
+    if speech_end > cursor:
+        spans.append((cursor, speech_end))
+    return spans
+
+def analyze_prosody(mono_data, framerate, max_val, sync):
+    """Compact per-segment pitch, brightness and loudness summaries for the player.
+
+    Segments are the speech spans between the detected silences. Pitch
+    statistics use voiced frames only; `pitchSlope` (Hz/s, linear fit) is
+    positive for rising intonation (questions, emphasis). Features are
+    computed on the VAD windows of the spans only (see span_features).
+    """
+    n_windows = len(mono_data) // int(framerate * 0.02)
+    spans = []
+    for start, end in speech_spans(sync):
+        i0, i1 = int(round(start / 0.02)), min(int(round(end / 0.02)), n_windows)
+        if i1 > i0:
+            spans.append((start, end, i0, i1))
+    pitch, centroid, rms = span_features(mono_data, framerate, max_val, [(i0, i1) for _, _, i0, i1 in spans])
+    segments = []
+    offset = 0
+    for start, end, i0, i1 in spans:
+        count = i1 - i0
+        seg = slice(offset, offset + count)
+        offset += count
+        seg_pitch = pitch[seg]
+        voiced = np.flatnonzero(seg_pitch > 0)
+        summary = {
+            "start": float(start),
+            "end": float(end),
+            "rmsMean": round(float(rms[seg].mean()), 4),
+            "rmsPeak": round(float(rms[seg].max()), 4),
+            "centroidMean": round(float(centroid[seg].mean()), 1),
+            "voicedRatio": round(len(voiced) / count, 3),
+            "pitchMedian": 0.0, "pitchLow": 0.0, "pitchHigh": 0.0, "pitchSlope": 0.0
+        }
+        if len(voiced):
+            low, median, high = np.percentile(seg_pitch[voiced], [10, 50, 90])
+            summary.update(pitchMedian=round(float(median), 1), pitchLow=round(float(low), 1),
+                           pitchHigh=round(float(high), 1))
+            if len(voiced) > 1:
+                slope = np.polyfit(voiced * 0.02, seg_pitch[voiced], 1)[0]
+                summary["pitchSlope"] = round(float(slope), 1) + 0.0  # no "-0.0" in the JSON
+        segments.append(summary)
+    return {"frameSeconds": 0.02, "segments": segments}
+
+# ========================================
+# SPEECH RATE
+# ========================================
+
+def text_units(text):
+    """(words, syllables) of the narration text; syllables are vowel groups, at least one per word"""
+    words = WORD_RE.findall(text)
+    return len(words), sum(max(len(VOWEL_GROUP_RE.findall(word)), 1) for word in words)
+
+def speech_rate(sync, text):
+    """Words and syllables per second of speech (pauses excluded) for a sync result"""
+    words, syllables = text_units(text)
+    voiced = sum(end - start for start, end in speech_spans(sync)) if sync.get("success") else 0.0
+    return {
+        "words": words,
+        "syllables": syllables,
+        "voicedSeconds": round(voiced, 3),
+        "wordsPerSecond": round(words / voiced, 3) if voiced > 0 else 0.0,
+        "syllablesPerSecond": round(syllables / voiced, 3) if voiced > 0 else 0.0
+    }
+
+def target_speed(source_rate, target_wps):
+    """Stretch factor taking a narration from its measured rate to `target_wps`.
+
+    Stretching by s divides speech and pause durations alike by s, so the
+    rate scales by s. Clamped to TARGET_SPEED_MIN..MAX; 1.0 when nothing
+    was measured.
+    """
+    if source_rate["wordsPerSecond"] <= 0:
+        return 1.0
+    speed = target_wps / source_rate["wordsPerSecond"]
+    return round(min(max(speed, TARGET_SPEED_MIN), TARGET_SPEED_MAX), 3)
+
+# ========================================
+# AUDIO SPRITES (key-step clips for the sequencing game)
+# ========================================
+
+def sprite_path(audio_path, kind):
+    """narration_1.wav + 'keysteps' -> narration_1_keysteps.wav"""
+    return f"{os.path.splitext(audio_path)[0]}_{kind}.wav"
+
+def paragraph_spans(sync, texts):
+    """(start, end) seconds of each paragraph of the narration.
+
+    The narration is the paragraphs read in order, so the speech time
+    (pauses excluded) is shared out by syllable count; each boundary then
+    snaps to the middle of the nearest detected pause within
+    SPRITE_SNAP_SECONDS, where the reader actually stopped.
+    """
+    spans = speech_spans(sync)
+    if not spans or not texts:
+        return []
+    weights = np.cumsum([max(text_units(t)[1], 1) for t in texts])
+    voiced = np.cumsum([end - start for start, end in spans])
+    pauses = np.array([(sil["start"] + sil["end"]) / 2 for sil in sync["silences"]])
+
+    bounds = [spans[0][0]]
+    for weight in weights[:-1]:
+        # Voiced time -> timeline time: position inside the speech span it falls in
+        at = voiced[-1] * weight / weights[-1]
+        k = min(int(np.searchsorted(voiced, at)), len(spans) - 1)
+        t = spans[k][1] - (voiced[k] - at)
+        if len(pauses):
+            nearest = pauses[np.argmin(np.abs(pauses - t))]
+            if abs(nearest - t) <= SPRITE_SNAP_SECONDS:
+                t = nearest
+        bounds.append(max(float(t), bounds[-1]))
+    bounds.append(spans[-1][1])
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def write_sprite(dest_path, params, clips):
+    """Concatenate (key, frame bytes) clips with SPRITE_GAP_SECONDS of silence; returns the offset index"""
+    frame_size = params.nchannels * params.sampwidth
+    gap = encode_pcm(np.zeros(int(params.framerate * SPRITE_GAP_SECONDS) * params.nchannels, dtype=np.float32), params)
+    parts, index, offset = [], [], 0
+    for key, frames in clips:
+        if parts:
+            parts.append(gap)
+            offset += len(gap) // frame_size
+        n_frames = len(frames) // frame_size
+        index.append(dict(key, start=offset / params.framerate, duration=n_frames / params.framerate))
+        parts.append(bytes(frames))
+        offset += n_frames
+    size = write_wav_atomic(dest_path, params, b''.join(parts))
+    return {"file": os.path.basename(dest_path), "bytes": size, "clips": index}
+
+def game_text_clips(game_clips_dir, paragraphs, key_steps):
+    """Pre-rendered gameText clips, <paragraph index>.wav, sharing one format; returns (params, clips, missing)"""
+    params, clips, missing = None, [], []
+    for i in key_steps:
+        clip_path = os.path.join(game_clips_dir, f"{i}.wav")
+        if not paragraphs[i].get("gameText") or not os.path.exists(clip_path):
+            missing.append(i)
+            continue
+        clip_params, frames = read_source(clip_path)
+        if params is None:
+            params = clip_params._replace(nframes=0)
+        elif clip_params._replace(nframes=0) != params:
+            raise ValueError(f"gameText clip {clip_path} is {format_label(clip_params)} "
+                             f"{clip_params.framerate} Hz x{clip_params.nchannels}, unlike the others")
+        clips.append(({"paragraph": i, "text": paragraphs[i]["gameText"]}, frames))
+    return params, clips, missing
+
+def package_sprites(audio_path, params, frames_bytes, sync, paragraphs, game_clips_dir=None):
+    """Cut the isKeyStep paragraphs of the final narration into one audio sprite.
+
+    Writes <name>_keysteps.wav (the key-step spans back to back) and, when
+    `game_clips_dir` holds gameText renderings named <paragraph index>.wav,
+    <name>_game.wav. The <name>.sprite.json index, written last, gives each
+    clip's start/duration inside its sprite so the game can load one small
+    file and play any step from memory. Returns the index file name, or
+    None when no paragraph is a key step.
+    """
+    key_steps = [i for i, p in enumerate(paragraphs) if p.get("isKeyStep")]
+    if not key_steps:
+        return None
+    frame_size = params.nchannels * params.sampwidth
+    view = memoryview(frames_bytes)
+    spans = paragraph_spans(sync, [p.get("text", "") for p in paragraphs])
+
+    clips = []
+    for i in key_steps:
+        start, end = spans[i]
+        first, last = int(round(start * params.framerate)), int(round(end * params.framerate))
+        clips.append(({"paragraph": i, "sourceStart": start, "sourceEnd": end},
+                      view[first * frame_size:last * frame_size]))
+    manifest = {"audio": os.path.basename(audio_path),
+                "keySteps": write_sprite(sprite_path(audio_path, 'keysteps'), params, clips)}
+
+    if game_clips_dir:
+        game_params, game_clips, missing = game_text_clips(game_clips_dir, paragraphs, key_steps)
+        if game_clips:
+            manifest["gameText"] = write_sprite(sprite_path(audio_path, 'game'), game_params, game_clips)
+            manifest["gameText"]["missing"] = missing
+
+    root = os.path.splitext(audio_path)[0]
+    write_json_atomic(root + '.sprite.json', manifest)
+    return os.path.basename(root) + '.sprite.json'
+
+# ========================================
+# BENCHMARKS (synthetic audio, no TTS needed)
+# ========================================
+
+def synthetic_narration(seconds, framerate=24000, n_channels=1, seed=0):
+    """Speech-like int16 test signal: ~300ms tone bursts separated by pauses"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * framerate)
+    t = np.arange(n, dtype=np.float32) / framerate
+    carrier = np.sin(2 * np.pi * 180 * t) + 0.4 * np.sin(2 * np.pi * 720 * t)
+    # Gate: 1 during "words", 0 during pauses, changing every 100ms
+    gate = np.repeat(rng.random(int(np.ceil(seconds * 10))) > 0.3, framerate // 10)[:n]
+    signal = (carrier * gate * 8000).astype(np.int16)
+    if n_channels > 1:
+        signal = np.repeat(signal[:, None], n_channels, axis=1).reshape(-1)
+    return pcm_params(n_channels, 2, framerate, n), signal.tobytes()
+
+def benchmark_io(seconds=300, speed=0.9, work_dir=None):
+    """Compare bytes moved by the legacy copy+unlink+rewrite flow and the single-write flow"""
+    params, content = synthetic_narration(seconds)
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        tts_out = os.path.join(tmp, 'tts.wav')
+
+        # Legacy: TTS file -> copyFileSync -> unlinkSync -> analyze_audio rewrites in place
+        write_wav_atomic(tts_out, params, content)
+        n = os.path.getsize(tts_out)
+        legacy_dest = os.path.join(tmp, 'legacy.wav')
+        t0 = time.perf_counter()
+        with open(tts_out, 'rb') as src, open(legacy_dest, 'wb') as dst:
+            dst.write(src.read())
+        analyze_audio(legacy_dest, speed)
+        legacy_time = time.perf_counter() - t0
+        final_size = os.path.getsize(legacy_dest)
+        legacy = {"read": n + n, "written": n + final_size, "fullWrites": 2}
+
+        # Single write: analyzer reads the TTS file once and publishes the destination
+        single_dest = os.path.join(tmp, 'single.wav')
+        t0 = time.perf_counter()
+        analyze_audio(tts_out, speed, output_path=single_dest)
+        single_time = time.perf_counter() - t0
+        single = {"read": n, "written": os.path.getsize(single_dest), "fullWrites": 1}
+
+    legacy["seconds"] = round(legacy_time, 3)
+    single["seconds"] = round(single_time, 3)
+    return {"benchmark": "io", "audioSeconds": seconds, "speed": speed,
+            "sourceBytes": n, "legacy": legacy, "singleWrite": single,
+            "bytesSaved": (legacy["read"] + legacy["written"]) - (single["read"] + single["written"])}
+
+def benchmark_rates(seconds=300, rates=(0.75, 0.9, 1.0, 1.1), work_dir=None):
+    """One render_renditions pass vs one analyze_audio run per rate"""
+    params, content = synthetic_narration(seconds)
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        source = os.path.join(tmp, 'tts.wav')
+        write_wav_atomic(source, params, content)
+
+        t0 = time.perf_counter()
+        for rate in rates:
+            analyze_audio(source, rate, output_path=os.path.join(tmp, f'single_{rate:g}.wav'))
+        per_rate_time = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        render_renditions(source, rates, os.path.join(tmp, 'multi.wav'))
+        multi_time = time.perf_counter() - t0
+
+    return {"benchmark": "rates", "audioSeconds": seconds, "rates": list(rates),
+            "perRateRuns": {"decodes": len(rates), "seconds": round(per_rate_time, 3)},
+            "onePass": {"decodes": 1, "seconds": round(multi_time, 3)}}
+
+def benchmark_resample(seconds=300, framerate=24000, target_rate=16000, work_dir=None):
+    """Stored size, render time and re-analysis time at source format vs resampled mono"""
+    params, content = synthetic_narration(seconds, framerate, n_channels=2)
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        source = os.path.join(tmp, 'tts.wav')
+        write_wav_atomic(source, params, content)
+        report = {"benchmark": "resample", "audioSeconds": seconds, "source": f"{framerate} Hz stereo",
+                  "target": f"{target_rate} Hz mono"}
+        results = {}
+        for label, kwargs in (("original", {}), ("resampled", {"target_rate": target_rate, "downmix": True})):
+            dest = os.path.join(tmp, f'{label}.wav')
+            t0 = time.perf_counter()
+            results[label] = analyze_audio(source, 0.9, output_path=dest, **kwargs)
+            render_time = time.perf_counter() - t0
+            # Later passes (re-analysis, packaging, catalog) read the stored file
+            t0 = time.perf_counter()
+            analyze_audio(dest)
+            report[label] = {"bytes": os.path.getsize(dest), "renderSeconds": round(render_time, 3),
+                             "reanalysisSeconds": round(time.perf_counter() - t0, 3)}
+    report["syncIdentical"] = results["original"] == results["resampled"]
+    report["sizeRatio"] = round(report["resampled"]["bytes"] / report["original"]["bytes"], 3)
+    return report
+
+def benchmark_codec(seconds=60, framerate=48000, n_channels=2, repeats=3):
+    """Decode/encode throughput of every supported sample format (MB/s of PCM payload)"""
+    rng = np.random.default_rng(0)
+    n = seconds * framerate * n_channels
+    formats = [pcm_params(n_channels, 1, framerate), pcm_params(n_channels, 2, framerate),
+               pcm_params(n_channels, 3, framerate), pcm_params(n_channels, 4, framerate),
+               pcm_params(n_channels, 4, framerate, is_float=True)]
+    report = {"benchmark": "codec", "audioSeconds": seconds, "framerate": framerate, "channels": n_channels}
+    for params in formats:
+        samples = (rng.uniform(-0.9, 0.9, n) * full_scale(params)).astype(np.float32)
+        content = encode_pcm(samples, params)
+        decode_time = min(timed(decode_pcm, content, params) for _ in range(repeats))
+        encode_time = min(timed(encode_pcm, samples, params) for _ in range(repeats))
+        mb = len(content) / 1e6
+        report[format_label(params)] = {"bytes": len(content),
+                                        "decodeMBps": round(mb / decode_time, 1),
+                                        "encodeMBps": round(mb / encode_time, 1)}
+    return report
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - t0
+
+def benchmark_workers(seconds=3600, speed=0.9, max_workers=None, work_dir=None):
+    """Serial vs process-pool stretch+analysis of one long narration (default 60 minutes)"""
+    max_workers = max_workers or os.cpu_count() or 1
+    params, content = synthetic_narration(seconds)
+    report = {"benchmark": "workers", "audioSeconds": seconds, "speed": speed, "cpus": os.cpu_count(), "runs": {}}
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        source = os.path.join(tmp, 'tts.wav')
+        write_wav_atomic(source, params, content)
+        del content
+        reference = None
+        for workers in range(1, max_workers + 1):
+            dest = os.path.join(tmp, f'out_{workers}.wav')
+            t0 = time.perf_counter()
+            result = analyze_audio(source, speed, output_path=dest, workers=workers)
+            elapsed = time.perf_counter() - t0
+            with open(dest, 'rb') as f:
+                digest = hash(f.read())
+            os.unlink(dest)
+            if reference is None:
+                reference = (result, digest, elapsed)
+            report["runs"][str(workers)] = {
+                "seconds": round(elapsed, 3),
+                "speedup": round(reference[2] / elapsed, 2),
+                "identical": result == reference[0] and digest == reference[1]
+            }
+    return report
+
+def benchmark_vad(seconds=600, framerate=48000, repeats=3, work_dir=None):
+    """Full-resolution vs envelope VAD on a stored narration (default 10 minutes at 48 kHz).
+
+    Timed twice: analysis only, and with --output as generateAudio runs it
+    (speed 1.0, the narration is written to its final place). `readSeconds`
+    is a plain read() of the file, which the full path starts with; the
+    fast path maps 16-bit files instead, so it can finish below it.
+    """
+    params, content = synthetic_narration(seconds, framerate)
+    report = {"benchmark": "vad", "audioSeconds": seconds, "framerate": framerate, "kernels": kernel_backend(),
+              "envelopeBlockFrames": envelope_block(framerate, int(framerate * 0.02))}
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        source = os.path.join(tmp, 'tts.wav')
+        write_wav_atomic(source, params, content)
+        del content
+        read = lambda: open(source, 'rb').read()
+        report["readSeconds"] = round(min(timed(read) for _ in range(repeats)), 4)
+        results, outputs = {}, {}
+        for vad in VAD_MODES:
+            results[vad] = analyze_audio(source, vad=vad)
+            elapsed = min(timed(analyze_audio, source, 1.0, None, None, None, None, False, None, vad)
+                          for _ in range(repeats))
+            dest = os.path.join(tmp, f'{vad}.wav')
+            copied = min(timed(analyze_audio, source, 1.0, dest, None, None, None, False, None, vad)
+                         for _ in range(repeats))
+            with open(dest, 'rb') as f:
+                outputs[vad] = hash(f.read())
+            report[vad] = {"seconds": round(elapsed, 4), "realtimeFactor": round(seconds / elapsed),
+                           "withOutputSeconds": round(copied, 4)}
+    full, fast = results["full"], results["fast"]
+    report["speedup"] = round(report["full"]["seconds"] / report["fast"]["seconds"], 2)
+    report["speedupWithOutput"] = round(report["full"]["withOutputSeconds"] / report["fast"]["withOutputSeconds"], 2)
+    report["identical"] = full == fast and outputs["full"] == outputs["fast"]
+    # Boundary error actually observed; the documented bound is one 20ms window
+    edges = lambda r: [r["start"], r["end"]] + [t for sil in r["silences"] for t in (sil["start"], sil["end"])]
+    if len(full["silences"]) == len(fast["silences"]):
+        report["maxBoundaryErrorSeconds"] = max(abs(a - b) for a, b in zip(edges(full), edges(fast)))
+    return report
+
+def cold_run(source, speed, backend, cache_dir):
+    """Wall time of one analyzer process on `source`, as generateAudio starts it"""
+    env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+    command = [sys.executable, os.path.abspath(__file__), source, str(speed),
+               "--output", source + ".out.wav", "--kernels", backend]
+    t0 = time.perf_counter()
+    subprocess.run(command, env=env, capture_output=True, check=True)
+    return time.perf_counter() - t0
+
+def benchmark_cold_start(clip_seconds=60, speed=0.9, work_dir=None):
+    """One analyzer process per backend on a clip: Numba with an empty kernel cache, then cached"""
+    params, content = synthetic_narration(clip_seconds)
+    report = {"clipSeconds": clip_seconds}
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        source = os.path.join(tmp, 'tts.wav')
+        write_wav_atomic(source, params, content)
+        cache_dir = os.path.join(tmp, 'numba_cache')
+        report["numpySeconds"] = round(cold_run(source, speed, "numpy", cache_dir), 3)
+        if numba is not None:
+            report["numbaCompileSeconds"] = round(cold_run(source, speed, "numba", cache_dir), 3)
+            report["numbaCachedSeconds"] = round(cold_run(source, speed, "numba", cache_dir), 3)
+    return report
+
+def benchmark_kernels(seconds=300, speed=0.9, repeats=3):
+    """OLA, window energy and silence scan on each available kernel backend.
+
+    The warm loop times the kernels alone, compiled. `coldStart` times
+    whole analyzer processes on a short clip, the way generateAudio runs
+    one per narration: imports, kernel compilation or cache load included.
+    """
+    params, content = synthetic_narration(seconds)
+    framerate = params.framerate
+    data, _ = decode_samples(content, params)
+    window_size = int(framerate * 0.02)
+    n_windows = len(data) // window_size
+    max_val = full_scale(params)
+    previous = os.environ.get(KERNELS_ENV)
+    report = {"benchmark": "kernels", "audioSeconds": seconds, "speed": speed,
+              "active": kernel_backend(), "numba": kernel_info()["numba"], "backends": {}}
+    outputs = {}
+    try:
+        for backend in KERNEL_BACKENDS:
+            if backend == "numba" and numba is None:
+                continue
+            use_kernels(backend)
+            # First calls compile the Numba kernels; time the steady state
+            stretch_audio(data[:framerate], speed, framerate)
+            analyze_signal(data[:framerate], framerate, max_val)
+            stretched = stretch_audio(data, speed, framerate)
+            energies = window_energies(data, max_val, window_size, n_windows)
+            is_speech = energies > max(np.mean(energies) * 0.15, 0.005)
+            outputs[backend] = (stretched, energies, silence_runs(is_speech))
+            report["backends"][backend] = {
+                "olaSeconds": round(min(timed(stretch_audio, data, speed, framerate) for _ in range(repeats)), 4),
+                "energySeconds": round(min(timed(window_energies, data, max_val, window_size, n_windows)
+                                           for _ in range(repeats)), 4),
+                "silenceSeconds": round(min(timed(silence_runs, is_speech) for _ in range(repeats)), 4)}
+    finally:
+        if previous is None:
+            os.environ.pop(KERNELS_ENV, None)
+        else:
+            os.environ[KERNELS_ENV] = previous
+    if len(outputs) == 2:
+        (s1, e1, r1), (s2, e2, r2) = outputs["numpy"], outputs["numba"]
+        report["identical"] = bool(np.array_equal(s1, s2) and np.array_equal(e1, e2) and
+                                   all(np.array_equal(a, b) for a, b in zip(r1, r2)))
+    report["coldStart"] = benchmark_cold_start(speed=speed)
+    return report
+
+def benchmark_prosody(seconds=300, framerate=24000, repeats=3, work_dir=None):
+    """Cost of the prosody stage on top of the base analysis of a stored narration"""
+    params, content = synthetic_narration(seconds, framerate)
+    report = {"benchmark": "prosody", "audioSeconds": seconds, "framerate": framerate,
+              "framesPerFftCall": PROSODY_BLOCK_FRAMES}
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        source = os.path.join(tmp, 'tts.wav')
+        write_wav_atomic(source, params, content)
+        base = min(timed(analyze_audio, source) for _ in range(repeats))
+        with_prosody = min(timed(analyze_audio, source, 1.0, None, None, None, None, False, None, "full", True)
+                           for _ in range(repeats))
+        result = analyze_audio(source, prosody=True)
+    _, mono_data = decode_samples(content, params)
+    features = min(timed(analyze_prosody, mono_data, framerate, full_scale(params), result)
+                   for _ in range(repeats))
+    # Only the speech windows are transformed
+    n_frames = sum(int(round(end / 0.02)) - int(round(start / 0.02)) for start, end in speech_spans(result))
+    report.update({"baseSeconds": round(base, 4), "withProsodySeconds": round(with_prosody, 4),
+                   "overhead": round(with_prosody / base, 2), "featureSeconds": round(features, 4),
+                   "speechWindows": n_frames, "windows": len(mono_data) // int(framerate * 0.02),
+                   "framesPerSecond": round(n_frames / features), "segments": len(result["prosody"]["segments"])})
+    return report
+
+BENCHMARKS = {
+    "codec": benchmark_codec,
+    "io": benchmark_io,
+    "kernels": benchmark_kernels,
+    "prosody": benchmark_prosody,
+    "rates": benchmark_rates,
+    "resample": benchmark_resample,
+    "vad": benchmark_vad,
+    "workers": benchmark_workers,
+}
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Stretch and analyze a narration WAV, printing sync JSON on stdout")
+    parser.add_argument("source", nargs="?", help="WAV path, or '-' to read from stdin")
+    parser.add_argument("speed", nargs="?", default="1.0", help="Playback speed factor (default 1.0)")
+    parser.add_argument("--output", help="Destination of the final WAV (written once, atomically)")
+    parser.add_argument("--rates", metavar="R1,R2,...",
+                        help="Render one file per speed (e.g. 0.75,0.9,1,1.1) plus a combined sync manifest; needs --output")
+    parser.add_argument("--segment", nargs="?", type=float, const=SEGMENT_MIN_SECONDS, metavar="MIN_SECONDS",
+                        help=f"Also cut the result into silence-aligned segments with a JSON manifest (default {SEGMENT_MIN_SECONDS:g}s minimum)")
+    parser.add_argument("--resample", type=int, metavar="RATE",
+                        help="Store the result at this sample rate (e.g. 22050 or 16000); sync data is unchanged")
+    parser.add_argument("--mono", action="store_true", help="Store the result downmixed to mono")
+    parser.add_argument("--workers", type=int, metavar="N",
+                        help="Split one long narration across N processes (same result as serial)")
+    parser.add_argument("--text-file", metavar="PATH",
+                        help="Narration text (UTF-8): reports words/syllables per second of speech")
+    parser.add_argument("--target-wps", type=float, metavar="RATE",
+                        help="Stretch to this many words per second of speech instead of using SPEED; needs --text-file")
+    parser.add_argument("--sprite", metavar="STORY_JSON",
+                        help="Story (or paragraph list) JSON: cut the isKeyStep paragraphs into an audio sprite")
+    parser.add_argument("--game-clips", metavar="DIR",
+                        help="With --sprite: pack gameText renderings named <paragraph index>.wav into a second sprite")
+    parser.add_argument("--prosody", action="store_true",
+                        help="Add per-segment pitch, spectral centroid and RMS summaries to the sync JSON")
+    parser.add_argument("--vad", choices=VAD_MODES, default="full",
+                        help="'fast' detects speech on a ~1ms envelope in one pass over the file (boundaries within one 20ms window)")
+    parser.add_argument("--pcm", metavar="RATE,CHANNELS,SAMPWIDTH",
+                        help="stdin carries headerless PCM with this format instead of a WAV stream")
+    parser.add_argument("--benchmark", choices=sorted(BENCHMARKS), help="Run a benchmark on synthetic audio")
+    parser.add_argument("--kernels", choices=KERNEL_BACKENDS,
+                        help=f"Kernel backend for this run (default: ${KERNELS_ENV}, or numba when installed)")
+    parser.add_argument("--kernel-info", action="store_true", help="Print the active kernel backend and exit")
+    return parser
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
+    args = build_arg_parser().parse_args()
+    if args.kernels:
+        try:
+            use_kernels(args.kernels)
+        except ValueError as e:
+            print(json.dumps({"error": str(e)}))
+            sys.exit(0)
+
+    if args.kernel_info:
+        print(json.dumps(kernel_info()))
+    elif args.benchmark:
+        print(json.dumps(BENCHMARKS[args.benchmark]()))
+    elif not args.source:
         print(json.dumps({"error": "No path provided"}))
+    elif args.rates:
+        if not args.output:
+            print(json.dumps({"error": "--rates needs --output"}))
+        else:
+            try:
+                rates = [float(r) for r in args.rates.split(',') if r.strip()]
+                result = render_renditions(args.source, rates, args.output, pcm_spec=args.pcm,
+                                            segment_seconds=args.segment, target_rate=args.resample,
+                                            downmix=args.mono, workers=args.workers, vad=args.vad)
+            except ValueError:
+                result = {"error": f"Invalid rates '{args.rates}'"}
+            print(json.dumps(result))
     else:
-        path = sys.argv[1]
         speed = 1.0
-        if len(sys.argv) > 2:
-            try:
-                speed = float(sys.argv[2])
-            except:
-                pass
-        
-        result = analyze_audio(path, speed)
+        try:
+            speed = float(args.speed)
+        except ValueError:
+            pass
+
+        text = None
+        paragraphs = None
+        try:
+            if args.text_file:
+                with open(args.text_file, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            if args.sprite:
+                with open(args.sprite, 'r', encoding='utf-8') as f:
+                    story = json.load(f)
+                paragraphs = story if isinstance(story, list) else story.get("paragraphs") or []
+        except (OSError, ValueError) as e:
+            result = {"error": f"Cannot read input file: {e}"}
+        else:
+            result = analyze_audio(args.source, speed, output_path=args.output, pcm_spec=args.pcm,
+                                   segment_seconds=args.segment, target_rate=args.resample, downmix=args.mono,
+                                   workers=args.workers, vad=args.vad, prosody=args.prosody,
+                                   text=text, target_wps=args.target_wps, paragraphs=paragraphs,
+                                   game_clips_dir=args.game_clips)
         print(json.dumps(result))
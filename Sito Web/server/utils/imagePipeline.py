@@ -0,0 +1,258 @@
+import json
+import os
+import re
+import time
+import base64
+import hashlib
+import argparse
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+
+from audioAnalyzer import write_json_atomic
+
+# Optional: Pillow does the decoding and encoding (pip install Pillow)
+try:
+    from PIL import Image, features
+except ImportError:
+    Image = None
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Paragraph images and covers saved by uploadMiddleware.js
+DEFAULT_UPLOADS_DIR = os.path.join(UTILS_DIR, '..', 'uploads')
+
+# Variants and their index live under uploads/ so express serves them as-is
+VARIANTS_DIRNAME = 'variants'
+INDEX_NAME = 'index.json'
+
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+
+# Responsive widths (phone, tablet, tablet landscape / desktop); never upscaled
+VARIANT_WIDTHS = (320, 640, 1280)
+VARIANT_QUALITY = 80
+VARIANT_FORMATS = {"webp": "WEBP", "avif": "AVIF"}
+DEFAULT_FORMAT = "webp"
+
+# <hash prefix>_<width>.<format>, as written by process_image
+VARIANT_NAME_RE = re.compile(r'^[0-9a-f]{16}_\d+\.(?:webp|avif)$')
+
+# Blurred placeholder shown while the real variant loads, inlined as a data URI
+PLACEHOLDER_WIDTH = 16
+PLACEHOLDER_QUALITY = 30
+
+# Bytes per read when hashing a source image
+HASH_CHUNK_BYTES = 1 << 20
+
+def pillow_error():
+    """None when Pillow is usable, else the message to report"""
+    if Image is None:
+        return "Pillow is not installed (pip install Pillow)"
+    return None
+
+def format_supported(fmt):
+    return Image is not None and features.check(fmt)
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def list_sources(uploads_dir):
+    """Images at the top of uploads/ (audio and generated variants live in subdirectories)"""
+    return sorted(entry.path for entry in os.scandir(uploads_dir)
+                  if entry.is_file() and entry.name.lower().endswith(SOURCE_EXTENSIONS))
+
+# ========================================
+# WORKER (one source image -> variants + placeholder)
+# ========================================
+
+def load_rgb(path):
+    """Decode the first frame, keeping alpha only when the image has it"""
+    with Image.open(path) as img:
+        img.seek(0)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        return img.convert('RGBA' if has_alpha else 'RGB')
+
+def resized(img, width):
+    height = max(round(img.height * width / img.width), 1)
+    return img.resize((width, height), Image.LANCZOS)
+
+def variant_widths(source_width, widths=VARIANT_WIDTHS):
+    """Target widths below the source width, or the source width alone for small images"""
+    chosen = [w for w in widths if w < source_width]
+    return chosen or [source_width]
+
+def process_image(path, digest, out_dir, fmt=DEFAULT_FORMAT, widths=VARIANT_WIDTHS, quality=VARIANT_QUALITY):
+    """Write the variants of one image, named by content hash so identical uploads share them.
+
+    Each file is written to a temporary name and renamed, so a crash never
+    leaves a truncated variant behind. Returns the index entry.
+    """
+    pil_format = VARIANT_FORMATS[fmt]
+    img = load_rgb(path)
+    variants = []
+    for width in variant_widths(img.width, widths):
+        frame = img if width == img.width else resized(img, width)
+        name = f"{digest[:16]}_{width}.{fmt}"
+        dest = os.path.join(out_dir, name)
+        tmp_path = os.path.join(out_dir, f".partial_{os.getpid()}_{name}")
+        frame.save(tmp_path, pil_format, quality=quality)
+        os.replace(tmp_path, dest)
+        variants.append({"width": width, "height": frame.height, "file": name, "bytes": os.path.getsize(dest)})
+
+    buf = BytesIO()
+    resized(img, min(PLACEHOLDER_WIDTH, img.width)).save(buf, pil_format, quality=PLACEHOLDER_QUALITY)
+    placeholder = f"data:image/{fmt};base64," + base64.b64encode(buf.getvalue()).decode('ascii')
+
+    return {"hash": digest, "bytes": os.path.getsize(path), "width": img.width, "height": img.height,
+            "format": fmt, "widths": list(widths), "quality": quality, "variants": variants,
+            "placeholder": placeholder}
+
+def safe_process_image(path, digest, out_dir, fmt, widths, quality):
+    try:
+        return process_image(path, digest, out_dir, fmt, widths, quality)
+    except Exception as e:
+        return {"error": str(e)}
+
+# ========================================
+# BATCH
+# ========================================
+
+def load_index(index_path):
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def is_current(entry, digest, fmt, widths, quality, out_dir):
+    """Same content, same encoding settings and every variant still on disk.
+
+    Entries written before the widths and quality were recorded never match,
+    so they are encoded once more.
+    """
+    return entry is not None and entry.get("hash") == digest and entry.get("format") == fmt and \
+        entry.get("widths") == list(widths) and entry.get("quality") == quality and \
+        all(os.path.exists(os.path.join(out_dir, v["file"])) for v in entry.get("variants", []))
+
+def remove_unused_variants(out_dir, index):
+    """Delete variant files no index entry points to (deleted sources, old format); returns the count"""
+    used = {v["file"] for entry in index.values() for v in entry.get("variants", [])}
+    removed = 0
+    for entry in os.scandir(out_dir):
+        if VARIANT_NAME_RE.match(entry.name) and entry.name not in used:
+            os.unlink(entry.path)
+            removed += 1
+    return removed
+
+def optimize_uploads(uploads_dir=DEFAULT_UPLOADS_DIR, fmt=DEFAULT_FORMAT, workers=None, widths=VARIANT_WIDTHS,
+                     force=False, quality=VARIANT_QUALITY):
+    """Generate variants for every new or changed upload and update uploads/variants/index.json.
+
+    Sources are matched to the index by content hash, so renamed or
+    re-uploaded copies of an image are not encoded again. Images are
+    encoded on a process pool; the index is written once, atomically,
+    by this process.
+    """
+    error = pillow_error()
+    if error:
+        return {"error": error}
+    if fmt not in VARIANT_FORMATS or not format_supported(fmt):
+        return {"error": f"Format '{fmt}' is not supported by this Pillow build"}
+    if not 1 <= quality <= 100:
+        return {"error": f"Quality must be between 1 and 100, not {quality}"}
+
+    t0 = time.perf_counter()
+    out_dir = os.path.join(uploads_dir, VARIANTS_DIRNAME)
+    os.makedirs(out_dir, exist_ok=True)
+    index_path = os.path.join(out_dir, INDEX_NAME)
+    index = load_index(index_path)
+    by_hash = {entry["hash"]: entry for entry in index.values() if "hash" in entry}
+
+    sources = list_sources(uploads_dir)
+    # digest -> (first path with that content, every upload name sharing it)
+    todo = {}
+    skipped = 0
+    for path in sources:
+        name = os.path.basename(path)
+        digest = content_hash(path)
+        entry = index.get(name) or by_hash.get(digest)
+        if not force and is_current(entry, digest, fmt, widths, quality, out_dir):
+            index[name] = entry
+            skipped += 1
+        else:
+            todo.setdefault(digest, (path, []))[1].append(name)
+
+    results = {}
+    errors = {}
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {digest: pool.submit(safe_process_image, path, digest, out_dir, fmt, widths, quality)
+                       for digest, (path, _) in todo.items()}
+            for digest, future in futures.items():
+                entry = future.result()
+                names = todo[digest][1]
+                if "error" in entry:
+                    errors.update((name, entry["error"]) for name in names)
+                else:
+                    results[digest] = entry
+                    index.update((name, entry) for name in names)
+
+    # Sources deleted from uploads/ drop out of the index, then variants nobody uses go
+    names = {os.path.basename(p) for p in sources}
+    index = {name: entry for name, entry in index.items() if name in names}
+    write_json_atomic(index_path, index)
+    removed = remove_unused_variants(out_dir, index)
+
+    elapsed = time.perf_counter() - t0
+    source_bytes = sum(e["bytes"] for e in results.values())
+    largest_bytes = sum(max(v["bytes"] for v in e["variants"]) for e in results.values())
+    return {
+        "success": True,
+        "format": fmt,
+        "sources": len(sources),
+        "processed": sum(len(todo[digest][1]) for digest in results),
+        "encoded": len(results),
+        "skipped": skipped,
+        "removedVariants": removed,
+        "errors": errors,
+        "sourceBytes": source_bytes,
+        "variantBytes": sum(v["bytes"] for e in results.values() for v in e["variants"]),
+        # What a client fetching the largest variant instead of the original saves
+        "bytesSaved": source_bytes - largest_bytes,
+        "seconds": round(elapsed, 3),
+        "imagesPerSecond": round(len(results) / elapsed, 2) if results else 0.0,
+        "sourceMBps": round(source_bytes / 1e6 / elapsed, 2) if results else 0.0
+    }
+
+# ========================================
+# CLI
+# ========================================
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Resized variants + placeholder for every story image in uploads/, printing a JSON report")
+    parser.add_argument("--uploads-dir", default=DEFAULT_UPLOADS_DIR, help="Upload directory (default server/uploads)")
+    parser.add_argument("--format", choices=sorted(VARIANT_FORMATS), default=DEFAULT_FORMAT,
+                        help=f"Variant format (default {DEFAULT_FORMAT})")
+    parser.add_argument("--widths", default=','.join(str(w) for w in VARIANT_WIDTHS), metavar="W1,W2,...",
+                        help="Variant widths in pixels (default %(default)s)")
+    parser.add_argument("--quality", type=int, default=VARIANT_QUALITY, help="Encoder quality, 1-100 (default %(default)d)")
+    parser.add_argument("--workers", type=int, metavar="N", help="Encoder processes (default: one per CPU)")
+    parser.add_argument("--force", action="store_true", help="Re-encode images whose variants are up to date")
+    return parser
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    try:
+        widths = tuple(sorted({int(w) for w in args.widths.split(',') if w.strip()}))
+        result = optimize_uploads(args.uploads_dir, args.format, args.workers, widths, args.force, args.quality)
+    except ValueError:
+        result = {"error": f"Invalid widths '{args.widths}'"}
+    except OSError as e:
+        result = {"error": str(e)}
+    print(json.dumps(result))
@@ -0,0 +1,299 @@
+import json
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import argparse
+
+from audioAnalyzer import read_wav_header, format_label, analyze_audio
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Narrations written by generateAudio, and the catalog next to them (outside
+# 'uploads', which express serves as static files)
+DEFAULT_AUDIO_DIR = os.path.join(UTILS_DIR, '..', 'uploads', 'audio')
+DEFAULT_DB_PATH = os.path.join(UTILS_DIR, '..', 'narration_catalog.sqlite')
+
+# URL path under which the stories reference files of the audio dir
+AUDIO_URL_PREFIX = '/uploads/audio/'
+
+# Bytes per read when hashing a file
+HASH_CHUNK_BYTES = 1 << 20
+
+# Files derived from a narration by audioAnalyzer: speed renditions
+# (narration_1_0.75x.wav), delivery segments (narration_1_segments/seg_00000.wav)
+# and game sprites (narration_1_keysteps.wav, narration_1_game.wav)
+RENDITION_RE = re.compile(r'^(?P<root>.+)_(?P<rate>\d+(?:\.\d+)?)x\.wav$')
+SEGMENTS_RE = re.compile(r'^(?P<root>.+)_segments/[^/]+\.wav$')
+SPRITE_RE = re.compile(r'^(?P<root>.+)_(?:keysteps|game)\.wav$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    duration REAL,
+    framerate INTEGER,
+    channels INTEGER,
+    format TEXT,
+    hash TEXT,
+    error TEXT,
+    scanned_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_hash ON files (hash);
+CREATE TABLE IF NOT EXISTS sync (
+    hash TEXT PRIMARY KEY,
+    result TEXT NOT NULL
+);
+"""
+
+# ========================================
+# PROBING (header only, no sample decode)
+# ========================================
+
+def probe_wav(path, size):
+    """Duration and format from the RIFF header; the samples are never read"""
+    with open(path, 'rb') as f:
+        params, data_size = read_wav_header(f)
+        if data_size is None:
+            # Streamed WAV with an open size: the data runs to the end of the file
+            data_size = size - f.tell()
+    frame_size = params.nchannels * params.sampwidth
+    n_frames = data_size // frame_size
+    return {"duration": n_frames / params.framerate if params.framerate else 0.0,
+            "framerate": params.framerate,
+            "channels": params.nchannels,
+            "format": format_label(params)}
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def owner_path(rel_path):
+    """Catalog path of the narration a rendition or segment was derived from (itself otherwise)"""
+    # Segments of a rendition resolve in two steps: segment -> rendition -> narration
+    while True:
+        match = SEGMENTS_RE.match(rel_path) or RENDITION_RE.match(rel_path) or SPRITE_RE.match(rel_path)
+        if not match:
+            return rel_path
+        rel_path = match.group('root') + '.wav'
+
+def rendition_rate(rel_path):
+    """Speed of a rendition file (narration_1_0.75x.wav -> 0.75); None for any other file"""
+    match = RENDITION_RE.match(rel_path)
+    return float(match.group('rate')) if match else None
+
+# ========================================
+# INDEX
+# ========================================
+
+def open_catalog(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    # Path rules stay in Python, the queries group on them in SQL
+    conn.create_function('owner_path', 1, owner_path, deterministic=True)
+    conn.create_function('rendition_rate', 1, rendition_rate, deterministic=True)
+    return conn
+
+def walk_wavs(audio_dir):
+    """(relative path with '/' separators, os.stat_result) of every WAV under `audio_dir`"""
+    for dirpath, dirnames, filenames in os.walk(audio_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            # '.partial_' files are writes in progress (see write_wav_atomic)
+            if not name.lower().endswith('.wav') or name.startswith('.partial_'):
+                continue
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, audio_dir).replace(os.sep, '/')
+            yield rel, os.stat(full)
+
+def update_catalog(conn, audio_dir, with_sync=False):
+    """Bring the index in line with `audio_dir`.
+
+    Files whose size and mtime match the index are skipped without being
+    opened; new or changed files are probed and hashed. With `with_sync`
+    every narration whose content has no cached sync data is also
+    analyzed once (fast VAD) and the result stored; renditions and
+    segments are skipped, their sync data lives in the manifests.
+    """
+    t0 = time.perf_counter()
+    known = {path: (size, mtime_ns) for path, size, mtime_ns in
+             conn.execute("SELECT path, size, mtime_ns FROM files")}
+    seen = set()
+    stats = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0, "errors": 0, "synced": 0}
+
+    for rel, st in walk_wavs(audio_dir):
+        seen.add(rel)
+        if known.get(rel) == (st.st_size, st.st_mtime_ns):
+            stats["unchanged"] += 1
+            continue
+        full = os.path.join(audio_dir, rel)
+        row = {"duration": None, "framerate": None, "channels": None, "format": None, "hash": None, "error": None}
+        try:
+            row.update(probe_wav(full, st.st_size))
+            row["hash"] = file_hash(full)
+        except (OSError, ValueError) as e:
+            row["error"] = str(e)
+            stats["errors"] += 1
+        conn.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, duration, framerate, channels, format, hash, error, scanned_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (rel, st.st_size, st.st_mtime_ns, row["duration"], row["framerate"], row["channels"],
+             row["format"], row["hash"], row["error"], time.time()))
+        stats["updated" if rel in known else "added"] += 1
+
+    gone = [(path,) for path in known if path not in seen]
+    conn.executemany("DELETE FROM files WHERE path = ?", gone)
+    stats["removed"] = len(gone)
+
+    if with_sync:
+        pending = conn.execute(
+            "SELECT MIN(path), hash FROM files WHERE hash IS NOT NULL "
+            "AND hash NOT IN (SELECT hash FROM sync) GROUP BY hash").fetchall()
+        for rel, digest in pending:
+            if owner_path(rel) != rel:
+                continue
+            result = analyze_audio(os.path.join(audio_dir, rel), vad="fast")
+            if "error" not in result:
+                conn.execute("INSERT OR REPLACE INTO sync (hash, result) VALUES (?, ?)", (digest, json.dumps(result)))
+                stats["synced"] += 1
+
+    conn.commit()
+    stats["seconds"] = round(time.perf_counter() - t0, 3)
+    return stats
+
+# ========================================
+# QUERIES
+# ========================================
+
+def total_hours(conn):
+    """Audio duration of the narrations themselves; `bytes` includes their derived files.
+
+    Renditions, segments and sprites repeat their narration's audio, so
+    every owner is counted once (GROUP BY owner). When the narration file
+    itself is gone, its rendition closest to 1.0x stands in, scaled back
+    by its rate; `fromRenditions` counts those owners.
+    """
+    narrations, duration, from_renditions = conn.execute("""
+        SELECT COUNT(*), COALESCE(SUM(seconds), 0.0), COALESCE(SUM(rate IS NOT NULL), 0) FROM (
+            SELECT MIN(CASE WHEN rate IS NULL THEN -1.0 ELSE ABS(rate - 1.0) END),
+                   COALESCE(duration, 0.0) * COALESCE(rate, 1.0) AS seconds, rate
+            FROM (SELECT path, duration, owner_path(path) AS owner, rendition_rate(path) AS rate FROM files)
+            WHERE path = owner OR rate IS NOT NULL
+            GROUP BY owner)""").fetchone()
+    count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM files").fetchone()
+    return {"files": count, "narrations": narrations, "fromRenditions": from_renditions, "bytes": size,
+            "seconds": round(duration, 3), "hours": round(duration / 3600, 3)}
+
+def duplicates(conn):
+    """Groups of files with identical content; `wastedBytes` is what keeping one of each would free"""
+    groups = []
+    rows = conn.execute(
+        "SELECT hash, size, GROUP_CONCAT(path, char(10)) FROM files WHERE hash IS NOT NULL "
+        "GROUP BY hash HAVING COUNT(*) > 1 ORDER BY size DESC")
+    for digest, size, paths in rows:
+        paths = sorted(paths.split('\n'))
+        groups.append({"hash": digest, "bytes": size, "paths": paths})
+    return {"groups": groups, "wastedBytes": sum(g["bytes"] * (len(g["paths"]) - 1) for g in groups)}
+
+def load_story_export(export_path):
+    """Story documents from a mongoexport file: a JSON array, one document, or one document per line"""
+    with open(export_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+        return data if isinstance(data, list) else [data]
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def story_audio_refs(stories, url_prefix=AUDIO_URL_PREFIX):
+    """Catalog paths referenced by the stories (narration and paragraph media)"""
+    refs = set()
+    for story in stories:
+        urls = [story.get("narrationUrl"), story.get("coverImage")]
+        urls += [p.get("mediaUrl") for p in story.get("paragraphs") or [] if isinstance(p, dict)]
+        for url in urls:
+            if isinstance(url, str) and url_prefix in url:
+                rel = url.split(url_prefix, 1)[1].split('?', 1)[0].split('#', 1)[0]
+                if rel:
+                    refs.add(rel)
+    return refs
+
+def orphans(conn, refs):
+    """Indexed files no story references (derived files follow their narration), and references with no file"""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS refs (path TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM refs")
+    conn.executemany("INSERT OR IGNORE INTO refs (path) VALUES (?)", [(r,) for r in refs])
+    orphaned = [{"path": path, "bytes": size}
+                for path, size in conn.execute(
+                    "SELECT path, size FROM files WHERE path NOT IN (SELECT path FROM refs) ORDER BY path")
+                if owner_path(path) not in refs]
+    missing = [path for (path,) in conn.execute(
+        "SELECT path FROM refs WHERE path NOT IN (SELECT path FROM files) ORDER BY path")]
+    return {"orphans": orphaned, "orphanBytes": sum(o["bytes"] for o in orphaned), "missing": missing}
+
+def cached_sync(conn, rel_path):
+    row = conn.execute(
+        "SELECT s.result FROM files f JOIN sync s ON s.hash = f.hash WHERE f.path = ?", (rel_path,)).fetchone()
+    return json.loads(row[0]) if row else {"error": f"No cached sync data for '{rel_path}'"}
+
+# ========================================
+# CLI
+# ========================================
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Header-only SQLite catalog of the narration WAVs, printing JSON on stdout")
+    parser.add_argument("--audio-dir", default=DEFAULT_AUDIO_DIR, help="Directory of the narrations (default uploads/audio)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="SQLite index file (default server/narration_catalog.sqlite)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update = commands.add_parser("update", help="Index new and changed files (unchanged size+mtime are skipped)")
+    update.add_argument("--sync", action="store_true", help="Also analyze and cache sync data for new content")
+
+    commands.add_parser("hours", help="Total narration duration (derived files not counted twice) and size")
+    commands.add_parser("duplicates", help="Files with identical content")
+
+    orphan = commands.add_parser("orphans", help="Files not referenced by any story in an export")
+    orphan.add_argument("export", help="mongoexport of the stories collection (JSON array or JSON lines)")
+    orphan.add_argument("--url-prefix", default=AUDIO_URL_PREFIX,
+                        help=f"URL path of the audio dir in story records (default {AUDIO_URL_PREFIX})")
+
+    sync = commands.add_parser("sync", help="Cached sync data of one indexed file")
+    sync.add_argument("path", help="Path relative to the audio dir")
+    return parser
+
+def run(args):
+    if not os.path.isdir(args.audio_dir):
+        return {"error": f"Audio directory not found: {args.audio_dir}"}
+    conn = open_catalog(args.db)
+    try:
+        if args.command == "update":
+            return update_catalog(conn, args.audio_dir, args.sync)
+        t0 = time.perf_counter()
+        if args.command == "hours":
+            result = total_hours(conn)
+        elif args.command == "duplicates":
+            result = duplicates(conn)
+        elif args.command == "orphans":
+            result = orphans(conn, story_audio_refs(load_story_export(args.export), args.url_prefix))
+        else:
+            return cached_sync(conn, args.path)
+        result["queryMs"] = round((time.perf_counter() - t0) * 1000, 2)
+        return result
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    try:
+        result = run(args)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        result = {"error": str(e)}
+    print(json.dumps(result))
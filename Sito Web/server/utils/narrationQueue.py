@@ -0,0 +1,587 @@
+import sys
+import json
+import os
+import time
+import random
+import shutil
+import signal
+import hashlib
+import sqlite3
+import tempfile
+import argparse
+import platform
+import threading
+import subprocess
+from contextlib import contextmanager
+
+import numpy as np
+
+from audioAnalyzer import WavParams, write_wav_atomic, render_renditions, rendition_path
+from storageSweeper import read_env_value
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(UTILS_DIR, '..')
+
+# Queue database and per-job output dirs (temp_audio/queue/<job id>; the
+# storage sweeper only touches temp_audio/audio_<ts> dirs)
+DEFAULT_DB_PATH = os.path.join(SERVER_DIR, 'narration_queue.sqlite')
+DEFAULT_JOBS_DIR = os.path.join(SERVER_DIR, 'temp_audio', 'queue')
+
+# Every worker loads its own copy of the model: size this to the RAM, not the cores
+DEFAULT_WORKERS = 1
+
+# Same limit generateAudio puts on a VibeVoice run
+JOB_TIMEOUT_SECONDS = 15 * 60
+
+# A running job whose worker died is picked up again once its lease expires,
+# at most this many runs in total
+LEASE_SECONDS = JOB_TIMEOUT_SECONDS + 60
+MAX_ATTEMPTS = 2
+
+# Idle workers and `status --wait` check the database this often
+POLL_SECONDS = 0.25
+
+# Bumped when the tables change. The queue only holds work in flight, so an
+# older database is dropped and recreated instead of migrated
+SCHEMA_VERSION = 2
+
+# Base name of the speed renditions a job writes next to its synthesis
+# (narration_0.9x.wav, see rendition_path)
+RENDITION_NAME = 'narration.wav'
+
+# Same model and defaults as generateAudio: the checkout setup.py clones next to
+# server/, with its env1 venv, unless the .env says otherwise
+DEFAULT_VIBEVOICE_PATH = os.path.normpath(os.path.join(SERVER_DIR, '..', 'VibeVoice'))
+VENV_DIRNAME = 'env1'
+VIBEVOICE_MODEL = 'microsoft/VibeVoice-Realtime-0.5B'
+VIBEVOICE_SCRIPT = os.path.join('demo', 'realtime_model_inference_from_file.py')
+DEFAULT_SPEAKER = 'it-Spk0_woman'
+LAUNCHER_ENV = ('TORCH_NUM_THREADS', 'TORCH_NUM_INTEROP_THREADS', 'VIBEVOICE_QUANTIZED_MODEL')
+
+# Stub synthesizer: VibeVoice's output format, one tone burst per word
+STUB_PARAMS = WavParams(1, 2, 24000, 0, 'NONE', 'not compressed')
+STUB_SECONDS = 0.2
+STUB_WORD_SECONDS = 0.3
+STUB_GAP_SECONDS = 0.1
+
+# A job is one synthesis; every submission is a request on a job with its own
+# speed, applied after the shared synthesis
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedupe_key TEXT NOT NULL,
+    text TEXT NOT NULL,
+    speaker TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_next ON jobs (status, priority DESC, id);
+-- One in-flight job per (text, speaker): concurrent submits cannot both insert
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_in_flight ON jobs (dedupe_key) WHERE status IN ('queued', 'running');
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    speed REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS requests_job ON requests (job_id, speed);
+"""
+
+JOB_FIELDS = ("status", "priority", "attempts", "speaker", "result", "error", "created_at", "started_at",
+              "finished_at", "lease_until")
+
+# ========================================
+# QUEUE
+# ========================================
+
+def open_queue(db_path):
+    # Autocommit: every write below opens its own BEGIN IMMEDIATE transaction
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with transaction(conn):
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS requests")
+            conn.execute("DROP TABLE IF EXISTS jobs")
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        for statement in SCHEMA.split(';'):
+            if statement.strip():
+                conn.execute(statement)
+    return conn
+
+@contextmanager
+def transaction(conn):
+    """BEGIN IMMEDIATE ... COMMIT: takes the write lock up front so read-then-write cannot race"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def dedupe_key(text, speaker):
+    """Requests with the same text and voice share one synthesis, whatever their speed"""
+    payload = json.dumps([text, speaker], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def speed_label(speed):
+    """Key of a speed in a job's renditions, as in rendition_path (0.9 -> '0.9')"""
+    return f"{speed:g}"
+
+def submit(conn, text, speaker=DEFAULT_SPEAKER, speed=1.0, priority=0):
+    """Queue a narration, or join the synthesis of the same text and voice already in flight.
+
+    A joined job keeps its place but takes the higher of the two
+    priorities. Returns the request id (what `status` takes), its job,
+    the job status and whether it was joined.
+    """
+    if not text or not text.strip():
+        raise ValueError("Empty narration text")
+    if not speed > 0:
+        raise ValueError(f"Speed must be positive, not {speed}")
+    key = dedupe_key(text, speaker)
+    now = time.time()
+    with transaction(conn):
+        row = conn.execute("SELECT id, status FROM jobs WHERE dedupe_key = ? AND status IN ('queued', 'running')",
+                           (key,)).fetchone()
+        if row:
+            conn.execute("UPDATE jobs SET priority = MAX(priority, ?) WHERE id = ?", (priority, row[0]))
+            job_id, status = row
+        else:
+            job_id = conn.execute("INSERT INTO jobs (dedupe_key, text, speaker, priority, created_at) "
+                                  "VALUES (?, ?, ?, ?, ?)", (key, text, speaker, priority, now)).lastrowid
+            status = "queued"
+        request_id = conn.execute("INSERT INTO requests (job_id, speed, created_at) VALUES (?, ?, ?)",
+                                  (job_id, round(float(speed), 3), now)).lastrowid
+    return {"id": request_id, "job": job_id, "status": status, "deduped": row is not None}
+
+def job_speeds(conn, job_id):
+    return [speed for (speed,) in conn.execute(
+        "SELECT DISTINCT speed FROM requests WHERE job_id = ? ORDER BY speed", (job_id,))]
+
+def claim(conn, worker):
+    """Next job for `worker` (highest priority, then oldest), or None when the queue is empty"""
+    now = time.time()
+    with transaction(conn):
+        # Out of retries: the last worker died while running it
+        conn.execute("UPDATE jobs SET status = 'failed', error = 'worker lost', finished_at = ? "
+                     "WHERE status = 'running' AND lease_until < ? AND attempts >= ?", (now, now, MAX_ATTEMPTS))
+        row = conn.execute(
+            "SELECT id, text, speaker, priority, attempts FROM jobs "
+            "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+            "ORDER BY priority DESC, id LIMIT 1", (now,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                     "lease_until = ?, started_at = ? WHERE id = ?", (worker, now + LEASE_SECONDS, now, row[0]))
+    return {"id": row[0], "text": row[1], "speaker": row[2], "priority": row[3], "attempt": row[4] + 1}
+
+def record_outcome(conn, job_id, worker, result, error):
+    """UPDATE of finish(), inside the caller's transaction"""
+    cursor = conn.execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL "
+        "WHERE id = ? AND worker = ? AND status = 'running'",
+        ("failed" if error else "done", json.dumps(result) if result is not None else None,
+         error, time.time(), job_id, worker))
+    return cursor.rowcount == 1
+
+def finish(conn, job_id, worker, result=None, error=None):
+    """Record the outcome; ignored if the lease expired and another worker took the job over"""
+    with transaction(conn):
+        return record_outcome(conn, job_id, worker, result, error)
+
+def complete(conn, job_id, worker, result):
+    """finish() a synthesis unless requests for speeds missing from result["renditions"] joined it.
+
+    Returns the missing speeds (nothing is recorded then), or [] once the
+    job is done. The check and the update share one write lock, so a
+    request joining right now either makes this call return its speed or
+    finds the job done and starts a new one.
+    """
+    with transaction(conn):
+        missing = [speed for speed in job_speeds(conn, job_id) if speed_label(speed) not in result["renditions"]]
+        if not missing:
+            record_outcome(conn, job_id, worker, result, None)
+    return missing
+
+def job_status(conn, request_id):
+    """State of a request: its job's, with `result.path` the narration at the request's speed"""
+    row = conn.execute(
+        f"SELECT r.id, r.job_id, r.speed, {', '.join('j.' + field for field in JOB_FIELDS)} "
+        "FROM requests r JOIN jobs j ON j.id = r.job_id WHERE r.id = ?", (request_id,)).fetchone()
+    if row is None:
+        return {"error": f"Request {request_id} not found"}
+    job = dict(zip(("id", "job", "speed") + JOB_FIELDS, row))
+    job["submissions"] = conn.execute("SELECT COUNT(*) FROM requests WHERE job_id = ?", (job["job"],)).fetchone()[0]
+    if job["result"]:
+        result = json.loads(job["result"])
+        job["result"] = {"path": result["renditions"][speed_label(job["speed"])],
+                         "synthesisPath": result["path"], "seconds": result["seconds"]}
+    if job["status"] == "queued":
+        # Jobs a free worker would take first
+        job["ahead"] = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND (priority > ? OR (priority = ? AND id < ?))",
+            (job["priority"], job["priority"], job["job"])).fetchone()[0]
+    return job
+
+def wait_for(conn, request_id, queue_timeout):
+    """Poll until the request's job is done or failed.
+
+    Only time the job spends without a live worker (queued, or left by a
+    dead one) counts against `queue_timeout`: while a worker holds the
+    lease the run is already bounded by JOB_TIMEOUT_SECONDS. Returns the
+    last status seen.
+    """
+    waited = 0.0
+    while True:
+        job = job_status(conn, request_id)
+        if "status" not in job or job["status"] in ("done", "failed"):
+            return job
+        held = job["status"] == "running" and (job["lease_until"] or 0) > time.time()
+        if not held:
+            if waited >= queue_timeout:
+                return job
+            waited += POLL_SECONDS
+        time.sleep(POLL_SECONDS)
+
+def queue_stats(conn):
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    submissions = conn.execute("SELECT COUNT(*) FROM requests").fetchone()[0]
+    jobs = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+    return {"queued": counts.get("queued", 0), "running": counts.get("running", 0),
+            "done": counts.get("done", 0), "failed": counts.get("failed", 0),
+            "submissions": submissions, "deduped": submissions - jobs}
+
+def prune(conn, jobs_dir, max_age):
+    """Delete finished jobs older than `max_age` seconds and their output dirs"""
+    cutoff = time.time() - max_age
+    with transaction(conn):
+        ids = [job_id for (job_id,) in conn.execute(
+            "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))]
+        conn.executemany("DELETE FROM requests WHERE job_id = ?", [(job_id,) for job_id in ids])
+        conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in ids])
+    for job_id in ids:
+        shutil.rmtree(os.path.join(jobs_dir, str(job_id)), ignore_errors=True)
+    return {"deleted": len(ids)}
+
+# ========================================
+# SYNTHESIZERS
+# ========================================
+
+def server_setting(key):
+    """Server process environment first, then the server .env (as dotenv does for node)"""
+    return os.environ.get(key) or read_env_value(key)
+
+def venv_python(vibevoice_path):
+    if platform.system() == 'Windows':
+        return os.path.join(vibevoice_path, VENV_DIRNAME, 'Scripts', 'python.exe')
+    return os.path.join(vibevoice_path, VENV_DIRNAME, 'bin', 'python')
+
+def vibevoice_synthesizer():
+    """Run VibeVoice exactly as generateAudio does, one process per job"""
+    vibevoice_path = server_setting('VIBEVOICE_PATH') or DEFAULT_VIBEVOICE_PATH
+    python_path = server_setting('PYTHON_VENV_PATH') or venv_python(vibevoice_path)
+    script_path = os.path.join(vibevoice_path, VIBEVOICE_SCRIPT)
+    if not os.path.exists(script_path):
+        raise ValueError(f"VibeVoice script not found: {script_path} (set VIBEVOICE_PATH in the server .env)")
+    env = dict(os.environ)
+    for key in LAUNCHER_ENV:
+        value = server_setting(key)
+        if value:
+            env[key] = value
+    if env.get('TORCH_NUM_THREADS'):
+        env['OMP_NUM_THREADS'] = env['MKL_NUM_THREADS'] = env['TORCH_NUM_THREADS']
+    launcher = [os.path.join(UTILS_DIR, 'vibevoiceLauncher.py')] if any(env.get(k) for k in LAUNCHER_ENV) else []
+
+    def synthesize(job, out_dir):
+        text_path = os.path.join(out_dir, 'input.txt')
+        with open(text_path, 'w', encoding='utf-8') as f:
+            f.write(job["text"])
+        command = [python_path] + launcher + [
+            script_path, '--model_path', VIBEVOICE_MODEL,
+            '--txt_path', text_path, '--speaker_name', job["speaker"], '--output_dir', out_dir]
+        proc = subprocess.run(command, cwd=vibevoice_path, env=env, capture_output=True, text=True,
+                              timeout=JOB_TIMEOUT_SECONDS)
+        if proc.returncode != 0:
+            raise RuntimeError(f"VibeVoice exited with {proc.returncode}: {proc.stderr.strip()[-500:]}")
+        wavs = sorted(name for name in os.listdir(out_dir) if name.endswith('.wav'))
+        if not wavs:
+            raise RuntimeError("VibeVoice did not write any WAV file")
+        return os.path.join(out_dir, wavs[0])
+
+    return synthesize
+
+def stub_synthesizer(seconds=STUB_SECONDS):
+    """No model: wait `seconds`, then write a 24 kHz WAV with a tone burst per word.
+
+    The bursts give the analyzer something to find, so the rest of the
+    pipeline can be exercised on machines without VibeVoice.
+    """
+    rate = STUB_PARAMS.framerate
+    t = np.arange(int(STUB_WORD_SECONDS * rate)) / rate
+    burst = (0.3 * np.sin(2 * np.pi * 220 * t) * np.hanning(len(t)) * 32767).astype('<i2')
+    gap = np.zeros(int(STUB_GAP_SECONDS * rate), dtype='<i2')
+
+    def synthesize(job, out_dir):
+        time.sleep(seconds)
+        words = max(1, len(job["text"].split()))
+        frames = np.concatenate([np.concatenate([burst, gap])] * words).tobytes()
+        dest = os.path.join(out_dir, f"input_{job['speaker']}.wav")
+        write_wav_atomic(dest, STUB_PARAMS, frames)
+        return dest
+
+    return synthesize
+
+# ========================================
+# WORKERS
+# ========================================
+
+def render_speeds(path, speeds, out_dir):
+    """Paths of the synthesis at every speed: 1.0 is the synthesis itself, the others one render_renditions pass"""
+    paths = {speed_label(speed): path for speed in speeds if speed == 1.0}
+    rates = [speed for speed in speeds if speed != 1.0]
+    if rates:
+        base = os.path.join(out_dir, RENDITION_NAME)
+        manifest = render_renditions(path, rates, base, vad="fast")
+        if "error" in manifest:
+            raise RuntimeError(f"Speed rendering failed: {manifest['error']}")
+        paths.update((speed_label(rate), os.path.abspath(rendition_path(base, rate))) for rate in rates)
+    return paths
+
+def run_job(conn, job, jobs_dir, synthesize, worker):
+    """Synthesize once, then render the speed of every request on the job (including ones that join meanwhile)"""
+    out_dir = os.path.join(jobs_dir, str(job["id"]))
+    # A retried job starts from an empty dir: the dead run may have left a partial WAV
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    t0 = time.perf_counter()
+    try:
+        path = os.path.abspath(synthesize(job, out_dir))
+        result = {"path": path, "seconds": None, "renditions": {}}
+        missing = job_speeds(conn, job["id"]) or [1.0]
+        while missing:
+            result["renditions"].update(render_speeds(path, missing, out_dir))
+            result["seconds"] = round(time.perf_counter() - t0, 3)
+            missing = complete(conn, job["id"], worker, result)
+    except Exception as e:
+        finish(conn, job["id"], worker, error=str(e) or type(e).__name__)
+
+def worker_loop(db_path, jobs_dir, synthesize, worker, stop, log=None):
+    conn = open_queue(db_path)
+    try:
+        while not stop.is_set():
+            job = claim(conn, worker)
+            if job is None:
+                stop.wait(POLL_SECONDS)
+                continue
+            if log:
+                log(f"{worker}: job {job['id']} (priority {job['priority']}, attempt {job['attempt']})")
+            run_job(conn, job, jobs_dir, synthesize, worker)
+    finally:
+        conn.close()
+
+def start_workers(db_path, jobs_dir, synthesize, count, stop, log=None):
+    # Worker names are unique across processes: finish() matches on them
+    prefix = f"{platform.node()}-{os.getpid()}"
+    threads = [threading.Thread(target=worker_loop, daemon=True,
+                                args=(db_path, jobs_dir, synthesize, f"{prefix}-w{i}", stop, log))
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def serve(db_path, jobs_dir, synthesize, workers):
+    """Process the queue with `workers` concurrent jobs until SIGINT or SIGTERM.
+
+    Running jobs are finished before exiting; queued ones stay in the
+    database for the next start.
+    """
+    os.makedirs(jobs_dir, exist_ok=True)
+    open_queue(db_path).close()
+    stop = threading.Event()
+    log = lambda text: print(text, file=sys.stderr, flush=True)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    threads = start_workers(db_path, jobs_dir, synthesize, workers, stop, log)
+    log(f"Serving {db_path} with {workers} worker(s)")
+    while not stop.wait(1):
+        pass
+    log("Stopping: running jobs are finished first")
+    for thread in threads:
+        thread.join()
+    return {"stopped": True}
+
+# ========================================
+# LOAD TEST
+# ========================================
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+def load_test(requests=200, distinct=40, submitters=8, workers=2, stub_seconds=STUB_SECONDS, seed=0):
+    """Burst of concurrent submissions against a throwaway queue and stub workers.
+
+    `distinct` narrations are drawn at random by `submitters` threads, so
+    identical requests overlap in flight. Checks that no more than
+    `workers` syntheses ever ran at once and that every request got a
+    finished narration.
+    """
+    rng = random.Random(seed)
+    texts = [f"Storia di prova numero {i}. " + "C'era una volta un bambino. " * (1 + i % 5) for i in range(distinct)]
+    # Mostly 1.0x: the other speeds share the synthesis and add one rendition each
+    plan = [(rng.choice(texts), rng.choice(['it-Spk0_woman', 'it-Spk1_man']), rng.choice([1.0, 1.0, 0.9, 1.1]),
+             rng.randint(0, 2)) for _ in range(requests)]
+
+    running, peak, lock = [0], [0], threading.Lock()
+    stub = stub_synthesizer(stub_seconds)
+
+    def synthesize(job, out_dir):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        try:
+            return stub(job, out_dir)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    work_dir = tempfile.mkdtemp(prefix='narration_queue_')
+    db_path, jobs_dir = os.path.join(work_dir, 'queue.sqlite'), os.path.join(work_dir, 'jobs')
+    os.makedirs(jobs_dir)
+    open_queue(db_path).close()
+    stop = threading.Event()
+    threads = start_workers(db_path, jobs_dir, synthesize, workers, stop)
+
+    latencies, outcomes, errors = [], [], []
+
+    def submitter(batch):
+        conn = open_queue(db_path)
+        try:
+            for text, speaker, speed, priority in batch:
+                t0 = time.perf_counter()
+                job = submit(conn, text, speaker, speed, priority)
+                final = wait_for(conn, job["id"], JOB_TIMEOUT_SECONDS)
+                with lock:
+                    latencies.append(time.perf_counter() - t0)
+                    outcomes.append(final)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+        finally:
+            conn.close()
+
+    t0 = time.perf_counter()
+    clients = [threading.Thread(target=submitter, args=(plan[i::submitters],)) for i in range(submitters)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    conn = open_queue(db_path)
+    try:
+        stats = queue_stats(conn)
+    finally:
+        conn.close()
+    # Done, and the narration at the request's own speed is on disk
+    finished = sum(1 for job in outcomes if job.get("status") == "done" and os.path.exists(job["result"]["path"]))
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    jobs = stats["done"] + stats["failed"]
+    return {"ok": not errors and finished == requests and peak[0] <= workers,
+            "requests": requests, "distinct": distinct, "submitters": submitters, "workers": workers,
+            "jobs": jobs, "deduped": stats["deduped"], "finished": finished, "failed": stats["failed"],
+            "errors": errors, "maxConcurrent": peak[0], "seconds": round(elapsed, 3),
+            "jobsPerSecond": round(jobs / elapsed, 2) if elapsed else None,
+            "latency": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                        "max": percentile(latencies, 100)}}
+
+# ========================================
+# CLI
+# ========================================
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="SQLite-backed narration queue: submit jobs, poll them, run the workers; JSON on stdout")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Queue database (default server/narration_queue.sqlite)")
+    parser.add_argument("--jobs-dir", default=DEFAULT_JOBS_DIR, help="Job output dirs (default temp_audio/queue)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sub = commands.add_parser("submit", help="Queue a narration (joins the synthesis of the same text and voice in flight)")
+    text = sub.add_mutually_exclusive_group(required=True)
+    text.add_argument("--text", help="Narration text")
+    text.add_argument("--text-file", help="UTF-8 file with the narration text")
+    sub.add_argument("--speaker", default=DEFAULT_SPEAKER, help="VibeVoice voice (default %(default)s)")
+    sub.add_argument("--speed", type=float, default=1.0,
+                     help="Playback speed, applied to this request after the shared synthesis (default %(default)g)")
+    sub.add_argument("--priority", type=int, default=0, help="Higher runs first (default %(default)d)")
+
+    status = commands.add_parser("status", help="State of a request and its job")
+    status.add_argument("id", type=int, help="Request id printed by submit")
+    status.add_argument("--wait", type=float, metavar="SECONDS",
+                        help="Block until the job finishes; SECONDS bounds the time spent waiting for a worker")
+
+    commands.add_parser("stats", help="Jobs per status and how many submissions were deduped")
+
+    serve_cmd = commands.add_parser("serve", help="Run the workers until interrupted")
+    serve_cmd.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                           help="Concurrent syntheses, each with its own model in RAM (default %(default)d)")
+    serve_cmd.add_argument("--synthesizer", choices=("vibevoice", "stub"), default="vibevoice")
+    serve_cmd.add_argument("--stub-seconds", type=float, default=STUB_SECONDS, help="Stub synthesis time")
+
+    prune_cmd = commands.add_parser("prune", help="Delete finished jobs and their output")
+    prune_cmd.add_argument("--hours", type=float, default=24, help="Keep jobs finished more recently (default %(default)g)")
+
+    load = commands.add_parser("loadtest", help="Concurrent submissions against a throwaway queue with stub workers")
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--distinct", type=int, default=40, help="Different narrations among the requests")
+    load.add_argument("--submitters", type=int, default=8, help="Concurrent clients")
+    load.add_argument("--workers", type=int, default=2)
+    load.add_argument("--stub-seconds", type=float, default=STUB_SECONDS)
+    load.add_argument("--seed", type=int, default=0)
+    return parser
+
+def run(args):
+    if args.command == "loadtest":
+        return load_test(args.requests, args.distinct, args.submitters, args.workers, args.stub_seconds, args.seed)
+    if args.command == "serve":
+        if args.workers < 1:
+            return {"error": "--workers must be at least 1"}
+        synthesize = stub_synthesizer(args.stub_seconds) if args.synthesizer == "stub" else vibevoice_synthesizer()
+        return serve(args.db, args.jobs_dir, synthesize, args.workers)
+    conn = open_queue(args.db)
+    try:
+        if args.command == "submit":
+            if args.text_file:
+                with open(args.text_file, 'r', encoding='utf-8') as f:
+                    text = f.read()
+            else:
+                text = args.text
+            return submit(conn, text, args.speaker, args.speed, args.priority)
+        if args.command == "status":
+            return wait_for(conn, args.id, args.wait) if args.wait else job_status(conn, args.id)
+        if args.command == "stats":
+            return queue_stats(conn)
+        return prune(conn, args.jobs_dir, args.hours * 3600)
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    try:
+        result = run(args)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        result = {"error": str(e)}
+    print(json.dumps(result))
@@ -0,0 +1,242 @@
+import json
+import os
+import re
+import time
+import shutil
+import argparse
+
+from narrationCatalog import DEFAULT_AUDIO_DIR, AUDIO_URL_PREFIX, owner_path, load_story_export, story_audio_refs
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.join(UTILS_DIR, '..')
+
+# Per-request working dirs of generateAudio (temp_audio/audio_<ms timestamp>)
+DEFAULT_TEMP_DIR = os.path.join(SERVER_DIR, 'temp_audio')
+TEMP_DIR_RE = re.compile(r'^audio_(?P<ts>\d+)$')
+
+# Longest a generateAudio request can live: VibeVoice runs for up to 15 minutes,
+# and with NARRATION_QUEUE the request first waits up to 15 minutes in the queue
+# and may see a retry (two leases of 16 minutes, see narrationQueue): about 50
+# minutes in all. Temp dirs older than two hours are left over from a crash
+TEMP_STALE_SECONDS = 2 * 3600
+
+# A narration is written before the story that references it is saved:
+# unreferenced narrations younger than this may still be claimed
+NARRATION_GRACE_SECONDS = 24 * 3600
+
+# Sidecars written next to a narration by audioAnalyzer (manifests; '.m3u8' playlists
+# were written by earlier versions)
+SIDECAR_SUFFIXES = ('.sync.json', '.segments.json', '.sprite.json', '.m3u8')
+
+# Same defaults as setup.py / server .env
+DEFAULT_MONGODB_URI = 'mongodb://localhost:27017/ProgettoTerapia'
+STORY_COLLECTION = 'stories'
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+# ========================================
+# STORY RECORDS
+# ========================================
+
+def read_env_value(key, env_path=os.path.join(SERVER_DIR, '.env')):
+    """Value of `key` in the server .env (the same file setup.py writes), or None"""
+    if not os.path.exists(env_path):
+        return None
+    with open(env_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            name, sep, value = line.strip().partition('=')
+            if sep and name.strip() == key:
+                return value.strip().strip('"\'')
+    return None
+
+def load_mongo_stories(uri):
+    """Story documents straight from MongoDB (needs pymongo); only the media fields are fetched"""
+    try:
+        from pymongo import MongoClient
+        from pymongo.errors import PyMongoError
+    except ImportError:
+        raise ValueError("pymongo is not installed (pip install pymongo); use --export with a mongoexport file")
+    try:
+        client = MongoClient(uri, serverSelectionTimeoutMS=3000)
+        try:
+            db = client.get_default_database(default='ProgettoTerapia')
+            fields = {"narrationUrl": 1, "coverImage": 1, "paragraphs.mediaUrl": 1}
+            return list(db[STORY_COLLECTION].find({}, fields))
+        finally:
+            client.close()
+    except PyMongoError as e:
+        raise ValueError(f"MongoDB error: {e}")
+
+# ========================================
+# SCAN
+# ========================================
+
+def path_size(path):
+    if os.path.isdir(path):
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+        return total
+    return os.path.getsize(path)
+
+def newest_mtime(path):
+    """Latest mtime in a file or tree: a dir still being written to is not stale"""
+    latest = os.path.getmtime(path)
+    if os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in dirnames + filenames:
+                latest = max(latest, os.path.getmtime(os.path.join(dirpath, name)))
+    return latest
+
+def entry_owner(name, is_dir):
+    """Narration (audio-dir relative path) a top-level entry of the audio dir belongs to, or None"""
+    if is_dir:
+        if not name.endswith('_segments'):
+            return None
+        return owner_path(name[:-len('_segments')] + '.wav')
+    for suffix in SIDECAR_SUFFIXES:
+        if name.endswith(suffix):
+            return owner_path(name[:-len(suffix)] + '.wav')
+    if name.lower().endswith('.wav'):
+        return owner_path(name)
+    return None
+
+def stale_temp_dirs(temp_dir, now, max_age=TEMP_STALE_SECONDS):
+    candidates = []
+    if not os.path.isdir(temp_dir):
+        return candidates
+    for entry in sorted(os.scandir(temp_dir), key=lambda e: e.name):
+        match = TEMP_DIR_RE.match(entry.name)
+        if not match or not entry.is_dir():
+            continue
+        # Timestamp in the name is when the request started; files inside may be newer
+        age = now - max(int(match.group('ts')) / 1000, newest_mtime(entry.path))
+        if age >= max_age:
+            candidates.append({"path": entry.path, "bytes": path_size(entry.path), "age": round(age),
+                               "reason": "stale temp dir"})
+    return candidates
+
+def unreferenced_narrations(audio_dir, refs, now, grace=NARRATION_GRACE_SECONDS, temp_age=TEMP_STALE_SECONDS):
+    """Narrations no story references, with their renditions, segments and sidecars.
+
+    Only files following the generateAudio naming (narration_*) are
+    considered: anything else in uploads/audio was put there by hand.
+    Leftover '.partial_' files of interrupted writes go too.
+    """
+    candidates = []
+    if not os.path.isdir(audio_dir):
+        return candidates
+    for entry in sorted(os.scandir(audio_dir), key=lambda e: e.name):
+        is_dir = entry.is_dir()
+        if entry.name.startswith('.partial_') and not is_dir:
+            age = now - entry.stat().st_mtime
+            if age >= temp_age:
+                candidates.append({"path": entry.path, "bytes": entry.stat().st_size, "age": round(age),
+                                   "reason": "interrupted write"})
+            continue
+        owner = entry_owner(entry.name, is_dir)
+        if owner is None or not owner.startswith('narration_') or owner in refs:
+            continue
+        age = now - newest_mtime(entry.path)
+        if age >= grace:
+            candidates.append({"path": entry.path, "bytes": path_size(entry.path), "age": round(age),
+                               "reason": f"unreferenced ({owner})"})
+    return candidates
+
+def plan_sweep(candidates, usage, budget=None):
+    """Everything, or (with a byte `budget`) the oldest candidates until usage fits the budget"""
+    if budget is None:
+        return list(candidates)
+    chosen = []
+    for item in sorted(candidates, key=lambda c: -c["age"]):
+        if usage <= budget:
+            break
+        chosen.append(item)
+        usage -= item["bytes"]
+    return chosen
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+def sweep(audio_dir, temp_dir, stories, dry_run=False, budget=None, url_prefix=AUDIO_URL_PREFIX,
+          grace=NARRATION_GRACE_SECONDS, temp_age=TEMP_STALE_SECONDS):
+    """Reconcile the audio and temp dirs with the story records and delete what nothing needs.
+
+    With `dry_run` nothing is touched and the report lists what would go.
+    With `budget` (bytes) only as much is deleted, oldest first, as it
+    takes to bring both dirs under the budget.
+    """
+    if not stories:
+        # An empty or wrong export would make every narration look unreferenced
+        return {"error": "No story records found; refusing to sweep narrations"}
+    now = time.time()
+    refs = story_audio_refs(stories, url_prefix)
+    candidates = stale_temp_dirs(temp_dir, now, temp_age) + \
+        unreferenced_narrations(audio_dir, refs, now, grace, temp_age)
+    usage = sum(path_size(d) for d in (audio_dir, temp_dir) if os.path.isdir(d))
+    chosen = plan_sweep(candidates, usage, budget)
+
+    deleted, failed = [], []
+    for item in chosen:
+        if dry_run:
+            deleted.append(item)
+            continue
+        try:
+            remove_path(item["path"])
+            deleted.append(item)
+        except OSError as e:
+            failed.append(dict(item, error=str(e)))
+
+    freed = sum(item["bytes"] for item in deleted)
+    report = {"success": True, "dryRun": dry_run, "stories": len(stories), "referenced": len(refs),
+              "candidates": len(candidates), "deleted": deleted, "failed": failed,
+              "freedBytes": freed, "usageBytes": usage, "usageAfterBytes": usage - freed}
+    if budget is not None:
+        report["budgetBytes"] = budget
+        report["overBudget"] = usage - freed > budget
+    return report
+
+# ========================================
+# CLI
+# ========================================
+
+def parse_size(text):
+    """'500M', '2G', '1048576' -> bytes"""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', text, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid size '{text}' (e.g. 500M, 2G)")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Delete stale temp_audio dirs and narrations no story references, printing a JSON report")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--export", help="mongoexport of the stories collection (JSON array or JSON lines)")
+    source.add_argument("--mongo", nargs="?", const="", metavar="URI",
+                        help="Read the stories from MongoDB (default: MONGODB_URI of the server .env); needs pymongo")
+    parser.add_argument("--audio-dir", default=DEFAULT_AUDIO_DIR, help="Narration directory (default uploads/audio)")
+    parser.add_argument("--temp-dir", default=DEFAULT_TEMP_DIR, help="generateAudio working dirs (default temp_audio)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    parser.add_argument("--budget", type=parse_size, metavar="SIZE",
+                        help="Delete only until audio + temp dirs fit in SIZE (e.g. 5G), oldest first")
+    parser.add_argument("--grace-hours", type=float, default=NARRATION_GRACE_SECONDS / 3600,
+                        help="Keep unreferenced narrations younger than this (default %(default)g)")
+    parser.add_argument("--url-prefix", default=AUDIO_URL_PREFIX,
+                        help=f"URL path of the audio dir in story records (default {AUDIO_URL_PREFIX})")
+    return parser
+
+if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    try:
+        if args.export:
+            stories = load_story_export(args.export)
+        else:
+            stories = load_mongo_stories(args.mongo or read_env_value('MONGODB_URI') or DEFAULT_MONGODB_URI)
+        result = sweep(args.audio_dir, args.temp_dir, stories, args.dry_run, args.budget,
+                       args.url_prefix, args.grace_hours * 3600)
+    except (OSError, ValueError) as e:
+        result = {"error": str(e)}
+    print(json.dumps(result))
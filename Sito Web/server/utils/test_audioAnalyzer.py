@@ -0,0 +1,216 @@
+"""Checks of audioAnalyzer on synthetic audio (no TTS needed): python -m pytest server/utils"""
+import io
+import struct
+import wave
+
+import numpy as np
+import pytest
+
+import audioAnalyzer
+from audioAnalyzer import (KERNELS_ENV, analyze_audio, decode_pcm, decode_samples, encode_pcm, full_scale,
+                           kernel_backend, pairwise_sum, pcm_params, prosody_frames, read_wav_stream, silence_runs,
+                           span_features, stretch_audio, synthetic_narration, wav_header, window_energies,
+                           write_wav_atomic)
+
+requires_numba = pytest.mark.skipif(audioAnalyzer.numba is None, reason="numba is not installed")
+
+# ========================================
+# PCM CODEC
+# ========================================
+
+# (sampwidth, is_float) of every format the codec reads and writes
+CODEC_FORMATS = {
+    "uint8": (1, False),
+    "int16": (2, False),
+    "int24": (3, False),
+    "int32": (4, False),
+    "float32": (4, True),
+    "float64": (8, True),
+}
+
+def codec_samples(params, n=4000):
+    """Stereo samples that float32 holds exactly, full scale edges included"""
+    rng = np.random.default_rng(params.sampwidth)
+    if params.comptype == 'FLOAT':
+        return np.concatenate([[-1.0, 1.0, 0.0, 0.5], rng.uniform(-1, 1, n - 4).astype(np.float32)])
+    limit = int(full_scale(params))
+    # int32 keeps 24 significant bits so the float32 decode stays exact
+    step = 256 if params.sampwidth == 4 else 1
+    values = rng.integers(-limit - 1, limit + 1, n - 4) // step * step
+    return np.concatenate([[-limit - 1, limit - (limit % step), 0, -1], values]).astype(np.float64)
+
+def riff(*chunks):
+    body = b'WAVE' + b''.join(chunks)
+    return b'RIFF' + struct.pack('<I', len(body)) + body
+
+def chunk(chunk_id, payload):
+    return chunk_id + struct.pack('<I', len(payload)) + payload + b'\0' * (len(payload) & 1)
+
+def fmt_chunk(n_channels, sampwidth=2, framerate=24000):
+    block_align = n_channels * sampwidth
+    return chunk(b'fmt ', struct.pack('<HHIIHH', 1, n_channels, framerate, framerate * block_align,
+                                      block_align, sampwidth * 8))
+
+@pytest.mark.parametrize("label", CODEC_FORMATS)
+def test_codec_round_trip(label):
+    sampwidth, is_float = CODEC_FORMATS[label]
+    params = pcm_params(2, sampwidth, 24000, is_float=is_float)
+    samples = codec_samples(params)
+    content = encode_pcm(samples, params)
+    assert len(content) == len(samples) * sampwidth
+
+    read_params, read_content = read_wav_stream(io.BytesIO(wav_header(params, len(samples) // 2) + content))
+    assert read_params == params._replace(nframes=len(samples) // 2)
+    assert read_content == content
+    np.testing.assert_array_equal(decode_pcm(read_content, read_params), samples)
+    # Re-encoding the decoded samples gives the same bytes back
+    assert encode_pcm(decode_pcm(content, params), params) == content
+
+    if not is_float:
+        with wave.open(io.BytesIO(wav_header(params, len(samples) // 2) + content)) as w:
+            assert (w.getnchannels(), w.getsampwidth(), w.getframerate()) == (2, sampwidth, 24000)
+            assert w.readframes(w.getnframes()) == content
+
+@pytest.mark.parametrize("label", [k for k, (_, is_float) in CODEC_FORMATS.items() if not is_float])
+def test_integer_encode_clips(label):
+    sampwidth, _ = CODEC_FORMATS[label]
+    params = pcm_params(1, sampwidth, 24000)
+    limit = full_scale(params)
+    decoded = decode_pcm(encode_pcm([-4 * limit, 4 * limit], params), params)
+    np.testing.assert_array_equal(decoded, np.float32([-limit - 1, limit]))
+
+def test_header_without_channels():
+    with pytest.raises(ValueError, match="without channels"):
+        read_wav_stream(io.BytesIO(riff(fmt_chunk(0), chunk(b'data', b'\0' * 8))))
+
+def test_truncated_data_chunk_keeps_whole_frames():
+    content = np.arange(-50, 50, dtype='<i2').tobytes()
+    # The header promises 1000 stereo frames; 100 samples and a stray byte arrive
+    header = riff(fmt_chunk(2)) + b'data' + struct.pack('<I', 4000)
+    params, read_content = read_wav_stream(io.BytesIO(header + content + b'\x01'))
+    assert params.nframes == 50
+    assert read_content == content
+
+def test_truncated_chunk_header():
+    with pytest.raises(ValueError, match="Truncated"):
+        read_wav_stream(io.BytesIO(riff(fmt_chunk(1)) + b'da'))
+
+def test_chunks_after_data_are_not_audio():
+    content = np.arange(7, dtype='<i2').tobytes()
+    # Odd data size: the pad byte and the LIST chunk after it stay out of the frames
+    stream = riff(fmt_chunk(1), chunk(b'LIST', b'INFOtest'), chunk(b'data', content[:-1]), chunk(b'LIST', b'x' * 10))
+    params, read_content = read_wav_stream(io.BytesIO(stream))
+    assert params.nframes == 6
+    assert read_content == content[:12]
+
+def test_data_before_fmt():
+    with pytest.raises(ValueError, match="before fmt"):
+        read_wav_stream(io.BytesIO(riff(chunk(b'data', b'\0' * 4), fmt_chunk(1))))
+
+# ========================================
+# KERNEL BACKENDS
+# ========================================
+
+def run_kernels(data, framerate, max_val, speed=0.9):
+    """Output of the OLA, energy and silence kernels on the active backend"""
+    window_size = int(framerate * 0.02)
+    n_windows = len(data) // window_size
+    energies = window_energies(data, max_val, window_size, n_windows)
+    is_speech = energies > max(np.mean(energies) * 0.15, 0.005)
+    return [stretch_audio(data, speed, framerate), energies, *silence_runs(is_speech)]
+
+def test_numba_is_the_default_when_installed(monkeypatch):
+    monkeypatch.delenv(KERNELS_ENV, raising=False)
+    assert kernel_backend() == ("numpy" if audioAnalyzer.numba is None else "numba")
+    monkeypatch.setenv(KERNELS_ENV, "numpy")
+    assert kernel_backend() == "numpy"
+
+@requires_numba
+@pytest.mark.parametrize("n", [0, 5, 8, 127, 128, 129, 480, 960, 1000, 4099, 65536])
+def test_pairwise_sum_matches_numpy(n):
+    values = np.random.default_rng(n).standard_normal(n + 3).astype(np.float32) * 1000
+    assert pairwise_sum(values, 3, n) == values[3:].sum(dtype=np.float32)
+
+@requires_numba
+def test_numba_kernels_match_numpy(monkeypatch):
+    params, content = synthetic_narration(20)
+    data, _ = decode_samples(content, params)
+    outputs = {}
+    for backend in ("numpy", "numba"):
+        monkeypatch.setenv(KERNELS_ENV, backend)
+        assert kernel_backend() == backend
+        outputs[backend] = run_kernels(data, params.framerate, full_scale(params))
+    for expected, actual in zip(outputs["numpy"], outputs["numba"]):
+        np.testing.assert_array_equal(actual, expected)
+
+# ========================================
+# PROCESS POOL
+# ========================================
+
+@pytest.mark.parametrize("speed", [0.75, 1.1, 1.3])
+def test_workers_match_serial_stereo(tmp_path, monkeypatch, speed):
+    # Small ranges so every rate is cut at many seams; the split happens in this process
+    monkeypatch.setattr(audioAnalyzer, "PARALLEL_CHUNK_SAMPLES", 1 << 13)
+    params, content = synthetic_narration(12, 24000, 2)
+    source = str(tmp_path / "tts.wav")
+    write_wav_atomic(source, params, content)
+    outputs = {}
+    for workers in (None, 3):
+        dest = str(tmp_path / f"final_{workers}.wav")
+        outputs[workers] = (analyze_audio(source, speed=speed, output_path=dest, workers=workers),
+                            open(dest, "rb").read())
+    assert outputs[3][0] == outputs[None][0]
+    assert outputs[3][1] == outputs[None][1]
+
+# ========================================
+# FAST VAD
+# ========================================
+
+@pytest.mark.parametrize("framerate,n_channels", [(48000, 1), (22050, 1), (44100, 2)])
+def test_fast_vad_matches_full(tmp_path, framerate, n_channels):
+    params, content = synthetic_narration(30, framerate, n_channels)
+    source = str(tmp_path / "tts.wav")
+    write_wav_atomic(source, params, content)
+    full = analyze_audio(source)
+    assert full["silences"]
+    assert analyze_audio(source, vad="fast") == full
+    # With --output elsewhere the frames are copied as they are
+    dest = str(tmp_path / "final.wav")
+    assert analyze_audio(source, output_path=dest, vad="fast") == full
+    assert open(dest, "rb").read() == open(source, "rb").read()
+
+# ========================================
+# PITCH
+# ========================================
+
+def tone(freq, framerate, seconds=1.0, sawtooth=False):
+    t = np.arange(int(framerate * seconds)) / framerate
+    wave = 2 * ((freq * t) % 1) - 1 if sawtooth else np.sin(2 * np.pi * freq * t)
+    return (wave * 16000).astype(np.float32)
+
+@pytest.mark.parametrize("framerate", [16000, 24000, 48000])
+@pytest.mark.parametrize("freq", [80, 100, 150, 300])
+@pytest.mark.parametrize("sawtooth", [False, True], ids=["sine", "sawtooth"])
+def test_pitch_of_tones(freq, framerate, sawtooth):
+    pitch, _, _ = prosody_frames(tone(freq, framerate, sawtooth=sawtooth), framerate, 32768.0)
+    # Edge windows are half zeros
+    inner = pitch[2:-2]
+    assert np.all(inner > 0)
+    assert np.median(inner) == pytest.approx(freq, rel=0.02)
+    assert np.all(np.abs(inner - freq) < 0.05 * freq)
+
+def test_noise_is_unvoiced():
+    noise = (np.random.default_rng(0).standard_normal(24000) * 8000).astype(np.float32)
+    pitch, _, _ = prosody_frames(noise, 24000, 32768.0)
+    assert np.mean(pitch > 0) < 0.05
+
+def test_span_features_match_every_window(monkeypatch):
+    # Small groups: spans are cut across groups and groups mix spans
+    monkeypatch.setattr(audioAnalyzer, "PROSODY_BLOCK_FRAMES", 37)
+    params, content = synthetic_narration(20)
+    _, mono_data = decode_samples(content, params)
+    everywhere = prosody_frames(mono_data, params.framerate, full_scale(params))
+    ranges = [(0, 3), (10, 60), (61, 62), (200, 290), (len(everywhere[0]) - 5, len(everywhere[0]))]
+    rows = np.concatenate([np.arange(i0, i1) for i0, i1 in ranges])
+    for spans, full in zip(span_features(mono_data, params.framerate, full_scale(params), ranges), everywhere):
+        np.testing.assert_allclose(spans, full[rows], rtol=1e-12, atol=1e-12)
@@ -0,0 +1,167 @@
+"""Checks of narrationQueue on a throwaway database with the stub synthesizer: python -m pytest server/utils"""
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import narrationQueue
+from audioAnalyzer import read_source
+from narrationQueue import (claim, finish, job_status, open_queue, queue_stats, run_job, stub_synthesizer, submit,
+                            transaction)
+
+TEXT = "C'era una volta un bambino che amava le storie."
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    open_queue(path).close()
+    return path
+
+@pytest.fixture
+def conn(db_path):
+    conn = open_queue(db_path)
+    yield conn
+    conn.close()
+
+def job_row(conn, job_id):
+    return conn.execute("SELECT status, worker, attempts, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+# ========================================
+# CLAIM
+# ========================================
+
+def test_transaction_takes_the_write_lock_up_front(db_path, conn):
+    other = sqlite3.connect(db_path, timeout=0.1, isolation_level=None)
+    try:
+        with transaction(conn):
+            # Nothing written yet, but BEGIN IMMEDIATE already holds the lock
+            with pytest.raises(sqlite3.OperationalError, match="locked"):
+                other.execute("BEGIN IMMEDIATE")
+        other.execute("BEGIN IMMEDIATE")
+        other.execute("ROLLBACK")
+    finally:
+        other.close()
+
+def test_concurrent_claims_take_each_job_once(db_path, conn):
+    job_ids = {submit(conn, f"{TEXT} {i}")["job"] for i in range(40)}
+    claimed, lock = [], threading.Lock()
+
+    def worker(name):
+        worker_conn = open_queue(db_path)
+        try:
+            while True:
+                job = claim(worker_conn, name)
+                if job is None:
+                    return
+                with lock:
+                    claimed.append(job["id"])
+        finally:
+            worker_conn.close()
+
+    threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(job_ids)
+
+def test_priority_then_submission_order(conn):
+    jobs = [submit(conn, f"{TEXT} {i}", priority=priority)["job"] for i, priority in enumerate([0, 2, 1, 2, 0])]
+    # Joining a queued job raises it to the joiner's priority
+    submit(conn, f"{TEXT} 4", priority=3)
+    order = []
+    while (job := claim(conn, "w")) is not None:
+        order.append(job["id"])
+    assert order == [jobs[4], jobs[1], jobs[3], jobs[2], jobs[0]]
+
+# ========================================
+# DEDUPE
+# ========================================
+
+def test_in_flight_index_allows_one_job_per_text_and_voice(conn):
+    first = submit(conn, TEXT, "it-Spk0_woman", 1.0)
+    # Another speed joins the same synthesis; another voice is another job
+    joined = submit(conn, TEXT, "it-Spk0_woman", 0.8)
+    other_voice = submit(conn, TEXT, "it-Spk1_man", 1.0)
+    assert joined["job"] == first["job"] and joined["deduped"]
+    assert joined["id"] != first["id"]
+    assert other_voice["job"] != first["job"] and not other_voice["deduped"]
+
+    key = conn.execute("SELECT dedupe_key FROM jobs WHERE id = ?", (first["job"],)).fetchone()[0]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO jobs (dedupe_key, text, speaker, created_at) VALUES (?, ?, ?, 0)",
+                     (key, TEXT, "it-Spk0_woman"))
+    # Finished jobs leave the index: the next submission starts a new synthesis
+    job = claim(conn, "w")
+    assert finish(conn, job["id"], "w", error="test")
+    again = submit(conn, TEXT, "it-Spk0_woman", 1.0)
+    assert again["job"] != first["job"] and not again["deduped"]
+    assert queue_stats(conn)["deduped"] == 1
+
+def test_speeds_are_applied_per_request_after_one_synthesis(tmp_path, monkeypatch, conn):
+    calls, passes = [], []
+    stub = stub_synthesizer(0)
+    render_speeds = narrationQueue.render_speeds
+
+    def synthesize(job, out_dir):
+        calls.append(job["id"])
+        return stub(job, out_dir)
+
+    def rendering(path, speeds, out_dir):
+        if not passes:
+            # A request for a new speed joins after the speeds were read
+            submit(conn, TEXT, speed=1.25)
+        passes.append(list(speeds))
+        return render_speeds(path, speeds, out_dir)
+
+    monkeypatch.setattr(narrationQueue, "render_speeds", rendering)
+    requests = [submit(conn, TEXT, speed=speed)["id"] for speed in (1.0, 0.8, 1.0)]
+    job = claim(conn, "w")
+    run_job(conn, job, str(tmp_path / "jobs"), synthesize, "w")
+    assert calls == [job["id"]]
+    assert passes == [[0.8, 1.0], [1.25]]
+
+    statuses = [job_status(conn, request_id) for request_id in requests + [requests[-1] + 1]]
+    assert [s["status"] for s in statuses] == ["done"] * 4
+    assert [s["speed"] for s in statuses] == [1.0, 0.8, 1.0, 1.25]
+    assert statuses[0]["submissions"] == 4
+    paths = [s["result"]["path"] for s in statuses]
+    assert paths[0] == paths[2] == statuses[0]["result"]["synthesisPath"]
+    assert len(set(paths)) == 3
+    frames = [read_source(path)[0].nframes for path in paths]
+    # OLA output carries one extra 40 ms window
+    window = int(narrationQueue.STUB_PARAMS.framerate * 0.04)
+    assert frames[1] == int(frames[0] / 0.8) + window
+    assert frames[3] == int(frames[0] / 1.25) + window
+
+# ========================================
+# LEASES
+# ========================================
+
+def test_expired_lease_is_reclaimed(monkeypatch, conn):
+    request = submit(conn, TEXT)
+    monkeypatch.setattr(narrationQueue, "LEASE_SECONDS", -1)
+    first = claim(conn, "dead")
+    assert first["attempt"] == 1
+    # The lease is already over: the next worker takes the job back
+    second = claim(conn, "alive")
+    assert (second["id"], second["attempt"]) == (first["id"], 2)
+    assert not finish(conn, first["id"], "dead", result={"path": "x", "seconds": 0, "renditions": {"1": "x"}})
+    assert finish(conn, first["id"], "alive", result={"path": "y", "seconds": 0, "renditions": {"1": "y"}})
+    assert job_status(conn, request["id"])["result"]["path"] == "y"
+
+def test_live_lease_is_not_reclaimed(conn):
+    submit(conn, TEXT)
+    assert claim(conn, "a") is not None
+    assert claim(conn, "b") is None
+
+def test_job_fails_after_max_attempts(monkeypatch, conn):
+    submit(conn, TEXT)
+    monkeypatch.setattr(narrationQueue, "LEASE_SECONDS", -1)
+    for attempt in range(narrationQueue.MAX_ATTEMPTS):
+        job = claim(conn, f"w{attempt}")
+        assert job["attempt"] == attempt + 1
+    time.sleep(0.01)
+    assert claim(conn, "last") is None
+    assert job_row(conn, job["id"])[0::3] == ("failed", "worker lost")
@@ -0,0 +1,136 @@
+"""Checks of storageSweeper on a throwaway uploads/audio + temp_audio tree: python -m pytest server/utils"""
+import os
+import time
+
+import pytest
+
+from storageSweeper import NARRATION_GRACE_SECONDS, TEMP_STALE_SECONDS, sweep
+
+HOUR = 3600
+
+# One story referencing narration_1 (its derived files must survive with it)
+STORIES = [{"narrationUrl": "http://localhost:5000/uploads/audio/narration_1.wav", "paragraphs": []}]
+
+@pytest.fixture
+def dirs(tmp_path):
+    audio_dir, temp_dir = tmp_path / "audio", tmp_path / "temp_audio"
+    audio_dir.mkdir()
+    temp_dir.mkdir()
+    return str(audio_dir), str(temp_dir)
+
+def make(path, age, size=100):
+    """File (or, with a trailing '/', a dir holding one file) last written `age` seconds ago"""
+    mtime = time.time() - age
+    if path.endswith('/'):
+        os.makedirs(path, exist_ok=True)
+        make(os.path.join(path, 'seg_00000.wav'), age, size)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * size)
+    os.utime(path.rstrip('/'), (mtime, mtime))
+    return path.rstrip('/')
+
+def names(report):
+    return sorted(os.path.basename(item["path"]) for item in report["deleted"])
+
+def derived_files(audio_dir, root, age):
+    """A narration with every file audioAnalyzer derives from it"""
+    return [make(os.path.join(audio_dir, root + suffix), age) for suffix in (
+        '.wav', '_0.75x.wav', '_0.75x_segments/', '_segments/', '_keysteps.wav', '_game.wav',
+        '.sync.json', '.segments.json', '.sprite.json', '_1.1x.sync.json')]
+
+# ========================================
+# AGE THRESHOLDS
+# ========================================
+
+def test_unreferenced_narrations_keep_their_grace_period(dirs):
+    audio_dir, temp_dir = dirs
+    assert NARRATION_GRACE_SECONDS == 24 * HOUR
+    make(os.path.join(audio_dir, 'narration_2.wav'), 23 * HOUR)
+    make(os.path.join(audio_dir, 'narration_3.wav'), 25 * HOUR)
+    make(os.path.join(audio_dir, 'narration_1.wav'), 100 * HOUR)
+    report = sweep(audio_dir, temp_dir, STORIES)
+    assert names(report) == ['narration_3.wav']
+    assert os.path.exists(os.path.join(audio_dir, 'narration_2.wav'))
+
+def test_temp_dirs_are_stale_after_two_hours(dirs):
+    audio_dir, temp_dir = dirs
+    assert TEMP_STALE_SECONDS == 2 * HOUR
+    now_ms = int(time.time() * 1000)
+    make(os.path.join(temp_dir, f'audio_{now_ms - 3 * HOUR * 1000}/'), 3 * HOUR)
+    make(os.path.join(temp_dir, f'audio_{now_ms - HOUR * 1000}/'), HOUR)
+    # Started 3 h ago but still written to 1 h ago: the request is alive
+    make(os.path.join(temp_dir, f'audio_{now_ms - 3 * HOUR * 1000 + 1}/'), HOUR)
+    # Not a generateAudio dir
+    make(os.path.join(temp_dir, 'keep/'), 100 * HOUR)
+    report = sweep(audio_dir, temp_dir, STORIES)
+    assert names(report) == [f'audio_{now_ms - 3 * HOUR * 1000}']
+    assert report["deleted"][0]["reason"] == "stale temp dir"
+    assert sorted(os.listdir(temp_dir)) == sorted([f'audio_{now_ms - HOUR * 1000}',
+                                                   f'audio_{now_ms - 3 * HOUR * 1000 + 1}', 'keep'])
+
+# ========================================
+# OWNERSHIP
+# ========================================
+
+def test_derived_files_follow_their_narration(dirs):
+    audio_dir, temp_dir = dirs
+    kept = derived_files(audio_dir, 'narration_1', 100 * HOUR)
+    gone = derived_files(audio_dir, 'narration_2', 100 * HOUR)
+    # Not generateAudio output, left alone whatever its age
+    kept.append(make(os.path.join(audio_dir, 'intro.wav'), 100 * HOUR))
+    report = sweep(audio_dir, temp_dir, STORIES)
+    assert names(report) == sorted(os.path.basename(p) for p in gone)
+    assert all(os.path.exists(p) for p in kept)
+    assert not any(os.path.exists(p) for p in gone)
+
+def test_derived_files_keep_an_unreferenced_narration_young(dirs):
+    audio_dir, temp_dir = dirs
+    make(os.path.join(audio_dir, 'narration_2.wav'), 100 * HOUR)
+    make(os.path.join(audio_dir, 'narration_2_segments/'), HOUR)
+    report = sweep(audio_dir, temp_dir, STORIES)
+    assert names(report) == ['narration_2.wav']
+    assert os.path.isdir(os.path.join(audio_dir, 'narration_2_segments'))
+
+# ========================================
+# MODES
+# ========================================
+
+def test_dry_run_deletes_nothing(dirs):
+    audio_dir, temp_dir = dirs
+    paths = derived_files(audio_dir, 'narration_2', 100 * HOUR)
+    paths.append(make(os.path.join(temp_dir, 'audio_1000/'), 100 * HOUR))
+    paths.append(make(os.path.join(audio_dir, '.partial_x.wav'), 100 * HOUR))
+    report = sweep(audio_dir, temp_dir, STORIES, dry_run=True)
+    assert report["dryRun"]
+    assert len(report["deleted"]) == len(paths)
+    assert report["usageAfterBytes"] == report["usageBytes"] - report["freedBytes"]
+    assert all(os.path.exists(p) for p in paths)
+
+def test_budget_evicts_oldest_first(dirs):
+    audio_dir, temp_dir = dirs
+    for n, hours in enumerate([30, 50, 40, 60]):
+        make(os.path.join(audio_dir, f'narration_{n + 2}.wav'), hours * HOUR, size=1000)
+    make(os.path.join(audio_dir, 'narration_1.wav'), 100 * HOUR, size=1000)
+    # 5000 bytes in use: fitting 2500 takes the three oldest unreferenced ones
+    report = sweep(audio_dir, temp_dir, STORIES, budget=2500)
+    assert [os.path.basename(item["path"]) for item in report["deleted"]] == [
+        'narration_5.wav', 'narration_3.wav', 'narration_4.wav']
+    assert report["usageAfterBytes"] == 2000
+    assert not report["overBudget"]
+    assert sorted(os.listdir(audio_dir)) == ['narration_1.wav', 'narration_2.wav']
+
+def test_budget_already_met_deletes_nothing(dirs):
+    audio_dir, temp_dir = dirs
+    make(os.path.join(audio_dir, 'narration_2.wav'), 100 * HOUR, size=1000)
+    report = sweep(audio_dir, temp_dir, STORIES, budget=1000)
+    assert report["deleted"] == []
+    assert report["candidates"] == 1
+
+def test_refuses_to_run_without_story_records(dirs):
+    audio_dir, temp_dir = dirs
+    path = make(os.path.join(audio_dir, 'narration_2.wav'), 100 * HOUR)
+    report = sweep(audio_dir, temp_dir, [])
+    assert "error" in report
+    assert os.path.exists(path)
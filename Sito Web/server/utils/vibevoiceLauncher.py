@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import runpy
+
+# Thread counts measured by setup.py on CPU-only hosts and written to the server .env
+INTRA_OP_ENV = "TORCH_NUM_THREADS"
+INTER_OP_ENV = "TORCH_NUM_INTEROP_THREADS"
+
+# int8 model prepared by setup.py on CPU-only hosts (the whole module, saved with torch.save);
+# the report next to it names the model it replaces
+QUANTIZED_MODEL_ENV = "VIBEVOICE_QUANTIZED_MODEL"
+QUANTIZED_REPORT_FILE = "quantization.json"
+
+def env_threads(name):
+    """Positive integer value of `name`, or None when unset or invalid"""
+    try:
+        value = int(os.environ.get(name, ""))
+    except ValueError:
+        return None
+    return value if value > 0 else None
+
+def apply_thread_settings():
+    """Configure torch before the model script imports it.
+
+    The inter-op pool can only be sized before the first parallel op
+    runs, which is why this cannot be left to an environment variable
+    read later by the script.
+    """
+    intra, inter = env_threads(INTRA_OP_ENV), env_threads(INTER_OP_ENV)
+    if intra is None and inter is None:
+        return
+    import torch
+    if inter is not None:
+        torch.set_num_interop_threads(inter)
+    if intra is not None:
+        torch.set_num_threads(intra)
+
+def use_quantized_model():
+    """Serve the int8 model in place of the full-precision one the script asks for.
+
+    Only from_pretrained calls for the model the report names are
+    redirected; dtype and device arguments are ignored, the dynamically
+    quantized layers run in float32 on CPU. Returns the model path, or
+    None when no usable quantized model is configured.
+    """
+    model_path = os.environ.get(QUANTIZED_MODEL_ENV)
+    report_path = os.path.join(os.path.dirname(model_path or ''), QUANTIZED_REPORT_FILE)
+    if not model_path or not os.path.exists(model_path) or not os.path.exists(report_path):
+        return None
+    with open(report_path, 'r', encoding='utf-8') as f:
+        source = json.load(f).get("source")
+
+    import torch
+    from transformers import PreTrainedModel
+
+    original = PreTrainedModel.from_pretrained.__func__
+
+    def from_pretrained(cls, name, *args, **kwargs):
+        if str(name) != source:
+            return original(cls, name, *args, **kwargs)
+        return torch.load(model_path, weights_only=False).eval()
+
+    PreTrainedModel.from_pretrained = classmethod(from_pretrained)
+    return model_path
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: vibevoiceLauncher.py SCRIPT [ARGS...]")
+    apply_thread_settings()
+    if use_quantized_model():
+        print(f"Using int8 model {os.environ[QUANTIZED_MODEL_ENV]}", file=sys.stderr)
+    script = os.path.abspath(sys.argv[1])
+    # Same argv and import path the script would see if it were run directly
+    sys.argv = [script] + sys.argv[2:]
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name="__main__")
@@ -7,6 +7,59 @@ import json
 from pathlib import Path
 import time
 import re
+import hashlib
+import argparse
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Stato dei passi completati (impronte), letto a ogni esecuzione per riprendere da dove si era rimasti
+SETUP_STATE_FILE = ".setup_state.json"
+
+# Cache locale degli artefatti (wheel pip, cache npm, mirror git di VibeVoice) per --prefetch / --offline
+DEFAULT_CACHE_DIR = ".setup_cache"
+
+VIBEVOICE_REPO = "https://github.com/microsoft/VibeVoice.git"
+
+# Build di PyTorch disponibili su download.pytorch.org
+TORCH_VARIANTS = ("cu121", "cu118", "cpu")
+TORCH_INDEX_URL = "https://download.pytorch.org/whl/{variant}"
+
+# Risultati delle verifiche dell'ambiente (versioni, GPU, torch, percorsi), riusati finché
+# gli eseguibili e i percorsi da cui derivano non cambiano
+MANIFEST_FILE = ".setup_manifest.json"
+
+# Eseguibili verificati al passo 0; ognuno viene rieseguito solo se il suo file cambia
+MANIFEST_TOOLS = ("node", "git", "nvidia-smi", "nvcc", "mongo")
+
+VIBEVOICE_REQUIRED_FILES = ("setup.py", "demo/realtime_model_inference_from_file.py")
+
+# Variabili del .env per la sintesi su CPU (lette da utils/vibevoiceLauncher.py): thread di torch
+# misurati e modello quantizzato int8
+CPU_TUNING_VARS = ('TORCH_NUM_THREADS', 'TORCH_NUM_INTEROP_THREADS', 'VIBEVOICE_QUANTIZED_MODEL')
+CPU_TUNING_SECTION = "# VIBEVOICE CPU (thread e modello int8 preparati da setup.py)"
+
+# Percorsi di VibeVoice nel .env, letti da generateAudio e da utils/narrationQueue.py
+VIBEVOICE_PATH_VARS = ('VIBEVOICE_PATH', 'PYTHON_VENV_PATH')
+VIBEVOICE_PATHS_SECTION = "# VIBEVOICE (percorsi rilevati da setup.py)"
+
+# Modello usato da generateAudio, e la classe con cui VibeVoice lo carica
+VIBEVOICE_MODEL_ID = "microsoft/VibeVoice-Realtime-0.5B"
+VIBEVOICE_MODEL_CLASS = "vibevoice.modular.modeling_vibevoice_streaming_inference:VibeVoiceStreamingForConditionalGenerationInference"
+
+# Cartella accanto al checkout di VibeVoice (fuori dal suo repository git) con il modello int8
+QUANTIZED_DIRNAME = "VibeVoice-int8"
+QUANTIZED_MODEL_FILE = "model.pt"
+# Letto anche da utils/vibevoiceLauncher.py per sapere quale modello sostituire
+QUANTIZED_REPORT_FILE = "quantization.json"
+
+# Configurazioni entro questo margine dalla più veloce sono equivalenti: vince quella con meno
+# thread, che lascia core liberi a più generazioni in parallelo
+CPU_TUNING_TOLERANCE = 0.05
+
+# Le righe dei passi eseguiti in parallelo non devono mescolarsi a metà
+OUTPUT_LOCK = threading.Lock()
+STATE_LOCK = threading.Lock()
 
 def print_header(text, emoji="🚀"):
     print("\n" + "="*60)
@@ -16,8 +69,38 @@ def print_header(text, emoji="🚀"):
 def print_step(step_num, total_steps, text):
     print(f"\n[{step_num}/{total_steps}] {text}")
 
-def repair_env_file(env_file, base_path, vv_root=None, python_bin=None, venv_path=None):
-    """Ripara o completa un file .env esistente con percorsi REALI"""
+def log(text, prefix=None):
+    """Stampa una riga, con il nome del passo davanti se eseguito in parallelo"""
+    with OUTPUT_LOCK:
+        print(f"   [{prefix}] {text}" if prefix else f"   {text}", flush=True)
+
+def update_env_values(env_file, values, section):
+    """Cambia solo le righe KEY=... di `values` nel .env, lasciando il resto com'è.
+
+    Le chiavi che mancano vengono aggiunte in fondo, sotto il commento `section`.
+    """
+    lines = env_file.read_text(encoding='utf-8').splitlines() if env_file.exists() else []
+    pending = dict(values)
+    for i, line in enumerate(lines):
+        key = line.split('=', 1)[0].strip()
+        if '=' in line and not line.lstrip().startswith('#') and key in pending:
+            lines[i] = f"{key}={pending.pop(key)}"
+    if pending:
+        if section not in lines:
+            lines += ["", section]
+        lines += [f"{key}={value}" for key, value in pending.items()]
+    with open(env_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+
+def repair_env_file(env_file, base_path, vv_root=None, python_bin=None, venv_path=None, tuning=None):
+    """Ripara o completa un file .env esistente con percorsi REALI
+
+    `tuning` ({variabile: valore}, vedi CPU_TUNING_VARS) viene scritto
+    senza chiedere conferma quando cambia i valori presenti: se il resto
+    del file è valido vengono aggiornate solo quelle righe. Una
+    riparazione completa riscrive il file conservando anche le variabili
+    che il modello non conosce (VIBEVOICE_PATH, NARRATION_QUEUE, ...).
+    """
     
     print("\n   🔧 RIPARAZIONE FILE .ENV")
     print("   " + "-"*50)
@@ -33,6 +116,10 @@ def repair_env_file(env_file, base_path, vv_root=None, python_bin=None, venv_pat
                     env_vars[key.strip()] = value.strip()
     
     print(f"   📋 Variabili trovate: {len(env_vars)}")
+
+    tuning = {key: str(value) for key, value in (tuning or {}).items()}
+    tuning_changed = any(env_vars.get(key) != value for key, value in tuning.items())
+    env_vars.update(tuning)
     
     # ========================================
     # RILEVAMENTO AUTOMATICO PERCORSI REALI
@@ -82,6 +169,16 @@ def repair_env_file(env_file, base_path, vv_root=None, python_bin=None, venv_pat
         
         if not python_bin or not python_bin.exists():
             print(f"   ⚠️ Virtual environment non trovato in {vv_root}")
+
+    # 3. Percorsi rilevati: scritti nel .env se mancano o non esistono più
+    detected = {}
+    if vv_root and vv_root.exists():
+        detected['VIBEVOICE_PATH'] = str(vv_root).replace("\\", "/")
+    if python_bin and python_bin.exists():
+        detected['PYTHON_VENV_PATH'] = str(python_bin).replace("\\", "/")
+    paths = {key: value for key, value in detected.items()
+             if not env_vars.get(key) or not os.path.exists(env_vars[key])}
+    env_vars.update(paths)
     
     # Variabili richieste con valori di default
     required_vars = {
@@ -115,17 +212,23 @@ def repair_env_file(env_file, base_path, vv_root=None, python_bin=None, venv_pat
             else:
                 print(f"   ✅ OK: {var}")
     
-    # Se tutto è OK, non fare nulla
+    # Se tutto è OK, tocca al massimo le righe dei percorsi e dei parametri CPU
     if not missing_vars and not invalid_vars:
+        if paths:
+            print(f"\n   📁 Percorsi VibeVoice: " + ", ".join(f"{k}={v}" for k, v in paths.items()))
+            update_env_values(env_file, paths, VIBEVOICE_PATHS_SECTION)
+        if tuning_changed:
+            print(f"\n   ⚙️ Aggiornamento parametri CPU: " + ", ".join(f"{k}={v}" for k, v in tuning.items()))
+            update_env_values(env_file, tuning, CPU_TUNING_SECTION)
         print(f"\n   🎉 File .env completo e valido!")
         return True
-    
+
     print(f"\n   🔨 Riparazione necessaria:")
     print(f"   • Variabili mancanti: {len(missing_vars)}")
     print(f"   • Variabili da correggere: {len(invalid_vars)}")
-    
+
     repair = input("\n   ❓ Vuoi riparare il file .env? (S/n): ").strip().lower()
-    
+
     if repair == 'n':
         print(f"   ⏭️ Salto riparazione")
         return False
@@ -239,6 +342,20 @@ SENDER_EMAIL={env_vars.get('SENDER_EMAIL', env_vars.get('SMTP_USER', 'your_email
 BACKEND_URL={env_vars.get('BACKEND_URL', 'http://localhost:4000')}
 FRONTEND_URL={env_vars.get('FRONTEND_URL', 'http://localhost:5173')}
 """
+
+    vibevoice_paths = [f"{key}={env_vars[key]}" for key in VIBEVOICE_PATH_VARS if env_vars.get(key)]
+    if vibevoice_paths:
+        env_content += f"\n{VIBEVOICE_PATHS_SECTION}\n" + "\n".join(vibevoice_paths) + "\n"
+
+    cpu_tuning = [f"{key}={env_vars[key]}" for key in CPU_TUNING_VARS if env_vars.get(key)]
+    if cpu_tuning:
+        env_content += f"\n{CPU_TUNING_SECTION}\n" + "\n".join(cpu_tuning) + "\n"
+
+    # Variabili aggiunte a mano o da altri strumenti: il modello sopra non le conosce
+    other_vars = [f"{key}={value}" for key, value in env_vars.items()
+                  if key not in required_vars and key not in CPU_TUNING_VARS + VIBEVOICE_PATH_VARS]
+    if other_vars:
+        env_content += "\n# ALTRE VARIABILI (conservate dal .env precedente)\n" + "\n".join(other_vars) + "\n"
     
     # Backup del vecchio file
     if env_file.exists():
@@ -276,11 +393,36 @@ FRONTEND_URL={env_vars.get('FRONTEND_URL', 'http://localhost:5173')}
     
     return True
 
-def run_command(command, cwd=None, shell=True, description="", show_output=False):
+def run_command(command, cwd=None, shell=True, description="", show_output=False, prefix=None):
     try:
+        if prefix:
+            # Passo in parallelo: output sempre in streaming, ogni riga col nome del passo
+            if description:
+                log(f"⏳ {description}...", prefix)
+            process = subprocess.Popen(
+                command,
+                cwd=cwd,
+                shell=shell,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding='utf-8',
+                errors='replace',
+                bufsize=1
+            )
+
+            for line in process.stdout:
+                if line.strip():
+                    log(line.rstrip(), prefix)
+
+            process.wait()
+            if process.returncode != 0:
+                log(f"❌ Comando terminato con codice {process.returncode}", prefix)
+            return process.returncode == 0, ""
+
         if description:
             print(f"   ⏳ {description}...")
-        
+
         if show_output:
             # Mostra l'output in tempo reale
             process = subprocess.Popen(
@@ -315,16 +457,16 @@ def run_command(command, cwd=None, shell=True, description="", show_output=False
         return False, e.stderr if hasattr(e, 'stderr') else str(e)
 
 def check_nodejs():
-    """Verifica che Node.js sia installato"""
+    """Verifica che Node.js sia installato; ritorna la versione (None se assente)"""
     try:
         result = subprocess.run(["node", "--version"], capture_output=True, text=True)
         version = result.stdout.strip()
         print(f"   ✅ Node.js installato: {version}")
-        return True
+        return version or "?"
     except FileNotFoundError:
         print(f"   ❌ Node.js NON installato!")
         print(f"   📥 Scarica da: https://nodejs.org/")
-        return False
+        return None
 
 def check_python():
     """Verifica che Python sia installato"""
@@ -337,17 +479,17 @@ def check_python():
     return True
 
 def check_git():
-    """Verifica che Git sia installato"""
+    """Verifica che Git sia installato; ritorna la versione (None se assente)"""
     try:
         result = subprocess.run(["git", "--version"], capture_output=True, text=True)
         version = result.stdout.strip()
         print(f"   ✅ Git installato: {version}")
-        return True
+        return version or "?"
     except FileNotFoundError:
         print(f"   ⚠️ Git NON installato!")
         print(f"   💡 Git è necessario per clonare VibeVoice")
         print(f"   📥 Scarica da: https://git-scm.com/")
-        return False
+        return None
 
 def check_nvidia_gpu():
     """Verifica se è presente una GPU NVIDIA"""
@@ -420,13 +562,8 @@ def check_vibevoice(base_path):
         return False, vv_root
     
     # Verifica struttura
-    required_files = [
-        "setup.py",
-        "demo/realtime_model_inference_from_file.py",
-    ]
-    
     missing_files = []
-    for file in required_files:
+    for file in VIBEVOICE_REQUIRED_FILES:
         if not (vv_root / file).exists():
             missing_files.append(file)
     
@@ -439,36 +576,45 @@ def check_vibevoice(base_path):
     print(f"   ✅ VibeVoice trovato e completo")
     return True, vv_root
 
-def clone_vibevoice(base_path):
-    """Clona il repository VibeVoice"""
+def clone_vibevoice(base_path, prefix=None, source=None):
+    """Clona il repository VibeVoice (da GitHub, o da `source`: il mirror della cache offline)"""
     vv_root = base_path / "VibeVoice"
-    
-    print("\n   📥 CLONAZIONE VIBEVOICE DA GITHUB")
-    print("   " + "-"*50)
-    print(f"   Repository: https://github.com/microsoft/VibeVoice.git")
-    print(f"   Destinazione: {vv_root}")
-    print(f"   ⏳ Questo richiederà 2-5 minuti...")
-    print()
-    
+    repo = source or VIBEVOICE_REPO
+
+    if prefix:
+        log(f"📥 Clonazione da {repo} in {vv_root} (2-5 minuti)", prefix)
+    else:
+        print("\n   📥 CLONAZIONE VIBEVOICE DA GITHUB")
+        print("   " + "-"*50)
+        print(f"   Repository: {repo}")
+        print(f"   Destinazione: {vv_root}")
+        print(f"   ⏳ Questo richiederà 2-5 minuti...")
+        print()
+
     success, _ = run_command(
-        "git clone https://github.com/microsoft/VibeVoice.git",
+        f'git clone "{repo}" VibeVoice',
         cwd=str(base_path),
         description="Clonazione repository",
-        show_output=True
+        show_output=True,
+        prefix=prefix
     )
-    
+
+    if success and source:
+        # Il checkout deve poter fare 'git pull' da GitHub, non dal mirror locale
+        run_command(f'git remote set-url origin {VIBEVOICE_REPO}', cwd=str(vv_root), prefix=prefix)
+
     return success
 
-def install_pytorch(pip_path, has_gpu=False, cuda_version=None):
-    """Installa PyTorch ottimizzato per la configurazione hardware"""
-    
+def choose_torch_variant(has_gpu=False, cuda_version=None):
+    """Sceglie la build di PyTorch (cu121, cu118 o cpu) per la configurazione hardware"""
+
     print("\n   🔥 INSTALLAZIONE PYTORCH")
     print("   " + "-"*50)
-    
+
     if has_gpu:
         print(f"   🎮 GPU NVIDIA rilevata → Installazione versione GPU")
         print(f"   ⚡ Questo accelererà ENORMEMENTE la generazione audio!")
-        
+
         # Determina la versione CUDA da usare
         if cuda_version:
             cuda_major = cuda_version.split('.')[0]
@@ -480,38 +626,47 @@ def install_pytorch(pip_path, has_gpu=False, cuda_version=None):
                 torch_cuda = "cu118"  # Default
         else:
             torch_cuda = "cu118"  # Default se CUDA non rilevato
-        
-        torch_install_cmd = f'"{pip_path}" install torch torchaudio --index-url https://download.pytorch.org/whl/{torch_cuda}'
-        
+
         print(f"   📦 Versione: PyTorch con CUDA {torch_cuda}")
-        print(f"   ⏳ Download in corso (può richiedere 5-10 minuti)...")
-        
+        return torch_cuda
+
+    print(f"   💻 GPU non rilevata → Installazione versione CPU")
+    print(f"   ⚠️ La generazione audio sarà più lenta (1-2 min per storia)")
+
+    choice = input("\n   ❓ Vuoi comunque installare la versione GPU manualmente? (s/N): ").strip().lower()
+
+    if choice == 's':
+        print(f"   📦 Installazione versione GPU (CUDA 11.8)...")
+        return "cu118"
+    print(f"   📦 Installazione versione CPU...")
+    return "cpu"
+
+def install_pytorch(pip_path, has_gpu=False, cuda_version=None, variant=None, prefix=None, cache=None):
+    """Installa PyTorch ottimizzato per la configurazione hardware"""
+
+    if variant is None:
+        variant = choose_torch_variant(has_gpu, cuda_version)
+
+    if cache and cache.offline:
+        torch_install_cmd = f'"{pip_path}" install torch torchaudio {cache.pip_args()}'
     else:
-        print(f"   💻 GPU non rilevata → Installazione versione CPU")
-        print(f"   ⚠️ La generazione audio sarà più lenta (1-2 min per storia)")
-        
-        choice = input("\n   ❓ Vuoi comunque installare la versione GPU manualmente? (s/N): ").strip().lower()
-        
-        if choice == 's':
-            print(f"   📦 Installazione versione GPU (CUDA 11.8)...")
-            torch_install_cmd = f'"{pip_path}" install torch torchaudio --index-url https://download.pytorch.org/whl/cu118'
-        else:
-            print(f"   📦 Installazione versione CPU...")
-            torch_install_cmd = f'"{pip_path}" install torch torchaudio --index-url https://download.pytorch.org/whl/cpu'
-        
-        print(f"   ⏳ Download in corso (può richiedere 5-10 minuti)...")
-    
-    success, _ = run_command(torch_install_cmd, description="", show_output=True)
-    
+        torch_install_cmd = f'"{pip_path}" install torch torchaudio --index-url {TORCH_INDEX_URL.format(variant=variant)}'
+        if cache:
+            torch_install_cmd += f' {cache.pip_args()}'
+    log(f"⏳ Download PyTorch ({variant}) in corso (può richiedere 5-10 minuti)...", prefix)
+
+    success, _ = run_command(torch_install_cmd, description="", show_output=True, prefix=prefix)
+
     return success
 
 def verify_pytorch_installation(python_bin):
-    """Verifica che PyTorch sia installato correttamente"""
+    """Verifica che PyTorch sia installato correttamente; ritorna {campo: valore} (None se fallisce)"""
     print("\n   🔍 Verifica installazione PyTorch...")
     
     verify_script = """
 import torch
 print(f"PyTorch Version: {torch.__version__}")
+print(f"Torch Path: {torch.__file__}")
 print(f"CUDA Available: {torch.cuda.is_available()}")
 if torch.cuda.is_available():
     print(f"CUDA Version: {torch.version.cuda}")
@@ -534,13 +689,13 @@ else:
             for line in result.stdout.strip().split('\n'):
                 print(f"   ✅ {line}")
             print("   " + "="*50)
-            return True
+            return dict(line.split(": ", 1) for line in result.stdout.strip().split('\n') if ": " in line)
         else:
             print(f"   ❌ Errore verifica: {result.stderr}")
-            return False
+            return None
     except Exception as e:
         print(f"   ❌ Errore: {e}")
-        return False
+        return None
 
 def check_mongodb():
     """Verifica che MongoDB sia in esecuzione"""
@@ -599,17 +754,643 @@ def get_gmail_app_password():
     
     return email, app_password
 
-def setup():
+# ========================================
+# PASSI IN PARALLELO (con ripresa)
+# ========================================
+
+class SetupStep:
+    """Un passo dell'installazione.
+
+    `action(prefix)` esegue il passo e ritorna True se è riuscito;
+    `fingerprint()` descrive i suoi input (hash del lockfile, marker del
+    venv...) e `done()` controlla che il risultato sia ancora su disco.
+    Un passo con la stessa impronta dell'ultima esecuzione riuscita e il
+    risultato presente viene saltato.
+    """
+
+    def __init__(self, name, label, action, deps=(), fingerprint=None, done=None):
+        self.name = name
+        self.label = label
+        self.action = action
+        self.deps = tuple(deps)
+        self.fingerprint = fingerprint or (lambda: None)
+        self.done = done or (lambda: True)
+
+def file_digest(*paths):
+    """Hash sha256 del contenuto dei file esistenti tra `paths` (None se nessuno esiste)"""
+    digest = hashlib.sha256()
+    found = False
+    for path in paths:
+        if path.exists():
+            digest.update(path.name.encode('utf-8'))
+            digest.update(path.read_bytes())
+            found = True
+    return digest.hexdigest() if found else None
+
+def venv_marker(venv_path):
+    """Cambia quando il venv viene ricreato (pyvenv.cfg viene riscritto)"""
+    cfg = venv_path / "pyvenv.cfg"
+    return f"{cfg.stat().st_mtime_ns}" if cfg.exists() else None
+
+def load_setup_state(state_file):
+    if not state_file.exists():
+        return {}
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f).get("steps", {})
+    except (OSError, ValueError):
+        # Stato illeggibile: si rieseguono tutti i passi
+        return {}
+
+def write_json_atomic(path, data):
+    tmp_file = path.with_name(path.name + ".tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_file, path)
+
+def save_setup_state(state_file, state):
+    write_json_atomic(state_file, {"steps": state})
+
+def record_step(state, state_file, name, fingerprint, result=None):
+    with STATE_LOCK:
+        if fingerprint is None:
+            if state.pop(name, None) is None:
+                return
+        else:
+            state[name] = {"fingerprint": fingerprint, "completedAt": time.strftime('%Y-%m-%d %H:%M:%S')}
+            if result is not None:
+                state[name]["result"] = result
+        save_setup_state(state_file, state)
+
+def execute_step(step, state, state_file, force=False):
+    """Esegue un passo (o lo salta se già completato); ritorna (esito, secondi)"""
+    t0 = time.time()
+    try:
+        recorded = state.get(step.name, {}).get("fingerprint")
+        if not force and recorded is not None and recorded == step.fingerprint() and step.done():
+            log("⏭️ Già completato, impronta invariata", step.name)
+            return "skipped", 0.0
+
+        log(f"▶️ {step.label}", step.name)
+        ok = step.action(step.name)
+        # L'impronta si registra dopo: npm install può aver appena creato il lockfile
+        record_step(state, state_file, step.name, step.fingerprint() if ok else None)
+    except Exception as e:
+        log(f"❌ Errore: {e}", step.name)
+        ok = False
+
+    elapsed = time.time() - t0
+    log(f"{'✅ Completato' if ok else '❌ Fallito'} in {elapsed:.0f}s", step.name)
+    return ("done" if ok else "failed"), elapsed
+
+def run_steps(steps, state_file, force=False):
+    """Esegue i passi in parallelo appena le loro dipendenze sono completate.
+
+    Un passo fallito blocca solo i passi che dipendono da lui; gli
+    altri proseguono. Ritorna {nome: (esito, secondi)} con esito tra
+    done, skipped, failed e blocked.
+    """
+    state = load_setup_state(state_file)
+    results = {}
+    pending = {step.name: step for step in steps}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(len(steps), 1)) as pool:
+        while pending or running:
+            progressed = False
+            for name, step in list(pending.items()):
+                outcomes = [results.get(dep, (None,))[0] for dep in step.deps]
+                if any(outcome in ("failed", "blocked") for outcome in outcomes):
+                    log("⛔ Saltato: un passo da cui dipende non è riuscito", name)
+                    results[name] = ("blocked", 0.0)
+                elif all(outcome in ("done", "skipped") for outcome in outcomes):
+                    running[pool.submit(execute_step, step, state, state_file, force)] = name
+                else:
+                    continue
+                del pending[name]
+                progressed = True
+
+            if not running:
+                if progressed:
+                    continue
+                # Dipendenze verso passi inesistenti: non potranno mai partire
+                for name in pending:
+                    results[name] = ("blocked", 0.0)
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                results[running.pop(future)] = future.result()
+
+    return results
+
+# ========================================
+# CACHE ARTEFATTI (--prefetch / --offline)
+# ========================================
+
+def platform_tag():
+    """Sistema e architettura: wheel e pacchetti npm nativi non valgono su altre piattaforme"""
+    return f"{sys.platform}-{platform.machine().lower() or 'unknown'}"
+
+class ArtifactCache:
+    """Wheelhouse pip, cache npm e mirror git di VibeVoice in una cartella locale.
+
+    Le wheel sono separate per piattaforma, versione di Python e build di
+    PyTorch (`variant`: cu121, cu118 o cpu), la cache npm per
+    piattaforma. Con `offline` le installazioni usano solo la cache;
+    altrimenti la cache viene consultata prima della rete.
+    """
+
+    def __init__(self, root, variant=None, offline=False):
+        self.root = Path(root)
+        self.variant = variant
+        self.offline = offline
+
+    @property
+    def key(self):
+        return f"{platform_tag()}-py{sys.version_info.major}{sys.version_info.minor}-{self.variant}"
+
+    @property
+    def wheelhouse(self):
+        return self.root / "wheels" / self.key
+
+    @property
+    def npm_cache(self):
+        return self.root / "npm" / platform_tag()
+
+    @property
+    def mirror(self):
+        return self.root / "VibeVoice.git"
+
+    def pip_args(self):
+        if self.offline:
+            return f'--no-index --find-links "{self.wheelhouse}"'
+        if self.variant and self.wheelhouse.exists():
+            return f'--find-links "{self.wheelhouse}"'
+        return ""
+
+    def npm_args(self):
+        # Anche online npm scrive nella cache: ogni installazione la arricchisce
+        mode = "--offline" if self.offline else "--prefer-offline"
+        return f'{mode} --cache "{self.npm_cache}"'
+
+    def missing(self, need_wheels=False, need_npm=False, need_mirror=False):
+        """Parti della cache che un'installazione offline richiede ma che non esistono"""
+        wanted = [(need_wheels, self.wheelhouse), (need_npm, self.npm_cache), (need_mirror, self.mirror)]
+        return [path for needed, path in wanted if needed and not path.exists()]
+
+def npm_step(name, label, folder, cache=None):
+    """npm install in `folder`, rieseguito solo se il lockfile (o package.json) cambia"""
+    command = f"npm install {cache.npm_args()}" if cache else "npm install"
+    return SetupStep(
+        name, label,
+        action=lambda prefix: run_command(command, cwd=str(folder),
+                                          description=command, prefix=prefix)[0],
+        fingerprint=lambda: file_digest(folder / "package-lock.json") or file_digest(folder / "package.json"),
+        done=lambda: (folder / "node_modules").exists()
+    )
+
+def summarize_steps(steps, results):
+    outcome_emoji = {"done": "✅", "skipped": "⏭️", "failed": "❌", "blocked": "⛔"}
+    print("\n   " + "="*50)
+    for step in steps:
+        outcome, seconds = results[step.name]
+        print(f"   {outcome_emoji[outcome]} {step.label}" + (f" ({seconds:.0f}s)" if outcome == "done" else ""))
+    print("   " + "="*50)
+
+def npm_prefetch_step(name, label, folder, cache):
+    """Porta nella cache npm i pacchetti del lockfile di `folder`, senza toccarne node_modules"""
+    def action(prefix):
+        with tempfile.TemporaryDirectory() as tmp:
+            for manifest in ("package.json", "package-lock.json"):
+                if (folder / manifest).exists():
+                    shutil.copy(folder / manifest, tmp)
+            command = "npm ci" if (folder / "package-lock.json").exists() else "npm install"
+            return run_command(f'{command} --ignore-scripts --no-audit --no-fund --cache "{cache.npm_cache}"',
+                               cwd=tmp, description=f"Download pacchetti npm ({command})", prefix=prefix)[0]
+    return SetupStep(name, label, action)
+
+def prefetch(base_path, cache):
+    """Scarica nella cache tutto ciò che serve a un'installazione --offline su questa piattaforma"""
+    print_header("Prefetch artefatti Pepper Feel Good", "📦")
+    print(f"📍 Cache: {cache.root}")
+    print(f"🔑 Chiave wheel: {cache.key}\n")
+
+    cache.wheelhouse.mkdir(parents=True, exist_ok=True)
+    cache.npm_cache.mkdir(parents=True, exist_ok=True)
+    # Stesso interprete che crea il venv: le wheel scaricate hanno i tag giusti
+    pip_download = f'"{sys.executable}" -m pip download --dest "{cache.wheelhouse}"'
+    torch_index = TORCH_INDEX_URL.format(variant=cache.variant)
+
+    def fetch_mirror(prefix):
+        if cache.mirror.exists():
+            return run_command(f'git --git-dir "{cache.mirror}" remote update --prune',
+                               description="Aggiornamento mirror VibeVoice", prefix=prefix)[0]
+        return run_command(f'git clone --mirror {VIBEVOICE_REPO} "{cache.mirror}"',
+                           description="Mirror VibeVoice", prefix=prefix)[0]
+
+    def fetch_vibevoice_deps(prefix):
+        vv_root = base_path / "VibeVoice"
+        with tempfile.TemporaryDirectory() as tmp:
+            # Senza checkout locale le dipendenze si leggono da una copia temporanea del mirror
+            if not (vv_root / "setup.py").exists() and not (vv_root / "pyproject.toml").exists():
+                vv_root = Path(tmp) / "VibeVoice"
+                if not run_command(f'git clone "{cache.mirror}" "{vv_root}"', prefix=prefix)[0]:
+                    return False
+            return run_command(
+                f'{pip_download} --find-links "{cache.wheelhouse}" --extra-index-url {torch_index} "{vv_root}"',
+                description="Download dipendenze VibeVoice", prefix=prefix)[0]
+
+    steps = [
+        SetupStep("mirror", "Mirror git di VibeVoice", fetch_mirror),
+        SetupStep("pip", "pip, setuptools, wheel",
+                  lambda prefix: run_command(f"{pip_download} pip setuptools wheel", prefix=prefix)[0]),
+        # I 'pip download' scrivono tutti nella stessa wheelhouse (e possono scaricare le stesse
+        # dipendenze, es. setuptools): girano uno dopo l'altro, pip -> pytorch -> vibevoice
+        SetupStep("pytorch", f"PyTorch ({cache.variant})",
+                  lambda prefix: run_command(f"{pip_download} torch torchaudio --index-url {torch_index}",
+                                             description="Download PyTorch", prefix=prefix)[0],
+                  deps=["pip"]),
+        SetupStep("vibevoice", "Dipendenze VibeVoice", fetch_vibevoice_deps, deps=["mirror", "pip", "pytorch"]),
+    ]
+    for name, label, folder in (("backend", "Pacchetti npm del backend", base_path / "server"),
+                                ("frontend", "Pacchetti npm del frontend", base_path / "client")):
+        if (folder / "package.json").exists():
+            steps.append(npm_prefetch_step(name, label, folder, cache))
+
+    results = run_steps(steps, cache.root / SETUP_STATE_FILE)
+    summarize_steps(steps, results)
+
+    if all(outcome == "done" for outcome, _ in results.values()):
+        print(f"\n🎉 Cache pronta: installa con 'python setup.py --offline --torch-variant {cache.variant}'")
+        return True
+    print(f"\n⚠️ Prefetch incompleto: riesegui 'python setup.py --prefetch'")
+    return False
+
+# ========================================
+# OTTIMIZZAZIONE THREAD CPU
+# ========================================
+
+# Modello sostitutivo con pesi casuali, nessun download: 4 strati decoder delle dimensioni di
+# Qwen2.5-0.5B (base di VibeVoice-Realtime-0.5B), proiezioni nn.Linear come nel modello vero.
+# `time_model` misura un prompt di 128 token seguito da 16 passi da un token.
+STANDIN_MODEL_SCRIPT = """
+import io, sys, json, time, statistics, torch
+F = torch.nn.functional
+
+class Block(torch.nn.Module):
+    def __init__(self, d=896, ff=4864, heads=14):
+        super().__init__()
+        self.heads = heads
+        self.q, self.k, self.v, self.o = (torch.nn.Linear(d, d) for _ in range(4))
+        self.gate, self.up, self.down = torch.nn.Linear(d, ff), torch.nn.Linear(d, ff), torch.nn.Linear(ff, d)
+
+    def forward(self, x):
+        b, t, d = x.shape
+        q, k, v = (p(x).view(b, t, self.heads, -1).transpose(1, 2) for p in (self.q, self.k, self.v))
+        x = x + self.o(F.scaled_dot_product_attention(q, k, v, is_causal=True).transpose(1, 2).reshape(b, t, d))
+        return x + self.down(F.silu(self.gate(x)) * self.up(x))
+
+def make_standin(layers=4):
+    torch.manual_seed(0)
+    return torch.nn.Sequential(*(Block() for _ in range(layers))).eval()
+
+def time_model(model, rounds):
+    prompt, token = torch.randn(1, 128, 896), torch.randn(1, 1, 896)
+    times = []
+    with torch.inference_mode():
+        for i in range(rounds + 2):
+            t0 = time.perf_counter()
+            model(prompt)
+            for _ in range(16):
+                model(token)
+            if i >= 2:
+                times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000
+"""
+
+# Eseguito nel venv per ogni configurazione, in un processo separato: il pool inter-op di torch
+# si può dimensionare una sola volta per processo
+CPU_BENCHMARK_SCRIPT = STANDIN_MODEL_SCRIPT + """
+intra, inter, rounds = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])
+torch.set_num_interop_threads(inter)
+torch.set_num_threads(intra)
+print(json.dumps({"ms": time_model(make_standin(), rounds)}))
+"""
+
+# Quantizzazione dinamica int8 dei nn.Linear: confronto fp32/int8 sul modello sostitutivo
+# (memoria dei pesi e latenza), poi, se i pesi veri sono disponibili, il modello VibeVoice
+# quantizzato salvato intero con torch.save
+QUANTIZE_SCRIPT = STANDIN_MODEL_SCRIPT + """
+import os, importlib
+model_id, model_class, out_path = sys.argv[1], sys.argv[2], sys.argv[3]
+
+def weight_bytes(model):
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell()
+
+def quantize(model):
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+standin = make_standin()
+standin_int8 = quantize(make_standin())
+report = {"torch": torch.__version__, "standin": {
+    "fp32": {"bytes": weight_bytes(standin), "ms": time_model(standin, 5)},
+    "int8": {"bytes": weight_bytes(standin_int8), "ms": time_model(standin_int8, 5)}}}
+
+try:
+    module_name, class_name = model_class.split(":")
+    cls = getattr(importlib.import_module(module_name), class_name)
+    model = cls.from_pretrained(model_id, torch_dtype=torch.float32).eval()
+except Exception as e:
+    report["model"] = {"error": f"{type(e).__name__}: {e}"}
+else:
+    fp32_bytes = weight_bytes(model)
+    model = quantize(model)
+    torch.save(model, out_path + ".partial")
+    os.replace(out_path + ".partial", out_path)
+    report["model"] = {"fp32Bytes": fp32_bytes, "int8Bytes": weight_bytes(model)}
+print(json.dumps(report))
+"""
+
+def thread_candidates(cpu_count):
+    """Configurazioni (intra-op, inter-op) da provare: potenze di 2 fino ai core disponibili"""
+    intra = {cpu_count, max(cpu_count // 2, 1)}
+    n = 1
+    while n < cpu_count:
+        intra.add(n)
+        n *= 2
+    inter = [1, 2] if cpu_count > 1 else [1]
+    return [(i, j) for i in sorted(intra) for j in inter]
+
+def pick_thread_config(timings, tolerance=CPU_TUNING_TOLERANCE):
+    """Tra le configurazioni entro `tolerance` dalla più veloce, quella con meno thread"""
+    best = min(timings.values())
+    near = [config for config, ms in timings.items() if ms <= best * (1 + tolerance)]
+    return min(near, key=lambda config: (config[0] + config[1], timings[config]))
+
+def benchmark_cpu_threads(python_bin, rounds=5):
+    """{(intra, inter): ms} misurati con torch del venv; {} se torch non è utilizzabile"""
+    timings = {}
+    for intra, inter in thread_candidates(os.cpu_count() or 1):
+        try:
+            result = subprocess.run(
+                [str(python_bin), "-c", CPU_BENCHMARK_SCRIPT, str(intra), str(inter), str(rounds)],
+                capture_output=True,
+                text=True,
+                timeout=120
+            )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"   ⚠️ intra={intra} inter={inter}: {e}")
+            continue
+        if result.returncode != 0:
+            print(f"   ❌ intra={intra} inter={inter}: {result.stderr.strip().splitlines()[-1:] or 'errore'}")
+            continue
+        timings[(intra, inter)] = json.loads(result.stdout.strip().splitlines()[-1])["ms"]
+        print(f"   ⏱️ intra-op {intra:>2} · inter-op {inter}: {timings[(intra, inter)]:.1f} ms")
+    return timings
+
+def tune_cpu_threads(python_bin, venv_path, state_file, force=False):
+    """Thread di torch più veloci su questa macchina, come variabili del .env ({} se non misurabili).
+
+    Il risultato viene salvato nello stato del setup e riusato finché
+    il venv e il numero di core non cambiano.
+    """
+    fingerprint = f"{venv_marker(venv_path)}:{os.cpu_count()}"
+    state = load_setup_state(state_file)
+    recorded = state.get("cpu-tuning", {})
+    if not force and recorded.get("fingerprint") == fingerprint and recorded.get("result"):
+        print(f"   ⏭️ Già misurato: " + ", ".join(f"{k}={v}" for k, v in recorded["result"].items()))
+        return recorded["result"]
+
+    print(f"   🧪 Benchmark thread di torch su {os.cpu_count()} core (modello sostitutivo, nessun download)...")
+    timings = benchmark_cpu_threads(python_bin)
+    if not timings:
+        print(f"   ⚠️ Benchmark non riuscito: VibeVoice userà i thread di default")
+        return {}
+
+    intra, inter = pick_thread_config(timings)
+    default_ms = timings.get((os.cpu_count() or 1, 1))
+    print(f"   ✅ Migliore: intra-op {intra}, inter-op {inter} ({timings[(intra, inter)]:.1f} ms"
+          + (f", default {default_ms:.1f} ms)" if default_ms else ")"))
+
+    tuning = {"TORCH_NUM_THREADS": str(intra), "TORCH_NUM_INTEROP_THREADS": str(inter)}
+    record_step(state, state_file, "cpu-tuning", fingerprint, result=tuning)
+    return tuning
+
+# ========================================
+# MANIFEST DELL'AMBIENTE (verifiche in cache)
+# ========================================
+
+def binary_stamp(name):
+    """Percorso, dimensione e mtime dell'eseguibile `name` nel PATH (None se assente), senza avviarlo"""
+    path = shutil.which(name)
+    if not path:
+        return None
+    st = os.stat(path)
+    return {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def file_stamp(path):
+    if not path or not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return {"path": str(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def load_manifest(manifest_file):
+    """Manifest salvato, o uno vuoto se manca, è illeggibile o è di un altro interprete"""
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if manifest.get("python") != sys.executable or manifest.get("platform") != platform_tag():
+        manifest = {}
+    manifest.update({"python": sys.executable, "platform": platform_tag()})
+    manifest.setdefault("tools", {})
+    return manifest
+
+def save_manifest(manifest_file, manifest):
+    manifest["updatedAt"] = time.strftime('%Y-%m-%d %H:%M:%S')
+    write_json_atomic(manifest_file, manifest)
+
+def probe_tool(name):
+    """Esegue la verifica originale di uno strumento e ne ritorna il risultato da salvare"""
+    if name == "node":
+        return {"version": check_nodejs()}
+    if name == "git":
+        return {"version": check_git()}
+    if name == "nvidia-smi":
+        return {"gpu": check_nvidia_gpu()[1]}
+    if name == "nvcc":
+        return {"cuda": get_cuda_version()}
+    return {"reachable": check_mongodb()}
+
+def describe_tool(name, entry):
+    """Riga di riepilogo di uno strumento letto dal manifest"""
+    if name == "node":
+        return f"✅ Node.js installato: {entry['version']}" if entry.get("version") else "❌ Node.js NON installato!"
+    if name == "git":
+        return f"✅ Git installato: {entry['version']}" if entry.get("version") else "⚠️ Git NON installato!"
+    if name == "nvidia-smi":
+        return f"✅ GPU NVIDIA: {entry['gpu']}" if entry.get("gpu") else "ℹ️ Nessuna GPU NVIDIA rilevata"
+    if name == "nvcc":
+        return f"✅ CUDA Toolkit: {entry['cuda']}" if entry.get("cuda") else "ℹ️ CUDA Toolkit non trovato"
+    return "✅ MongoDB client presente" if entry.get("stamp") else "⚠️ MongoDB client non trovato"
+
+def resolve_tools(manifest, refresh=False):
+    """Strumenti del manifest, riverificati solo se l'eseguibile è cambiato (o con `refresh`)"""
+    tools = manifest["tools"]
+    for name in MANIFEST_TOOLS:
+        stamp = binary_stamp(name)
+        entry = tools.get(name)
+        if not refresh and entry is not None and entry.get("stamp") == stamp:
+            print(f"   {describe_tool(name, entry)} (manifest)")
+            continue
+        entry = {"stamp": stamp}
+        # Eseguibile assente: il risultato è già noto, niente processo da avviare
+        if stamp is not None or name in ("node", "git"):
+            entry.update(probe_tool(name))
+        else:
+            print(f"   {describe_tool(name, entry)}")
+        tools[name] = entry
+    return tools
+
+def resolve_torch(manifest, python_bin, refresh=False):
+    """Info su PyTorch nel venv: dal manifest se il pacchetto torch non è cambiato, altrimenti verificate"""
+    entry = manifest.get("torch") or {}
+    stamp = entry.get("stamp")
+    if (not refresh and entry.get("python") == str(python_bin) and stamp
+            and file_stamp(stamp["path"]) == stamp):
+        print(f"\n   ✅ PyTorch {entry['info'].get('PyTorch Version')} "
+              f"(CUDA: {entry['info'].get('CUDA Available')}) (manifest)")
+        return entry["info"]
+
+    info = verify_pytorch_installation(python_bin)
+    if info:
+        manifest["torch"] = {"python": str(python_bin), "stamp": file_stamp(info.get("Torch Path")), "info": info}
+    else:
+        manifest.pop("torch", None)
+    return info
+
+def vibevoice_complete(vv_root):
+    return all((Path(vv_root) / file).exists() for file in VIBEVOICE_REQUIRED_FILES)
+
+def manifest_paths(manifest):
+    """Percorsi VibeVoice/venv salvati, se esistono ancora (per repair_env_file)"""
+    paths = manifest.get("paths") or {}
+    if paths.get("vibevoice") and paths.get("python") and vibevoice_complete(paths["vibevoice"]) \
+            and Path(paths["python"]).exists():
+        return {"vv_root": Path(paths["vibevoice"]), "python_bin": Path(paths["python"]),
+                "venv_path": Path(paths["venv"])}
+    return {}
+
+def check_environment(base_path, refresh=False):
+    """--check: stato dell'ambiente dal manifest, senza installare nulla; ritorna True se completo"""
+    t0 = time.perf_counter()
+    print_header("Verifica ambiente Pepper Feel Good", "🩺")
+    manifest_file = base_path / MANIFEST_FILE
+    manifest = load_manifest(manifest_file)
+
+    tools = resolve_tools(manifest, refresh)
+    paths = manifest_paths(manifest)
+    vv_root = paths.get("vv_root", base_path / "VibeVoice")
+    vv_ok = vibevoice_complete(vv_root)
+    print(f"   {'✅' if vv_ok else '❌'} VibeVoice: {vv_root}")
+
+    python_bin = paths.get("python_bin")
+    if not python_bin:
+        # Setup precedente al manifest: venv nella posizione standard
+        default_python = vv_root / "env1" / ("Scripts/python.exe" if platform.system() == "Windows" else "bin/python")
+        python_bin = default_python if default_python.exists() else None
+    torch_info = None
+    if python_bin:
+        print(f"   ✅ Python venv: {python_bin}")
+        torch_info = resolve_torch(manifest, python_bin, refresh)
+    else:
+        print(f"   ❌ Python venv: NON CONFIGURATO (esegui python setup.py)")
+
+    save_manifest(manifest_file, manifest)
+    ok = bool(tools["node"].get("version")) and vv_ok and bool(torch_info)
+    print(f"\n{'🎉 Ambiente completo' if ok else '⚠️ Ambiente incompleto'} "
+          f"(verifica in {time.perf_counter() - t0:.2f}s)")
+    return ok
+
+def print_quantization_report(report):
+    fp32, int8 = report["standin"]["fp32"], report["standin"]["int8"]
+    print(f"   📊 Modello sostitutivo (4 strati Qwen2.5-0.5B):")
+    print(f"      • Pesi: {fp32['bytes'] / 1e6:.1f} MB → {int8['bytes'] / 1e6:.1f} MB "
+          f"({int8['bytes'] / fp32['bytes']:.0%})")
+    print(f"      • Latenza: {fp32['ms']:.1f} ms → {int8['ms']:.1f} ms ({fp32['ms'] / int8['ms']:.2f}x)")
+    model = report.get("model", {})
+    if "int8Bytes" in model:
+        print(f"   📊 {report['source']}: pesi {model['fp32Bytes'] / 1e6:.0f} MB → {model['int8Bytes'] / 1e6:.0f} MB")
+
+def prepare_quantized_model(python_bin, vv_root, venv_path, state_file, force=False, offline=False):
+    """Prepara (una volta) il modello int8 accanto al checkout di VibeVoice.
+
+    Ritorna le variabili del .env che lo attivano ({} se i pesi veri non
+    sono disponibili: in quel caso resta solo la misura sul modello
+    sostitutivo).
+    """
+    out_dir = vv_root.parent / QUANTIZED_DIRNAME
+    model_path = out_dir / QUANTIZED_MODEL_FILE
+    report_path = out_dir / QUANTIZED_REPORT_FILE
+    fingerprint = f"{venv_marker(venv_path)}:{VIBEVOICE_MODEL_ID}"
+    state = load_setup_state(state_file)
+    if not force and state.get("quantize", {}).get("fingerprint") == fingerprint and model_path.exists():
+        print(f"   ⏭️ Modello int8 già pronto: {model_path}")
+        return {"VIBEVOICE_QUANTIZED_MODEL": str(model_path)}
+
+    print(f"   🗜️ Quantizzazione int8 di {VIBEVOICE_MODEL_ID} (può richiedere alcuni minuti)...")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    env = dict(os.environ, HF_HUB_OFFLINE="1") if offline else None
+    try:
+        result = subprocess.run(
+            [str(python_bin), "-c", QUANTIZE_SCRIPT, VIBEVOICE_MODEL_ID, VIBEVOICE_MODEL_CLASS, str(model_path)],
+            capture_output=True,
+            text=True,
+            timeout=1800,
+            env=env
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"   ❌ Errore: {e}")
+        return {}
+    if result.returncode != 0:
+        print(f"   ❌ Errore quantizzazione: {result.stderr.strip().splitlines()[-1:] or result.returncode}")
+        return {}
+
+    report = dict(json.loads(result.stdout.strip().splitlines()[-1]), source=VIBEVOICE_MODEL_ID,
+                  modelFile=QUANTIZED_MODEL_FILE, createdAt=time.strftime('%Y-%m-%d %H:%M:%S'))
+    print_quantization_report(report)
+    if "error" in report["model"]:
+        print(f"   ⚠️ Pesi di {VIBEVOICE_MODEL_ID} non disponibili ({report['model']['error']})")
+        print(f"   ⏭️ VibeVoice userà il modello a precisione piena")
+        return {}
+
+    write_json_atomic(report_path, report)
+    record_step(state, state_file, "quantize", fingerprint)
+    print(f"   ✅ Modello int8 salvato: {model_path}")
+    return {"VIBEVOICE_QUANTIZED_MODEL": str(model_path)}
+
+def setup(force=False, offline=False, cache_dir=None, torch_variant=None, refresh=False):
     base_path = Path(__file__).parent.absolute()
-    total_steps = 10
+    total_steps = 6
     
     print_header("Setup Pepper Feel Good", "🌈")
     print(f"📍 Percorso progetto: {base_path}\n")
     
     # STEP 0: Prerequisiti
     print_step(0, total_steps, "Verifica Prerequisiti")
-    
-    if not check_nodejs():
+
+    manifest_file = base_path / MANIFEST_FILE
+    manifest = load_manifest(manifest_file)
+    if refresh:
+        print(f"   🔄 --refresh: tutte le verifiche vengono ripetute")
+    tools = resolve_tools(manifest, refresh)
+    save_manifest(manifest_file, manifest)
+
+    if not tools["node"].get("version"):
         print("\n⛔ ERRORE CRITICO: Installa Node.js prima di continuare!")
         input("Premi INVIO per uscire...")
         sys.exit(1)
@@ -620,44 +1401,26 @@ def setup():
         if choice != 's':
             sys.exit(1)
     
-    has_git = check_git()
-    check_mongodb()
-    
-    # STEP 1: NODE.JS BACKEND
-    print_step(1, total_steps, "Installazione Backend (Node.js)")
+    has_git = bool(tools["git"].get("version"))
+
+    cache = ArtifactCache(cache_dir or base_path / DEFAULT_CACHE_DIR, offline=offline)
+    if offline:
+        print(f"\n   📴 Modalità offline: installazione solo dalla cache {cache.root}")
     
+    # STEP 1: VERIFICA VIBEVOICE E HARDWARE
+    # Tutte le domande vengono fatte qui, prima che i passi partano in parallelo
+    print_step(1, total_steps, "Verifica VibeVoice e Hardware (GPU)")
+
     server_path = base_path / "server"
-    if server_path.exists():
-        success, _ = run_command(
-            "npm install", 
-            cwd=str(server_path),
-            description="Installazione moduli npm per il backend"
-        )
-        if not success:
-            print("   ⚠️ Alcuni moduli potrebbero non essersi installati correttamente")
-    else:
-        print(f"   ⚠️ Cartella 'server' non trovata!")
-    
-    # STEP 2: NODE.JS FRONTEND
-    print_step(2, total_steps, "Installazione Frontend (React)")
-    
     client_path = base_path / "client"
-    if client_path.exists():
-        success, _ = run_command(
-            "npm install",
-            cwd=str(client_path),
-            description="Installazione moduli npm per il frontend"
-        )
-        if not success:
-            print("   ⚠️ Alcuni moduli potrebbero non essersi installati correttamente")
-    else:
+    if not server_path.exists():
+        print(f"   ⚠️ Cartella 'server' non trovata!")
+    if not client_path.exists():
         print(f"   ⚠️ Cartella 'client' non trovata!")
 
-    # STEP 3: VERIFICA/CLONA VIBEVOICE
-    print_step(3, total_steps, "Verifica/Installazione VibeVoice")
-    
     vv_exists, vv_root = check_vibevoice(base_path)
-    
+    clone_needed = False
+
     if not vv_exists:
         if not has_git:
             print("\n   ⛔ Git non installato! Impossibile clonare VibeVoice automaticamente")
@@ -670,14 +1433,10 @@ def setup():
         else:
             print(f"\n   VibeVoice non trovato. Vuoi clonarlo ora?")
             clone_choice = input("   ❓ Clonare VibeVoice da GitHub? (S/n): ").strip().lower()
-            
+
             if clone_choice != 'n':
-                if clone_vibevoice(base_path):
-                    print(f"   ✅ VibeVoice clonato con successo!")
-                    vv_installed = True
-                else:
-                    print(f"   ❌ Errore durante la clonazione")
-                    vv_installed = False
+                clone_needed = True
+                vv_installed = True
             else:
                 print(f"   ⏭️ Salto installazione VibeVoice")
                 vv_installed = False
@@ -685,29 +1444,17 @@ def setup():
         vv_installed = True
         print(f"   ✅ VibeVoice già installato")
 
-    # STEP 4: RILEVAMENTO GPU
-    print_step(4, total_steps, "Rilevamento Hardware (GPU)")
-    
-    has_nvidia_gpu, gpu_name = check_nvidia_gpu()
-    cuda_version = get_cuda_version() if has_nvidia_gpu else None
+    gpu_name = tools["nvidia-smi"].get("gpu")
+    has_nvidia_gpu = bool(gpu_name)
+    cuda_version = tools["nvcc"].get("cuda") if has_nvidia_gpu else None
+    print(f"\n   {describe_tool('nvidia-smi', tools['nvidia-smi'])}")
 
-    # STEP 5: PYTHON VENV
-    print_step(5, total_steps, "Configurazione Ambiente Python (IA)")
-    
     venv_path = vv_root / "env1"
-    
+
     if vv_installed:
-        # Crea VENV se non esiste
-        if not venv_path.exists():
-            print(f"   🐍 Creazione Virtual Environment Python...")
-            success, _ = run_command(
-                f'"{sys.executable}" -m venv env1',
-                cwd=str(vv_root),
-                description="Creazione venv 'env1'"
-            )
-        else:
-            print(f"   ✅ Virtual Environment già presente")
-        
+        torch_variant = torch_variant or choose_torch_variant(has_nvidia_gpu, cuda_version)
+        cache.variant = torch_variant
+
         # Determina i path in base al sistema operativo
         if platform.system() == "Windows":
             pip_path = venv_path / "Scripts" / "pip.exe"
@@ -718,54 +1465,108 @@ def setup():
             python_bin = venv_path / "bin" / "python"
             activate_cmd = f"source {venv_path / 'bin' / 'activate'}"
 
-        # STEP 6: PYTORCH INSTALLATION
-        print_step(6, total_steps, "Installazione PyTorch (AI Engine)")
-        
-        if pip_path.exists():
-            # Upgrade pip
-            run_command(
-                f'"{pip_path}" install --upgrade pip',
-                description="Aggiornamento pip"
-            )
-            
-            # Installa PyTorch con rilevamento GPU
-            pytorch_success = install_pytorch(pip_path, has_nvidia_gpu, cuda_version)
-            
-            if pytorch_success:
-                # Verifica installazione
-                verify_pytorch_installation(python_bin)
-            else:
-                print(f"   ⚠️ Problemi con l'installazione di PyTorch")
-                vv_installed = False
-        else:
-            print(f"   ❌ pip non trovato in {pip_path}")
-            vv_installed = False
+    if offline:
+        missing = cache.missing(need_wheels=vv_installed,
+                                need_npm=server_path.exists() or client_path.exists(),
+                                need_mirror=clone_needed)
+        if missing:
+            print(f"\n   ⛔ Cache incompleta per {cache.key}:")
+            for path in missing:
+                print(f"      • {path}")
+            print(f"   💡 Esegui prima (con rete): python setup.py --prefetch"
+                  + (f" --torch-variant {torch_variant}" if vv_installed else ""))
+            sys.exit(1)
 
-        # STEP 7: VIBEVOICE INSTALLATION
-        print_step(7, total_steps, "Installazione VibeVoice")
-        
-        if pip_path.exists() and vv_root.exists():
-            # Installa VibeVoice
-            success, _ = run_command(
-                f'"{pip_path}" install -e .',
-                cwd=str(vv_root),
-                description="Installazione VibeVoice (modalità editable)",
-                show_output=True
-            )
-            
-            if success:
-                print(f"   ✅ VibeVoice configurato correttamente")
-            else:
-                print(f"   ⚠️ Problemi con l'installazione di VibeVoice")
+    # STEP 2: INSTALLAZIONE IN PARALLELO
+    print_step(2, total_steps, "Installazione Dipendenze (in parallelo)")
+
+    steps = []
+    if server_path.exists():
+        steps.append(npm_step("backend", "Moduli npm del backend", server_path, cache))
+    if client_path.exists():
+        steps.append(npm_step("frontend", "Moduli npm del frontend", client_path, cache))
+
+    if vv_installed:
+        # Il venv vive dentro la cartella VibeVoice: git clone vuole una destinazione vuota
+        if clone_needed:
+            steps.append(SetupStep(
+                "clone", "Clonazione VibeVoice",
+                action=lambda prefix: clone_vibevoice(base_path, prefix,
+                                                      source=str(cache.mirror) if offline else None),
+                done=lambda: check_vibevoice(base_path)[0]
+            ))
+
+        def install_torch(prefix):
+            run_command(f'"{pip_path}" install --upgrade pip {cache.pip_args()}', description="Aggiornamento pip",
+                        prefix=prefix)
+            return install_pytorch(pip_path, has_nvidia_gpu, cuda_version, variant=torch_variant, prefix=prefix,
+                                   cache=cache)
+
+        steps += [
+            SetupStep(
+                "venv", "Virtual Environment Python 'env1'",
+                action=lambda prefix: python_bin.exists() or run_command(
+                    f'"{sys.executable}" -m venv env1', cwd=str(vv_root),
+                    description="Creazione venv 'env1'", prefix=prefix)[0],
+                deps=["clone"] if clone_needed else [],
+                fingerprint=lambda: venv_marker(venv_path),
+                done=python_bin.exists
+            ),
+            SetupStep(
+                "pytorch", f"PyTorch ({torch_variant})", install_torch,
+                deps=["venv"],
+                fingerprint=lambda: venv_marker(venv_path) and f"{torch_variant}:{venv_marker(venv_path)}",
+                done=python_bin.exists
+            ),
+            SetupStep(
+                "vibevoice", "VibeVoice (modalità editable)",
+                action=lambda prefix: run_command(
+                    f'"{pip_path}" install -e . {cache.pip_args()}', cwd=str(vv_root),
+                    description="pip install -e .", prefix=prefix)[0],
+                deps=["pytorch"],
+                fingerprint=lambda: venv_marker(venv_path) and
+                    f"{file_digest(vv_root / 'setup.py', vv_root / 'pyproject.toml')}:{venv_marker(venv_path)}",
+                done=python_bin.exists
+            ),
+        ]
+
+    if force:
+        print(f"   🔁 --force: le impronte salvate vengono ignorate")
+    results = run_steps(steps, base_path / SETUP_STATE_FILE, force)
+
+    summarize_steps(steps, results)
+
+    if any(outcome in ("failed", "blocked") for outcome, _ in results.values()):
+        print(f"   💡 Riesegui 'python setup.py': i passi già completati verranno saltati")
+
+    if vv_installed:
+        if all(results[name][0] in ("done", "skipped") for name in ("venv", "pytorch", "vibevoice")):
+            print(f"   ✅ VibeVoice configurato correttamente")
+            manifest["paths"] = {"vibevoice": str(vv_root), "venv": str(venv_path), "python": str(python_bin)}
+            if not resolve_torch(manifest, python_bin, refresh):
                 vv_installed = False
+            save_manifest(manifest_file, manifest)
         else:
-            print(f"   ❌ Path non validi per l'installazione VibeVoice")
+            print(f"   ⚠️ Problemi con l'installazione di PyTorch/VibeVoice")
             vv_installed = False
     else:
         print(f"   ⏭️ Salto configurazione Python (VibeVoice non installato)")
 
-    # STEP 8: CARTELLE
-    print_step(8, total_steps, "Creazione Struttura Cartelle")
+    # STEP 3: OTTIMIZZAZIONE CPU
+    print_step(3, total_steps, "Ottimizzazione CPU (thread e modello int8)")
+
+    tuning = None
+    if vv_installed and not has_nvidia_gpu:
+        tuning = tune_cpu_threads(python_bin, venv_path, base_path / SETUP_STATE_FILE, force)
+        tuning.update(prepare_quantized_model(python_bin, vv_root, venv_path, base_path / SETUP_STATE_FILE,
+                                              force, offline))
+    elif has_nvidia_gpu:
+        print(f"   ⏭️ GPU NVIDIA presente: non necessaria")
+    else:
+        print(f"   ⏭️ Salto (VibeVoice non installato)")
+
+    # STEP 4: CARTELLE
+    print_step(4, total_steps, "Creazione Struttura Cartelle")
     
     folders = [
         server_path / "uploads",
@@ -780,8 +1581,8 @@ def setup():
         else:
             print(f"   ✅ Già presente: {folder.name}")
 
-    # STEP 9: FILE .ENV
-    print_step(9, total_steps, "Configurazione File .env")
+    # STEP 5: FILE .ENV
+    print_step(5, total_steps, "Configurazione File .env")
     
     env_file = server_path / ".env"
     
@@ -792,10 +1593,11 @@ def setup():
             base_path, 
             vv_root=vv_root,
             python_bin=python_bin,
-            venv_path=venv_path
+            venv_path=venv_path,
+            tuning=tuning
         )
     else:
-        repair_result = repair_env_file(env_file, base_path)
+        repair_result = repair_env_file(env_file, base_path, **manifest_paths(manifest))
     
     # Se il repair non è stato fatto o ha fallito, crea da zero
     if not repair_result and not env_file.exists():
@@ -866,14 +1668,20 @@ SENDER_EMAIL={email_user}
 BACKEND_URL=http://localhost:{backend_port}
 FRONTEND_URL=http://localhost:{frontend_port}
 """
+        if vv_installed and 'python_bin' in locals():
+            env_content += f"\n{VIBEVOICE_PATHS_SECTION}\n" + \
+                f"VIBEVOICE_PATH={vv_abs_path}\nPYTHON_VENV_PATH={python_abs_path}\n"
+        if tuning:
+            env_content += f"\n{CPU_TUNING_SECTION}\n" + \
+                "\n".join(f"{key}={value}" for key, value in tuning.items()) + "\n"
         
         with open(env_file, "w", encoding="utf-8") as f:
             f.write(env_content)
         
         print(f"\n   ✅ File .env creato: {env_file}")
         
-    # STEP 10: VERIFICA INSTALLAZIONE
-    print_step(10, total_steps, "Verifica Installazione Finale")
+    # STEP 6: VERIFICA INSTALLAZIONE
+    print_step(6, total_steps, "Verifica Installazione Finale")
     
     checks = {
         "Backend npm modules": (server_path / "node_modules").exists(),
@@ -970,9 +1778,41 @@ FRONTEND_URL=http://localhost:{frontend_port}
         print("💡 Suggerimento: Controlla i messaggi di errore sopra")
         print("   e risolvi i problemi prima di avviare l'applicazione.\n")
 
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Setup di Pepper Feel Good (dipendenze, VibeVoice, .env)")
+    parser.add_argument("--force", action="store_true",
+                        help=f"Riesegue tutti i passi ignorando le impronte salvate in {SETUP_STATE_FILE}")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--prefetch", action="store_true",
+                      help="Scarica nella cache wheel pip, pacchetti npm e mirror di VibeVoice, senza installare")
+    mode.add_argument("--offline", action="store_true", help="Installa solo dalla cache (nessun accesso alla rete)")
+    mode.add_argument("--check", action="store_true",
+                      help=f"Mostra lo stato dell'ambiente dal manifest ({MANIFEST_FILE}) senza installare nulla")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ripete tutte le verifiche (versioni, GPU, PyTorch) invece di usare il manifest")
+    parser.add_argument("--cache-dir", type=Path, help=f"Cartella della cache (default {DEFAULT_CACHE_DIR}/ nel progetto)")
+    parser.add_argument("--torch-variant", choices=TORCH_VARIANTS,
+                        help="Build di PyTorch da usare/scaricare (default: rilevata da GPU e CUDA)")
+    return parser
+
 if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
     try:
-        setup()
+        base_path = Path(__file__).parent.absolute()
+        if args.check:
+            sys.exit(0 if check_environment(base_path, args.refresh) else 1)
+        if args.prefetch:
+            variant = args.torch_variant
+            if not variant:
+                manifest = load_manifest(base_path / MANIFEST_FILE)
+                tools = resolve_tools(manifest, args.refresh)
+                save_manifest(base_path / MANIFEST_FILE, manifest)
+                gpu = tools["nvidia-smi"].get("gpu")
+                variant = choose_torch_variant(bool(gpu), tools["nvcc"].get("cuda") if gpu else None)
+            cache = ArtifactCache(args.cache_dir or base_path / DEFAULT_CACHE_DIR, variant)
+            sys.exit(0 if prefetch(base_path, cache) else 1)
+        setup(force=args.force, offline=args.offline, cache_dir=args.cache_dir, torch_variant=args.torch_variant,
+              refresh=args.refresh)
     except KeyboardInterrupt:
         print("\n\n⛔ Setup interrotto dall'utente")
         sys.exit(0)